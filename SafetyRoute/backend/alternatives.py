@@ -0,0 +1,238 @@
+# file: alternatives.py
+"""
+Đường thay thế kiểu via-node / plateau (Abraham, Delling, Goldberg, Werneck - "Alternative Routes in Road Networks").
+
+Cách cũ: tìm đường -> nhân trọng số các cạnh vừa đi lên x3 -> tìm lại (3 lần tìm đầy đủ), chống trùng
+chỉ bằng số node + node giữa. Cách này:
+    1. CHỈ 1 lần tìm 2 chiều (graph_engine.bidirectional_search) nhưng dừng muộn hơn một chút
+       (stretch) để cây xuôi và cây ngược phủ cả các node "đi vòng" gần tối ưu.
+    2. Mỗi node v có trong cả 2 cây cho 1 đường s -> v -> t (via path) với chi phí d_f(v) + d_b(v).
+       Các node cùng nằm trên 1 "plateau" (đoạn mà 2 cây đi trùng nhau) cho CÙNG 1 đường
+       -> gom theo plateau, plateau dài = đường tự nhiên (không phải đi vòng vào rồi quay ra).
+    3. Một via path được nhận khi:
+         - chi phí <= (1 + ALT_MAX_STRETCH) * tốt nhất
+         - phần chung với các đường đã chọn <= ALT_MAX_OVERLAP * tốt nhất
+         - tối ưu cục bộ (T-test): đoạn con quanh plateau dài ALT_LOCAL_OPT * tốt nhất mỗi phía
+           phải là đường ngắn nhất (1 lần tìm 2 chiều NGẮN, cục bộ)
+         - không tự cắt (không lặp node)
+"""
+import os
+
+import graph_engine
+
+INF = graph_engine.INF
+
+# k: số đường thay thế tối đa (ngoài đường tốt nhất)
+ALT_MAX_ROUTES = int(os.getenv("ALT_MAX_ROUTES", "2"))
+
+# ε: đường thay thế dài hơn đường tốt nhất tối đa 25%
+ALT_MAX_STRETCH = float(os.getenv("ALT_MAX_STRETCH", "0.25"))
+
+# γ: tổng chi phí phần chung với các đường đã chọn <= 80% chi phí đường tốt nhất
+ALT_MAX_OVERLAP = float(os.getenv("ALT_MAX_OVERLAP", "0.8"))
+
+# α: đoạn con dài ALT_LOCAL_OPT * chi phí tốt nhất quanh via node phải là đường ngắn nhất
+ALT_LOCAL_OPT = float(os.getenv("ALT_LOCAL_OPT", "0.25"))
+
+# Nới T-test: đoạn x -> y được dài hơn đường ngắn nhất tối đa 10% (đường phố nhiều ngả gần bằng nhau)
+ALT_LOCAL_SLACK = float(os.getenv("ALT_LOCAL_SLACK", "0.1"))
+
+# Số ứng viên tối đa được chạy T-test (mỗi lần là 1 lần tìm cục bộ)
+ALT_MAX_CANDIDATES = 8
+
+# Sai số so sánh chi phí (cộng dồn float)
+COST_TOL = 1e-9
+
+
+def _plateaus(graph, trees, limit):
+    """
+    Gom các node có mặt trong cả 2 cây (chi phí via <= limit) theo plateau.
+    Cạnh e = u->x thuộc plateau nếu pred_f[x] == e và succ_b[u] == e (2 cây cùng đi qua e).
+    Output: list (cost, plateau_cost, start, end) - mỗi plateau là 1 via path riêng.
+    """
+    offsets, targets = graph.adjacency()
+    sources = graph.reverse_adjacency()[2]
+    pred_f, succ_b = trees.pred_f, trees.succ_b
+    dist_f, dist_b = trees.dist_f, trees.dist_b
+
+    seen = set()
+    result = []
+    for v in trees.done_f & trees.done_b:
+        if v in seen:
+            continue
+        cost = dist_f[v] + dist_b[v]
+        if cost > limit:
+            continue
+        # Lùi về đầu plateau
+        start = v
+        while True:
+            e = pred_f[start]
+            if e == -1 or succ_b.get(sources[e]) != e:
+                break
+            start = sources[e]
+        # Tiến tới cuối plateau, đánh dấu mọi node trên đó
+        end = start
+        seen.add(end)
+        while True:
+            e = succ_b[end]
+            if e == -1 or pred_f.get(targets[e]) != e:
+                break
+            end = targets[e]
+            seen.add(end)
+        result.append((cost, dist_f[end] - dist_f[start], start, end))
+    return result
+
+
+def _tree_sharing(parent, step, w, used):
+    """
+    Phần chi phí nằm trên các cạnh `used` của đường cây từ gốc tới node v (có nhớ, tính dần theo cây).
+    parent: cạnh cha của node (-1 ở gốc), step: cạnh -> node cha.
+    """
+    memo = {}
+
+    def shared(v):
+        chain = []
+        while v not in memo:
+            e = parent[v]
+            if e == -1:
+                memo[v] = 0.0
+                break
+            chain.append((v, e))
+            v = step[e]
+        acc = memo[v]
+        for u, e in reversed(chain):
+            if e in used:
+                acc += w[e]
+            memo[u] = acc
+        return acc
+    return shared
+
+
+def _local_optimal(graph, weights, nodes, cum, a, b, t_len, slack, speed_mps):
+    """
+    T-test: lấy x cách đầu plateau (nodes[a]) >= t_len về phía source, y cách cuối plateau (nodes[b])
+    >= t_len về phía target; đoạn x -> y trên via path không được dài hơn (1 + slack) lần khoảng cách
+    ngắn nhất x -> y (slack = 0: đúng định nghĩa tối ưu cục bộ).
+    Output: (đạt?, số node đã chốt).
+    """
+    i = a
+    while i > 0 and cum[a] - cum[i] < t_len:
+        i -= 1
+    j = b
+    while j < len(nodes) - 1 and cum[j] - cum[b] < t_len:
+        j += 1
+    if i == j:
+        return True, 0
+    res = graph_engine.bidirectional_astar(graph, nodes[i], nodes[j], weights, speed_mps)
+    if res is None:
+        return False, 0
+    return cum[j] - cum[i] <= res.cost * (1 + slack) * (1 + COST_TOL) + COST_TOL, res.settled
+
+
+def alternative_routes(graph, source, target, weights, k=ALT_MAX_ROUTES, speed_mps=None, bounds=None,
+                       max_stretch=ALT_MAX_STRETCH, max_overlap=ALT_MAX_OVERLAP, local_opt=ALT_LOCAL_OPT,
+                       local_slack=ALT_LOCAL_SLACK):
+    """
+    Đường tốt nhất + tối đa k đường thay thế từ 1 lần tìm 2 chiều.
+    Input giống graph_engine.bidirectional_astar (source/target có thể là dict node ảo,
+    speed_mps / bounds: cận A* - None cả 2 thì là Dijkstra 2 chiều).
+    Output: list SearchResult [tốt nhất, thay thế 1, ...] (rỗng nếu không có đường),
+            settled của mọi phần tử = tổng công sức (2 cây + các T-test).
+    """
+    trees = graph_engine.bidirectional_search(graph, source, target, weights, speed_mps, bounds, stretch=max_stretch)
+    if trees.meet is None:
+        return []
+    w = graph_engine.weight_lists(weights)[0]
+    mu = trees.mu
+    settled = len(trees.done_f) + len(trees.done_b)
+
+    best_nodes, best_edges = graph_engine.via_path(graph, trees, trees.meet)
+    routes = [(best_nodes, best_edges, mu)]
+    used = set(best_edges)
+
+    # Ưu tiên via path ngắn + plateau dài (2 * chi phí - plateau nhỏ)
+    candidates = sorted(_plateaus(graph, trees, mu * (1 + max_stretch) * (1 + COST_TOL)),
+                        key=lambda c: 2 * c[0] - c[1])
+    sources, targets = graph.reverse_adjacency()[2], graph.adjacency()[1]
+    shared_f = shared_b = None
+    tested = 0
+    for cost, _, start, end in candidates:
+        if len(routes) > k or tested >= ALT_MAX_CANDIDATES:
+            break
+        if shared_f is None:
+            # Tập cạnh đã dùng vừa đổi -> tính lại phần chung theo 2 cây
+            shared_f = _tree_sharing(trees.pred_f, sources, w, used)
+            shared_b = _tree_sharing(trees.succ_b, targets, w, used)
+        # Phần chung = nửa xuôi (s -> start) + plateau + nửa ngược (end -> t), không cần dựng đường
+        if shared_f(end) + shared_b(end) > max_overlap * mu:
+            continue   # gần trùng đường đã chọn (kể cả chính đường tốt nhất)
+        nodes, edges = graph_engine.via_path(graph, trees, start)
+        if len(set(nodes)) != len(nodes):
+            continue   # đi vào rồi quay ra (lặp node)
+
+        cum = [0.0]
+        for e in edges:
+            cum.append(cum[-1] + w[e])
+        a = nodes.index(start)
+        b = nodes.index(end)
+        tested += 1
+        ok, cost_test = _local_optimal(graph, weights, nodes, cum, a, b, local_opt * mu, local_slack, speed_mps)
+        settled += cost_test
+        if not ok:
+            continue
+        routes.append((nodes, edges, cost))
+        used.update(edges)
+        shared_f = None
+
+    return [graph_engine.SearchResult(nodes, edges, cost, settled) for nodes, edges, cost in routes]
+
+
+if __name__ == '__main__':
+    # Kiểm tra đường thay thế: python alternatives.py [file.graphml]
+    import sys
+    import time
+
+    import numpy as np
+
+    import benchmark
+    import landmarks
+    import standardization
+
+    g = benchmark.load_bench_graph(sys.argv[1] if len(sys.argv) > 1 else 'hcm_map_drive.graphml')
+    base = standardization.base_speed_array(g)
+    rng = np.random.default_rng(0)
+    weights = landmarks.free_flow_weights(g, base) * (1 + np.where(rng.random(g.num_edges) < 0.2, rng.uniform(0, 3, g.num_edges), 0.0))
+    speed_mps = max(landmarks.MIN_SPEED_KMH, float(base.max())) / 3.6
+
+    ok, found, t_via, t_pen, settled = True, 0, 0.0, 0.0, 0
+    pairs = rng.integers(0, g.num_nodes, (200, 2)).tolist()
+    for s, t in pairs:
+        ref = graph_engine.shortest_path(g, s, t, weights)
+        t0 = time.perf_counter()
+        routes = alternative_routes(g, s, t, weights, speed_mps=speed_mps)
+        t_via += time.perf_counter() - t0
+        # Cách cũ: 3 lần tìm, phạt x3 giữa các lần
+        t0 = time.perf_counter()
+        w_pen = weights.copy()
+        for _ in range(3):
+            res = graph_engine.shortest_path(g, s, t, w_pen)
+            if res is None:
+                break
+            graph_engine.penalize_path(g, w_pen, res.edges, 3.0)
+        t_pen += time.perf_counter() - t0
+        if (ref is None) != (not routes):
+            ok = False
+        elif ref is not None:
+            ok = ok and abs(ref.cost - routes[0].cost) <= 1e-6 * max(1.0, ref.cost)
+            for r in routes[1:]:
+                # Đường thay thế phải liền mạch, đúng chi phí và trong giới hạn stretch
+                ok = ok and all(g.adjacency()[1][e] == v for e, v in zip(r.edges, r.nodes[1:]))
+                ok = ok and abs(sum(weights[r.edges]) - r.cost) <= 1e-6 * max(1.0, r.cost)
+                ok = ok and r.cost <= ref.cost * (1 + ALT_MAX_STRETCH) + 1e-6
+            found += len(routes) - 1
+            settled += routes[0].settled
+    n = len(pairs)
+    print(f"🔀 Đường thay thế: {n} cặp | via-node {t_via / n * 1000:.2f} ms, chốt {settled // n},"
+          f" {found / n:.2f} đường phụ/cặp | phạt x3 (3 lần tìm) {t_pen / n * 1000:.2f} ms | hợp lệ: {ok}")
+    if not ok:
+        sys.exit(1)
@@ -1,6 +1,5 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import json
 import os
 import sys
 
@@ -9,9 +8,22 @@ import core_logic      # Xử lý tìm đường
 import chatbot         # AI Chatbot
 import weather         # Module thời tiết (đã có set_demo_mode)
 import disasters       # Module thiên tai (đã có set_demo_mode)
+import hazard_store    # Kho dữ liệu môi trường (thread nền)
+import response_cache  # ETag + nén gzip/brotli cho API chỉ-đọc
+import tiles           # Tile z/x/y cho lớp môi trường + heatmap rủi ro
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag'])
+
+# Thread nền làm mới dữ liệu môi trường chạy cùng server (không chạy khi chỉ import core_logic)
+core_logic.start_hazard_store()
+
+# Phản hồi /api/map-data đã dựng sẵn, khóa theo (dữ liệu các lớp, bbox)
+MAP_DATA_CACHE = response_cache.ResponseCache()
+MAP_DATA_MAX_AGE_S = int(os.getenv("MAP_DATA_MAX_AGE_S", "30"))
+
+# Số chuyến tối đa của 1 request /api/find-routes/batch
+BATCH_MAX_TRIPS = int(os.getenv("BATCH_MAX_TRIPS", "200"))
 
 # ==========================================
 # 1. HEALTH CHECK
@@ -52,13 +64,119 @@ def find_routes_api():
         print(f"🔥 Lỗi Server (Find Route): {e}", file=sys.stderr)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/find-routes/reweight', methods=['POST'])
+def reweight_routes_api():
+    """Kéo thanh trượt ưu tiên: tìm lại trên phiên đã có (token 'session' của /api/find-routes)."""
+    try:
+        data = request.json or {}
+        token = data.get('session')
+        user_prefs = data.get('preferences', {})
+        if not token:
+            return jsonify({"status": "error", "message": "Thiếu session"}), 400
+
+        result = core_logic.reweight_routes(token, preferences=user_prefs)
+        if result is None:
+            # Frontend gọi lại /api/find-routes đầy đủ
+            return jsonify({"status": "error", "message": "Phiên tìm đường đã hết hạn, vui lòng tìm lại."}), 404
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"🔥 Lỗi Server (Reweight): {e}", file=sys.stderr)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/find-routes/batch', methods=['POST'])
+def batch_routes_api():
+    """Nhiều chuyến đi 1 lần: {trips: [{start, end}, ...], mode, preferences}. Lỗi của từng chuyến nằm trong results."""
+    try:
+        data = request.json or {}
+        trips = data.get('trips')
+        vehicle_mode = data.get('mode', 'motorbike')
+        user_prefs = data.get('preferences', {})
+
+        if not isinstance(trips, list) or not trips:
+            return jsonify({"status": "error", "message": "Thiếu danh sách trips"}), 400
+        if len(trips) > BATCH_MAX_TRIPS:
+            return jsonify({"status": "error", "message": f"Tối đa {BATCH_MAX_TRIPS} chuyến mỗi lần"}), 400
+
+        print(f"📩 [API] Tìm đường theo lô ({vehicle_mode}): {len(trips)} chuyến")
+        result = core_logic.get_optimal_routes_batch(trips, vehicle_mode=vehicle_mode, preferences=user_prefs)
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"🔥 Lỗi Server (Batch): {e}", file=sys.stderr)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/travel-matrix', methods=['POST'])
+def travel_matrix_api():
+    """
+    Ma trận thời gian đi + rủi ro: {origins: [[lat, lng] | {lat, lng, ...}], destinations (bỏ trống = điểm tham quan
+    crowd_zones.json), mode, preferences}. Trả JSON dạng stream: mỗi hàng (1 điểm đi) được gửi ngay khi tính xong.
+    """
+    try:
+        data = request.json or {}
+        origins = data.get('origins')
+        vehicle_mode = data.get('mode', 'motorbike')
+        user_prefs = data.get('preferences', {})
+        if not isinstance(origins, list) or not origins:
+            return jsonify({"status": "error", "message": "Thiếu danh sách origins"}), 400
+
+        print(f"📩 [API] Ma trận ({vehicle_mode}): {len(origins)} điểm đi")
+        result = core_logic.get_travel_matrix(origins, data.get('destinations'), vehicle_mode=vehicle_mode,
+                                              preferences=user_prefs, stream=True)
+        if result.get('status') == 'error':
+            return jsonify(result), 400
+    except Exception as e:
+        print(f"🔥 Lỗi Server (Matrix): {e}", file=sys.stderr)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    def cells(row, digits):
+        # float32 -> số làm tròn, không tới được (inf) -> null
+        return [round(float(v), digits) if v != float('inf') else None for v in row]
+
+    def generate():
+        yield '{"origins": ' + app.json.dumps(result['origins']) + ', "destinations": ' + app.json.dumps(result['destinations'])
+        yield ', "rows": ['
+        settled = 0
+        try:
+            for i, eta_row, risk_row, n in result['rows']:
+                settled += n
+                row = {"eta_s": cells(eta_row, 1), "risk": cells(risk_row, 1)}
+                yield (', ' if i else '') + app.json.dumps(row)
+            stats = dict(result['stats'], settled=settled)
+        except Exception as e:
+            # Header 200 đã gửi -> báo lỗi trong phần stats
+            print(f"🔥 Lỗi Server (Matrix stream): {e}", file=sys.stderr)
+            stats = dict(result['stats'], error=str(e))
+        yield '], "stats": ' + app.json.dumps(stats) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/api/find-routes/pareto', methods=['POST'])
+def pareto_routes_api():
+    """Các đường đánh đổi thời gian <-> rủi ro (tập Pareto) trong 1 lần tìm. Payload giống /api/find-routes."""
+    try:
+        data = request.json or {}
+        start_coords = data.get('start')
+        end_coords = data.get('end')
+        vehicle_mode = data.get('mode', 'motorbike')
+        user_prefs = data.get('preferences', {})
+
+        if not start_coords or not end_coords:
+            return jsonify({"status": "error", "message": "Thiếu tọa độ start/end"}), 400
+
+        print(f"📩 [API] Pareto ({vehicle_mode}): {start_coords} -> {end_coords}")
+        result = core_logic.get_pareto_routes(start_coords, end_coords, vehicle_mode=vehicle_mode, preferences=user_prefs)
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"🔥 Lỗi Server (Pareto): {e}", file=sys.stderr)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # ==========================================
 # 3. API DỮ LIỆU BẢN ĐỒ (Đã fix lỗi trùng tên)
 # ==========================================
 @app.route('/api/map-data', methods=['GET'])
 def get_map_layers():
-    print("🌍 [API] Đang tải dữ liệu lớp bản đồ...")
-    
     # 1. Lấy Filter BBox
     try:
         min_lat = float(request.args.get('min_lat', -90))
@@ -71,73 +189,67 @@ def get_map_layers():
         has_filter = False
 
     try:
-        # A. THIÊN TAI (Disasters)
-        # ----------------------------------------
-        disaster_data = [] # Đổi tên biến để không trùng với thư viện 'disasters'
-        
-        # 1. Ưu tiên đọc file thực
-        if os.path.exists('real_disasters.json'):
-            try:
-                with open('real_disasters.json', 'r', encoding='utf-8') as f:
-                    all_disasters = json.load(f)
-                    disaster_data = [
-                        d for d in all_disasters 
-                        if min_lat <= d['lat'] <= max_lat and min_lng <= d['lng'] <= max_lng
-                    ]
-            except: pass
-        
-        # 2. Fallback: Nếu list rỗng và đang filter thì gọi hàm scan (Mock/NASA)
-        if not disaster_data and has_filter: 
-             # Gọi hàm từ module 'disasters'
-             disaster_data = disasters.get_natural_disasters(min_lat, min_lng, 50)
-             
-             # Lọc lại lần nữa cho chắc (vì Mock 50km có thể trả về điểm ở xa)
-             disaster_data = [
-                d for d in disaster_data
-                if min_lat <= d['lat'] <= max_lat and min_lng <= d['lng'] <= max_lng
-             ]
-
-        # B. THỜI TIẾT (Weather)
-        # ----------------------------------------
-        weather_data = [] # Đổi tên biến
-        
-        if has_filter:
-            bbox = (min_lat, min_lng, max_lat, max_lng)
-            # Gọi hàm từ module 'weather'
-            weather_data = weather.get_weather_zones(bbox)
-        
-        # C. ĐIỂM NÓNG (Crowd)
-        # ----------------------------------------
-        crowd_data = [] # Đổi tên biến
-        try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            file_path = os.path.join(script_dir, 'crowd_zones.json')
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    all_crowd = json.load(f)
-                    if has_filter:
-                        crowd_data = [
-                            c for c in all_crowd 
-                            if min_lat <= c['lat'] <= max_lat and min_lng <= c['lng'] <= max_lng
-                        ]
-                    else:
-                        crowd_data = [] # Không filter -> Không trả về gì cả
-        except: pass
+        # Đọc từ snapshot của hazard_store (thread nền làm mới) -> không gọi API trong request
+        snap = hazard_store.STORE.snapshot()
+        bbox = (min_lat, min_lng, max_lat, max_lng)
 
-        return jsonify({
-            "status": "success",
-            "bbox_used": has_filter,
-            "data": {
-                "disasters": disaster_data,
-                "weather": weather_data,
-                "crowd": crowd_data
+        # ETag theo nội dung các lớp + bbox: client gửi lại If-None-Match trùng -> 304, không lọc gì cả
+        key = (snap.digests, tuple(snap.versions.items()), has_filter, bbox)
+        etag = response_cache.make_etag('map-data', *key)
+        if response_cache.etag_matches(request, etag):
+            return response_cache.not_modified(etag, MAP_DATA_MAX_AGE_S)
+
+        body = MAP_DATA_CACHE.get(key)
+        if body is None:
+            print("🌍 [API] Đang tải dữ liệu lớp bản đồ...")
+            # A. THIÊN TAI (Disasters)
+            disaster_data = snap.layers['disasters'].within(bbox)
+
+            # B. THỜI TIẾT (Weather) - chỉ trả khi có filter
+            weather_data = snap.layers['weather'].touching(bbox) if has_filter else []
+
+            # C. ĐIỂM NÓNG (Crowd) - Không filter -> Không trả về gì cả
+            crowd_data = snap.layers['crowd'].within(bbox) if has_filter else []
+
+            payload = {
+                "status": "success",
+                "bbox_used": has_filter,
+                "versions": snap.versions,
+                "data": {
+                    "disasters": disaster_data,
+                    "weather": weather_data,
+                    "crowd": crowd_data
+                }
             }
-        })
+            body = MAP_DATA_CACHE.put(key, response_cache.CachedBody(etag, app.json.dumps(payload).encode('utf-8')))
+
+        return response_cache.send(request, body, MAP_DATA_MAX_AGE_S)
 
     except Exception as e:
         print(f"🔥 Lỗi Server (Map Data): {e}", file=sys.stderr)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# ==========================================
+# 3b. TILE BẢN ĐỒ (z/x/y) - cache sẵn, CDN cache được
+# ==========================================
+TILE_VEHICLE_MODES = ('motorbike', 'car', 'bus', 'truck', 'walking')
+
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>', methods=['GET'])
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>.json', methods=['GET'])
+def get_tile(layer, z, x, y):
+    if not tiles.valid_tile(layer, z, x, y):
+        return jsonify({"status": "error", "message": f"Tile không hợp lệ: {layer}/{z}/{x}/{y}"}), 400
+    vehicle_mode = request.args.get('mode', 'motorbike')
+    if vehicle_mode not in TILE_VEHICLE_MODES:
+        return jsonify({"status": "error", "message": f"Phương tiện không hỗ trợ: {vehicle_mode}"}), 400
+
+    try:
+        body = tiles.get_tile(layer, z, x, y, app.json.dumps, vehicle_mode=vehicle_mode)
+        return response_cache.send(request, body, tiles.TILE_MAX_AGE_S)
+    except Exception as e:
+        print(f"🔥 Lỗi Server (Tile): {e}", file=sys.stderr)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # ==========================================
 # 4. API CHATBOT
 # ==========================================
@@ -172,6 +284,7 @@ def toggle_demo_mode():
         # Gọi module an toàn
         weather.set_demo_mode(is_demo)
         disasters.set_demo_mode(is_demo)
+        hazard_store.STORE.invalidate()  # Làm mới dữ liệu môi trường theo chế độ mới (nền)
         
         mode_text = "DEMO (Mock Data)" if is_demo else "REALTIME (Live API)"
         return jsonify({
@@ -184,4 +297,5 @@ def toggle_demo_mode():
 
 if __name__ == '__main__':
     print("\n🚀 SERVER READY...")
-    app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
+    # threaded=True: mỗi request 1 thread, dùng chung đồ thị trong RAM (trọng số nằm trong overlay riêng)
+    app.run(debug=True, port=5000, host='0.0.0.0', threaded=True)
\ No newline at end of file
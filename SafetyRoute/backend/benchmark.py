@@ -0,0 +1,243 @@
+# file: benchmark.py
+"""
+Đo hiệu năng các bước nặng của backend (chạy tay, không phải test tự động).
+    python benchmark.py                       # dùng hcm_map_drive (snapshot nếu có)
+    python benchmark.py vietnam_d1_map.graphml
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+import graph_engine
+import graph_snapshot
+import standardization
+
+
+def load_bench_graph(graphml_path):
+    """Nạp CompactGraph: ưu tiên snapshot, không có thì đọc GraphML."""
+    graph = graph_snapshot.load_snapshot(graphml_path)
+    if graph is None:
+        import osmnx as ox
+        graph = graph_engine.build_compact_graph(ox.load_graphml(graphml_path))
+    return graph
+
+
+def _random_hazards(graph, n, rng):
+    """Sinh n vùng nguy hiểm ngẫu nhiên trong khung bản đồ (dạng giống disasters.py)."""
+    lat = rng.uniform(float(graph.y.min()), float(graph.y.max()), n)
+    lng = rng.uniform(float(graph.x.min()), float(graph.x.max()), n)
+    cats = [[], ['floods'], ['severeStorms'], ['wildfires'], ['landslides']]
+    return [{'lat': float(a), 'lng': float(b), 'radius': float(rng.uniform(0.2, 3.0)),
+             'categories_raw': cats[i % len(cats)]} for i, (a, b) in enumerate(zip(lat, lng))]
+
+
+def bench_hazard_kernel(graph, n_hazards=50, n_edges=None, seed=0):
+    """
+    So sánh bản scalar (intersection + disaster_impact_from_points từng cạnh)
+    với kernel vector hóa (bulk_intersection + hazard_edge_scores).
+    Kết quả phải GIỐNG HỆT nhau.
+    """
+    rng = np.random.default_rng(seed)
+    hazards = _random_hazards(graph, n_hazards, rng)
+    edges = np.arange(graph.num_edges, dtype=np.int64)
+    if n_edges is not None and n_edges < len(edges):
+        edges = np.sort(rng.choice(edges, n_edges, replace=False))
+    idx = standardization.create_spatial_index(hazards)
+
+    bboxes = graph.edge_bounds()[edges]
+
+    t0 = time.perf_counter()
+    scalar = np.zeros(len(edges))
+    for i, e in enumerate(edges.tolist()):
+        pot = idx.intersection(tuple(bboxes[i]))
+        if pot:
+            scalar[i] = standardization.disaster_impact_from_points(graph.edge_points(e), [hazards[j] for j in pot])
+    t_scalar = time.perf_counter() - t0
+
+    graph.segments()  # đã dựng sẵn lúc load trong traffic.py
+    t0 = time.perf_counter()
+    vector = standardization.hazard_edge_scores(
+        graph, edges, *standardization.disaster_hazard_arrays(hazards),
+        candidates=idx.bulk_intersection(bboxes))
+    t_vector = time.perf_counter() - t0
+
+    same = bool(np.array_equal(scalar, vector))
+    print(f"☢️ Hazard kernel: {len(edges)} cạnh x {n_hazards} vùng | scalar {t_scalar * 1000:.1f} ms"
+          f" | numpy {t_vector * 1000:.1f} ms | x{t_scalar / max(t_vector, 1e-9):.1f} | khớp: {same}")
+    return same
+
+
+def bench_hazard_index(graph, n_hazards=200, seed=0):
+    """
+    Chỉ mục lưới (HazardGridIndex): truy vấn từng bbox cạnh vs 1 lần bulk cho mọi cạnh,
+    đối chiếu với quét tuyến tính theo BBox bán kính (đáp án đúng).
+    """
+    rng = np.random.default_rng(seed)
+    hazards = _random_hazards(graph, n_hazards, rng)
+    bboxes = graph.edge_bounds()
+    idx = standardization.create_spatial_index(hazards)
+
+    t0 = time.perf_counter()
+    single = [idx.intersection(tuple(b)) for b in bboxes]
+    t_single = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rows, items = idx.bulk_intersection(bboxes)
+    t_bulk = time.perf_counter() - t0
+
+    h = standardization.hazard_bounds(hazards)
+    brute = [np.flatnonzero((b[0] <= h[:, 2]) & (h[:, 0] <= b[2]) & (b[1] <= h[:, 3]) & (h[:, 1] <= b[3])).tolist()
+             for b in bboxes]
+    bulk = [[] for _ in range(len(bboxes))]
+    for r, i in zip(rows.tolist(), items.tolist()):
+        bulk[r].append(i)
+    bulk = [sorted(x) for x in bulk]
+    same = single == brute and bulk == brute
+    print(f"🔎 Hazard index: {len(bboxes)} bbox x {n_hazards} vùng | từng bbox {t_single * 1000:.1f} ms"
+          f" | bulk {t_bulk * 1000:.1f} ms | {len(rows)} cặp | khớp: {same}")
+    return same
+
+
+def bench_traffic_speeds(graph, hour=17.5, is_weekend=False, vehicle_mode='motorbike', seed=0):
+    """
+    Tốc độ thực tế của mọi cạnh: predict từng cạnh (không cache, như trước)
+    vs tốc độ cơ bản dựng sẵn + điểm kẹt xe theo lô có cache.
+    """
+    rng = np.random.default_rng(seed)
+    weather = rng.choice([0.0, 0.1, 0.3, 0.6, 0.8, 0.9, 1.0], graph.num_edges)
+    model = standardization.traffic_model
+
+    t0 = time.perf_counter()
+    scalar = np.zeros(graph.num_edges)
+    for e in range(graph.num_edges):
+        standardization.TRAFFIC_SCORE_CACHE.clear()
+        scalar[e] = standardization.calculate_segment_speed(graph.edge_record(e), hour, is_weekend, weather[e], vehicle_mode)
+    t_scalar = time.perf_counter() - t0
+
+    standardization.TRAFFIC_SCORE_CACHE.clear()
+    t0 = time.perf_counter()
+    base = graph.base_speed if graph.base_speed is not None else standardization.base_speed_array(graph)
+    vector = standardization.calculate_segment_speeds(base, hour, is_weekend, weather, vehicle_mode)
+    t_vector = time.perf_counter() - t0
+
+    same = bool(np.array_equal(scalar, vector))
+    print(f"🚦 Traffic speed ({'AI' if model else 'fallback'}): {graph.num_edges} cạnh | từng cạnh {t_scalar * 1000:.1f} ms"
+          f" | lô + cache {t_vector * 1000:.1f} ms | x{t_scalar / max(t_vector, 1e-9):.1f} | khớp: {same}")
+    return same
+
+
+def bench_crowd_tensor(graph, hours=(7.0, 11.0, 11.25, 11.5, 16.0, 17.0, 18.75, 19.0, 23.9)):
+    """
+    Điểm đám đông của mọi cạnh: calculate_crowd_score từng trung điểm
+    vs ma trận cạnh x khung giờ dựng sẵn (1 lần gather).
+    """
+    t0 = time.perf_counter()
+    tensor = standardization.build_crowd_tensor(graph)
+    t_build = time.perf_counter() - t0
+
+    mid_lat = ((graph.y[graph.sources] + graph.y[graph.targets]) / 2).tolist()
+    mid_lon = ((graph.x[graph.sources] + graph.x[graph.targets]) / 2).tolist()
+    edges = np.arange(graph.num_edges)
+    same, t_scalar, t_gather = True, 0.0, 0.0
+    for h in hours:
+        t0 = time.perf_counter()
+        scalar = np.array([standardization.calculate_crowd_score(a, b, h) for a, b in zip(mid_lat, mid_lon)])
+        t_scalar += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        gathered = tensor.scores(edges, h)
+        t_gather += time.perf_counter() - t0
+        same = same and bool(np.array_equal(scalar, gathered))
+    print(f"👥 Crowd tensor: {graph.num_edges} cạnh ({int((tensor.edge_row >= 0).sum())} gần điểm nóng), dựng {t_build * 1000:.0f} ms"
+          f" | từng cạnh {t_scalar / len(hours) * 1000:.1f} ms | gather {t_gather / len(hours) * 1000:.2f} ms | khớp: {same}")
+    return same
+
+
+def bench_search(graph, n_pairs=200, seed=0):
+    """
+    Dijkstra 1 chiều vs A* 2 chiều (cận dưới chim bay / tốc độ tối đa) trên trọng số
+    kiểu final_weight = eta * (1 + penalty). Chi phí phải bằng nhau, so số node đã chốt.
+    """
+    rng = np.random.default_rng(seed)
+    base = graph.base_speed if graph.base_speed is not None else standardization.base_speed_array(graph)
+    penalty = np.where(rng.random(graph.num_edges) < 0.2, rng.uniform(0, 3, graph.num_edges), 0.0)
+    weights = graph.length / (base / 3.6) * (1 + penalty)
+    speed_mps = max(5.0, float(base.max())) / 3.6
+    pairs = rng.integers(0, graph.num_nodes, (n_pairs, 2)).tolist()
+
+    same, settled, times = True, {'dijkstra': 0, 'bidir': 0}, {'dijkstra': 0.0, 'bidir': 0.0}
+    for s, t in pairs:
+        t0 = time.perf_counter()
+        ref = graph_engine.shortest_path(graph, s, t, weights)
+        times['dijkstra'] += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        got = graph_engine.bidirectional_astar(graph, s, t, weights, speed_mps)
+        times['bidir'] += time.perf_counter() - t0
+        if (ref is None) != (got is None) or (ref and abs(ref.cost - got.cost) > 1e-6 * max(1.0, ref.cost)):
+            same = False
+        elif ref:
+            same = same and abs(sum(weights[got.edges]) - got.cost) <= 1e-6 * max(1.0, got.cost)
+            settled['dijkstra'] += ref.settled
+            settled['bidir'] += got.settled
+    print(f"🧭 Search: {n_pairs} cặp | Dijkstra {times['dijkstra'] / n_pairs * 1000:.2f} ms, chốt {settled['dijkstra'] // n_pairs}"
+          f" | A* 2 chiều {times['bidir'] / n_pairs * 1000:.2f} ms, chốt {settled['bidir'] // n_pairs} | khớp: {same}")
+    return same
+
+
+def bench_lazy_weights(graph, n_pairs=50, n_hazards=50, seed=0):
+    """
+    Chấm điểm trước mọi cạnh (eager) vs chấm lười khi A* 2 chiều duyệt tới (LazyWeightOverlay)
+    trên cả bản đồ. Cùng bộ chấm điểm -> chi phí đường phải bằng nhau, so số cạnh phải chấm.
+    """
+    import core_logic
+    import edge_weights
+    import spatial_index
+
+    rng = np.random.default_rng(seed)
+    if graph.base_speed is None:
+        graph.base_speed = standardization.base_speed_array(graph)
+    if graph.crowd is None:
+        graph.crowd = standardization.build_crowd_tensor(graph)
+    env = {'disasters': _random_hazards(graph, n_hazards, rng), 'weather': [], 'crowd': []}
+    corridor = spatial_index.GridIndex(graph).full_corridor()
+    speed_mps = max(5.0, float(graph.base_speed.max())) / 3.6
+    pairs = rng.integers(0, graph.num_nodes, (n_pairs, 2)).tolist()
+
+    same, scored, times = True, 0, {'eager': 0.0, 'lazy': 0.0}
+    for s, t in pairs:
+        scorer = core_logic.EdgeScorer(graph, env, 17.5, 'motorbike', {})
+        t0 = time.perf_counter()
+        eager = edge_weights.WeightOverlay(corridor)
+        etas, penalties, scores = scorer.weigh(corridor.edges)
+        eager.assign(etas, penalties, scores[:, 0], scores[:, 1], scores[:, 2])
+        ref = graph_engine.bidirectional_astar(graph, s, t, eager.search_weights(), speed_mps)
+        times['eager'] += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        lazy = edge_weights.LazyWeightOverlay(corridor, scorer.weigh)
+        got = graph_engine.bidirectional_astar(graph, s, t, lazy.search_weights(), speed_mps)
+        times['lazy'] += time.perf_counter() - t0
+        if (ref is None) != (got is None) or (ref and abs(ref.cost - got.cost) > 1e-6 * max(1.0, ref.cost)):
+            same = False
+        scored += lazy.num_scored
+    print(f"🐢 Lazy weights: {n_pairs} cặp | chấm trước {graph.num_edges} cạnh {times['eager'] / n_pairs * 1000:.1f} ms"
+          f" | chấm lười {scored // n_pairs} cạnh {times['lazy'] / n_pairs * 1000:.1f} ms | khớp: {same}")
+    return same
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'hcm_map_drive.graphml'
+    if not os.path.exists(path) and not os.path.exists(graph_snapshot.snapshot_dir(path)):
+        print(f"❌ Không thấy '{path}'")
+        sys.exit(1)
+    g = load_bench_graph(path)
+    print(f"🗺️ '{path}': {g.num_nodes} node, {g.num_edges} cạnh")
+    ok = all([bench_hazard_index(g, n_hazards=200),
+              bench_hazard_kernel(g, n_hazards=50),
+              bench_traffic_speeds(g),
+              bench_crowd_tensor(g),
+              bench_search(g),
+              bench_lazy_weights(g)])
+    if not ok:
+        print("❌ Có phép đo không khớp bản tham chiếu")
+        sys.exit(1)
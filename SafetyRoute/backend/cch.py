@@ -0,0 +1,400 @@
+# file: cch.py
+"""
+Customizable Contraction Hierarchies (CCH) cho bản đồ CSR.
+
+Tìm đường trong cả thành phố bằng Dijkstra/A* phải quét hàng chục nghìn node, nên
+_prepare_graph phải cắt hành lang (BBox). CCH chia việc làm 3 pha:
+    1. OFFLINE, không phụ thuộc trọng số (chạy 1 lần, lưu vào snapshot):
+       - Thứ tự node bằng chia đôi lồng nhau (nested dissection) theo tọa độ: node thuộc
+         "đường cắt" giữa 2 nửa bản đồ được xếp hạng CAO NHẤT.
+       - Co đồ thị theo thứ tự đó -> đồ thị "lên" (mọi cung nối node hạng thấp -> hạng cao)
+         + danh sách tam giác dưới (v; u, w) dùng cho pha 2.
+    2. CUSTOMIZE (mỗi khi trọng số đổi, VD output của _calculate_weights): duyệt tam giác
+       theo tầng của cây khử (elimination tree), mỗi tầng là 1 lượt numpy.
+    3. QUERY: chỉ leo cây khử từ 2 đầu (tổ tiên của s và t), gặp nhau ở node chung tốt nhất,
+       rồi bung (unpack) cung tắt thành danh sách cạnh gốc.
+Kết quả trả về dạng graph_engine.SearchResult (nodes/edges theo id nội bộ) như các thuật toán khác.
+"""
+import numpy as np
+
+import graph_engine
+
+INF = graph_engine.INF
+
+# Số node tối đa của 1 mảnh khi chia đôi lồng nhau (mảnh nhỏ hơn xếp theo bậc)
+CCH_LEAF_SIZE = 32
+
+# Tiền tố tên mảng khi lưu vào snapshot (graph.extras)
+EXTRAS_PREFIX = 'cch_'
+CCH_ARRAYS = ('rank', 'parent', 'arc_offsets', 'arc_hi', 'arc_lo', 'edge_arc', 'edge_up',
+              'tri_a', 'tri_b', 'tri_c', 'level_offsets')
+
+
+def _undirected_pairs(graph):
+    """Các cặp (u, v) u < v không trùng, bỏ vòng tự thân."""
+    u = np.minimum(graph.sources, graph.targets).astype(np.int64)
+    v = np.maximum(graph.sources, graph.targets).astype(np.int64)
+    keep = u != v
+    pairs = np.unique(u[keep] * graph.num_nodes + v[keep])
+    return (pairs // graph.num_nodes).astype(np.int32), (pairs % graph.num_nodes).astype(np.int32)
+
+
+def nested_dissection_order(graph, leaf_size=CCH_LEAF_SIZE):
+    """
+    Thứ tự co node (không phụ thuộc trọng số). Output: rank (int32, n) - hạng của từng node.
+    Mỗi mảnh được chia đôi theo trung vị của trục dài hơn; các node nằm ở đầu các cạnh
+    cắt ngang (lấy phía ít node hơn) làm "đường cắt" và được xếp sau cả 2 nửa.
+    """
+    n = graph.num_nodes
+    eu, ev = _undirected_pairs(graph)
+    px = graph.x * np.cos(np.radians(float(np.mean(graph.y)) if n else 0.0))
+    py = graph.y
+    side = np.zeros(n, dtype=np.int8)
+    order = []
+
+    def leaf(nodes, edges):
+        # Mảnh nhỏ: co node bậc thấp trước (ít cung tắt)
+        deg = np.zeros(n, dtype=np.int64)
+        np.add.at(deg, eu[edges], 1)
+        np.add.at(deg, ev[edges], 1)
+        order.extend(nodes[np.argsort(deg[nodes], kind='stable')].tolist())
+
+    stack = [(np.arange(n, dtype=np.int32), np.arange(len(eu), dtype=np.int64), False)]
+    while stack:
+        nodes, edges, emit = stack.pop()
+        if emit:                       # đánh dấu "xếp đường cắt" sau khi 2 nửa đã xong
+            order.extend(nodes.tolist())
+            continue
+        if len(nodes) <= leaf_size:
+            leaf(nodes, edges)
+            continue
+
+        xs, ys = px[nodes], py[nodes]
+        coord = xs if np.ptp(xs) >= np.ptp(ys) else ys
+        median = np.median(coord)
+        left = coord < median
+        if left.all() or not left.any():
+            left = np.arange(len(nodes)) < len(nodes) // 2   # trùng tọa độ: chia theo vị trí
+        side[nodes] = np.where(left, 1, 2)
+
+        su, sv = side[eu[edges]], side[ev[edges]]
+        cut = edges[su != sv]
+        cut_left = np.unique(np.where(side[eu[cut]] == 1, eu[cut], ev[cut]))
+        cut_right = np.unique(np.where(side[eu[cut]] == 2, eu[cut], ev[cut]))
+        sep = cut_left if len(cut_left) <= len(cut_right) else cut_right
+        side[sep] = 0
+
+        parts = []
+        for s in (1, 2):
+            part_nodes = nodes[side[nodes] == s]
+            part_edges = edges[(side[eu[edges]] == s) & (side[ev[edges]] == s)]
+            parts.append((part_nodes, part_edges))
+        side[nodes] = 0
+
+        # Ngăn xếp LIFO: đẩy đường cắt trước để nó được xếp SAU 2 nửa
+        stack.append((sep.astype(np.int32), None, True))
+        for part_nodes, part_edges in parts:
+            if len(part_nodes):
+                stack.append((part_nodes, part_edges, False))
+
+    rank = np.empty(n, dtype=np.int32)
+    rank[np.array(order, dtype=np.int64)] = np.arange(n, dtype=np.int32)
+    return rank
+
+
+def contract(graph, rank):
+    """
+    Co đồ thị theo `rank` (không phụ thuộc trọng số). Output: dict các mảng của CCH.
+        - arc_lo/arc_hi: cung (node hạng thấp, node hạng cao), gom theo arc_lo (CSR: arc_offsets)
+        - parent: cha trong cây khử (node hạng thấp nhất trong các láng giềng "lên", -1 = gốc)
+        - edge_arc/edge_up: cạnh gốc e -> cung chứa nó, đi theo chiều lên (lo -> hi) hay không
+        - tri_a/tri_b/tri_c: tam giác dưới (v; u, w): a = (v,u), b = (v,w), c = (u,w),
+          đã sắp theo tầng của v trong cây khử (level_offsets)
+    """
+    n = graph.num_nodes
+    eu, ev = _undirected_pairs(graph)
+    rank_l = rank.tolist()
+    up = [set() for _ in range(n)]
+    for a, b in zip(eu.tolist(), ev.tolist()):
+        if rank_l[a] < rank_l[b]:
+            up[a].add(b)
+        else:
+            up[b].add(a)
+
+    # Khử node theo hạng tăng dần: láng giềng "lên" của v nối thành đồ thị đầy đủ (fill-in)
+    by_rank = np.argsort(rank).tolist()
+    up_sorted = [None] * n
+    parent = np.full(n, -1, dtype=np.int32)
+    for v in by_rank:
+        nb = sorted(up[v], key=rank_l.__getitem__)
+        up_sorted[v] = nb
+        if nb:
+            parent[v] = nb[0]
+            first = up[nb[0]]
+            for i, u in enumerate(nb):
+                targets = up[u] if i else first
+                for w in nb[i + 1:]:
+                    targets.add(w)
+
+    # Cung: gom theo node thấp, trong mỗi node sắp theo hạng node cao
+    counts = np.array([len(nb) for nb in up_sorted], dtype=np.int64)
+    arc_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=arc_offsets[1:])
+    arc_hi = np.array([w for nb in up_sorted for w in nb], dtype=np.int32)
+    arc_lo = np.repeat(np.arange(n, dtype=np.int32), counts)
+    arc_id = {(lo, hi): i for i, (lo, hi) in enumerate(zip(arc_lo.tolist(), arc_hi.tolist()))}
+
+    # Cạnh gốc -> cung
+    src, dst = graph.sources.tolist(), graph.targets.tolist()
+    edge_arc = np.full(graph.num_edges, -1, dtype=np.int32)
+    edge_up = np.zeros(graph.num_edges, dtype=bool)
+    for e, (a, b) in enumerate(zip(src, dst)):
+        if a == b:
+            continue   # vòng tự thân không bao giờ nằm trên đường ngắn nhất
+        if rank_l[a] < rank_l[b]:
+            edge_arc[e], edge_up[e] = arc_id[(a, b)], True
+        else:
+            edge_arc[e] = arc_id[(b, a)]
+
+    # Tầng trong cây khử: lá = 0, cha > mọi con (con cháu luôn được customize trước)
+    height = np.zeros(n, dtype=np.int64)
+    for v in by_rank:
+        p = parent[v]
+        if p >= 0 and height[p] < height[v] + 1:
+            height[p] = height[v] + 1
+
+    tri = []
+    for v in by_rank:
+        nb = up_sorted[v]
+        for i, u in enumerate(nb):
+            a = arc_id[(v, u)]
+            for w in nb[i + 1:]:
+                tri.append((height[v], a, arc_id[(v, w)], arc_id[(u, w)]))
+    tri = np.array(tri, dtype=np.int64).reshape(-1, 4)
+    tri = tri[np.argsort(tri[:, 0], kind='stable')]
+    level_offsets = np.searchsorted(tri[:, 0], np.arange(int(tri[:, 0].max()) + 2 if len(tri) else 1))
+
+    return {
+        'rank': rank.astype(np.int32), 'parent': parent,
+        'arc_offsets': arc_offsets, 'arc_hi': arc_hi, 'arc_lo': arc_lo,
+        'edge_arc': edge_arc, 'edge_up': edge_up,
+        'tri_a': tri[:, 1].astype(np.int32), 'tri_b': tri[:, 2].astype(np.int32),
+        'tri_c': tri[:, 3].astype(np.int32), 'level_offsets': level_offsets.astype(np.int64),
+    }
+
+
+def _min_per_group(groups, values):
+    """Với mỗi nhóm: (nhóm, giá trị nhỏ nhất, vị trí đạt min trong mảng gốc)."""
+    order = np.lexsort((values, groups))
+    g = groups[order]
+    first = np.ones(len(g), dtype=bool)
+    first[1:] = g[1:] != g[:-1]
+    pick = order[first]
+    return groups[pick], values[pick], pick
+
+
+class CCH:
+    """Cấu trúc CCH (không phụ thuộc trọng số) của 1 CompactGraph."""
+    def __init__(self, graph, arrays):
+        self.graph = graph
+        for name in CCH_ARRAYS:
+            setattr(self, name, np.asarray(arrays[name]))
+        self.num_arcs = len(self.arc_hi)
+        # Bản list cho vòng lặp query thuần Python
+        self._parent = self.parent.tolist()
+        self._rank = self.rank.tolist()
+        self._arc_offsets = self.arc_offsets.tolist()
+        self._arc_hi = self.arc_hi.tolist()
+        self._tri_a = self.tri_a.tolist()
+        self._tri_b = self.tri_b.tolist()
+
+    @property
+    def num_triangles(self):
+        return len(self.tri_c)
+
+    def to_extras(self):
+        """Các mảng để lưu kèm snapshot (graph_snapshot.write_snapshot(extra_arrays=...))."""
+        return {EXTRAS_PREFIX + name: getattr(self, name) for name in CCH_ARRAYS}
+
+    def customize(self, weights):
+        """
+        Pha customize: trọng số theo cạnh gốc (INF = chặn) -> CCHMetric.
+        Cung nhận trọng số nhỏ nhất của các cạnh gốc song song, rồi mỗi tam giác dưới (v; u, w)
+        cập nhật c(u->w) <= c(u->v) + c(v->w) (và chiều ngược lại), tầng thấp trước.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        m = self.num_arcs
+        up, down = np.full(m, INF), np.full(m, INF)
+        orig_up, orig_down = np.full(m, -1, dtype=np.int64), np.full(m, -1, dtype=np.int64)
+        tri_up, tri_down = np.full(m, -1, dtype=np.int64), np.full(m, -1, dtype=np.int64)
+
+        valid = (self.edge_arc >= 0) & (weights < INF)
+        for direction, cost, orig in ((True, up, orig_up), (False, down, orig_down)):
+            edges = np.flatnonzero(valid & (self.edge_up == direction))
+            arcs, vals, pick = _min_per_group(self.edge_arc[edges].astype(np.int64), weights[edges])
+            cost[arcs] = vals
+            orig[arcs] = edges[pick]
+
+        lo_off = self.level_offsets
+        for lv in range(len(lo_off) - 1):
+            s, e = lo_off[lv], lo_off[lv + 1]
+            if s == e:
+                continue
+            a, b, c = self.tri_a[s:e], self.tri_b[s:e], self.tri_c[s:e]
+            c64 = c.astype(np.int64)
+            # u -> w qua v: (u -> v) là chiều xuống của a, (v -> w) là chiều lên của b
+            for cost, cand, tri in ((up, down[a] + up[b], tri_up), (down, down[b] + up[a], tri_down)):
+                arcs, vals, pick = _min_per_group(c64, cand)
+                better = vals < cost[arcs]
+                cost[arcs[better]] = vals[better]
+                tri[arcs[better]] = s + pick[better]
+        return CCHMetric(self, up, down, orig_up, orig_down, tri_up, tri_down)
+
+
+class CCHMetric:
+    """CCH đã customize cho 1 bộ trọng số (dùng cho nhiều query)."""
+    def __init__(self, cch, up, down, orig_up, orig_down, tri_up, tri_down):
+        self.cch = cch
+        self._up, self._down = up.tolist(), down.tolist()
+        self._orig_up, self._orig_down = orig_up.tolist(), orig_down.tolist()
+        self._tri_up, self._tri_down = tri_up.tolist(), tri_down.tolist()
+
+    def _ancestors(self, seeds):
+        """Hợp các đường lên gốc (cây khử) của các node xuất phát, sắp theo hạng tăng dần."""
+        parent, seen = self.cch._parent, set()
+        for s in seeds:
+            while s >= 0 and s not in seen:
+                seen.add(s)
+                s = parent[s]
+        return sorted(seen, key=self.cch._rank.__getitem__)
+
+    def _sweep(self, seeds, cost):
+        """Duyệt tổ tiên theo hạng tăng dần, thả lỏng mọi cung lên. Output: (dist, pred, số node đã quét)."""
+        offsets, arc_hi = self.cch._arc_offsets, self.cch._arc_hi
+        dist, pred = {}, {}
+        for s, c in seeds.items():
+            if c < dist.get(s, INF):
+                dist[s], pred[s] = c, -1
+        nodes = self._ancestors(seeds)
+        for x in nodes:
+            d = dist.get(x)
+            if d is None:
+                continue
+            for arc in range(offsets[x], offsets[x + 1]):
+                nd = d + cost[arc]
+                y = arc_hi[arc]
+                if nd < dist.get(y, INF):
+                    dist[y], pred[y] = nd, arc
+        return dist, pred, len(nodes)
+
+    def _unpack(self, arc, upward, out):
+        """Bung cung tắt thành cạnh gốc (theo thứ tự đi), ghi nối vào `out`."""
+        tri_a, tri_b = self.cch._tri_a, self.cch._tri_b
+        stack = [(arc, upward)]
+        while stack:
+            arc, upward = stack.pop()
+            t = self._tri_up[arc] if upward else self._tri_down[arc]
+            if t < 0:
+                out.append(self._orig_up[arc] if upward else self._orig_down[arc])
+            elif upward:
+                # lo -> hi = (lo -> v: chiều xuống của a) + (v -> hi: chiều lên của b)
+                stack.append((tri_b[t], True))
+                stack.append((tri_a[t], False))
+            else:
+                # hi -> lo = (hi -> v: chiều xuống của b) + (v -> lo: chiều lên của a)
+                stack.append((tri_a[t], True))
+                stack.append((tri_b[t], False))
+
+    def query(self, source, target):
+        """
+        Đường ngắn nhất source -> target (id node hoặc dict {node: chi phí cộng thêm} như shortest_path).
+        Output: graph_engine.SearchResult (settled = số node đã quét ở 2 phía) hoặc None.
+        """
+        seeds = source if isinstance(source, dict) else {source: 0.0}
+        goals = target if isinstance(target, dict) else {target: 0.0}
+        dist_f, pred_f, n_f = self._sweep(seeds, self._up)
+        dist_b, pred_b, n_b = self._sweep(goals, self._down)
+
+        best, meet = INF, None
+        for v, d in dist_f.items():
+            db = dist_b.get(v)
+            if db is not None and d + db < best:
+                best, meet = d + db, v
+        if meet is None:
+            return None
+
+        graph = self.cch.graph
+        arc_lo = self.cch.arc_lo
+        chain = []
+        v = meet
+        while pred_f[v] != -1:
+            chain.append(pred_f[v])
+            v = int(arc_lo[pred_f[v]])
+        edges = []
+        for arc in reversed(chain):
+            self._unpack(arc, True, edges)
+        v = meet
+        while pred_b[v] != -1:
+            arc = pred_b[v]
+            self._unpack(arc, False, edges)
+            v = int(arc_lo[arc])
+
+        sources, targets = graph.sources, graph.adjacency()[1]
+        start = int(sources[edges[0]]) if edges else meet
+        nodes = [start] + [targets[e] for e in edges]
+        return graph_engine.SearchResult(nodes, edges, best, n_f + n_b)
+
+
+def build_cch(graph, leaf_size=CCH_LEAF_SIZE):
+    """Pha OFFLINE: thứ tự nested dissection + co đồ thị -> CCH."""
+    return CCH(graph, contract(graph, nested_dissection_order(graph, leaf_size)))
+
+
+def load_cch(graph):
+    """Dựng CCH từ mảng đã lưu trong snapshot (graph.extras). Không có -> None."""
+    names = [EXTRAS_PREFIX + name for name in CCH_ARRAYS]
+    if not all(name in graph.extras for name in names):
+        return None
+    return CCH(graph, {name: graph.extras[EXTRAS_PREFIX + name] for name in CCH_ARRAYS})
+
+
+if __name__ == '__main__':
+    # Đối chiếu CCH với Dijkstra: python cch.py [file.graphml]
+    import sys
+    import time
+
+    import benchmark
+
+    g = benchmark.load_bench_graph(sys.argv[1] if len(sys.argv) > 1 else 'hcm_map_drive.graphml')
+    t0 = time.perf_counter()
+    c = build_cch(g)
+    print(f"🏗️ CCH: {g.num_nodes} node, {c.num_arcs} cung, {c.num_triangles} tam giác,"
+          f" {len(c.level_offsets) - 1} tầng ({time.perf_counter() - t0:.2f}s)")
+
+    rng = np.random.default_rng(0)
+    weights = g.length / 8.0 * (1 + np.where(rng.random(g.num_edges) < 0.2, rng.uniform(0, 3, g.num_edges), 0.0))
+    t0 = time.perf_counter()
+    metric = c.customize(weights)
+    t_custom = time.perf_counter() - t0
+
+    ok, t_ref, t_cch, scanned = True, 0.0, 0.0, 0
+    pairs = rng.integers(0, g.num_nodes, (300, 2)).tolist()
+    for s, t in pairs:
+        t0 = time.perf_counter()
+        ref = graph_engine.shortest_path(g, s, t, weights)
+        t_ref += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        got = metric.query(s, t)
+        t_cch += time.perf_counter() - t0
+        if (ref is None) != (got is None):
+            ok = False
+        elif ref is not None:
+            scanned += got.settled
+            path_cost = float(weights[got.edges].sum())
+            linked = all(int(g.sources[e]) == u for e, u in zip(got.edges, got.nodes))
+            ok = ok and abs(ref.cost - got.cost) <= 1e-6 * max(1.0, ref.cost) and \
+                abs(path_cost - got.cost) <= 1e-6 * max(1.0, got.cost) and linked and got.nodes[-1] == t
+    print(f"⚙️ Customize: {t_custom * 1000:.1f} ms | query: Dijkstra {t_ref / len(pairs) * 1000:.2f} ms,"
+          f" CCH {t_cch / len(pairs) * 1000:.2f} ms (quét {scanned // len(pairs)} node) | khớp: {ok}")
+    if not ok:
+        sys.exit(1)
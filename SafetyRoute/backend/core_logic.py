@@ -1,31 +1,203 @@
 import networkx as nx
-import osmnx as ox
 import numpy as np
 from datetime import datetime
 import warnings
-import json
 import os
-import pickle
+import copy
+import time
 
 # Import các module vệ tinh
 import traffic
-import weather
-import disasters
+import hazard_store
 import standardization 
-from standardization import CROWD_ZONES
+import graph_engine
+import spatial_index
+import alternatives
+import pareto
+import travel_matrix
+import route_session
+import edge_weights
+import risk_engine
+import forest_model
 
 warnings.filterwarnings("ignore")
 
+# Backend tìm đường: "csr" (mảng nén, nhanh) hoặc "networkx" (bản tham chiếu cũ)
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "csr")
+
+# Cách bám điểm đi/đến: "node" (node gần nhất) hoặc "edge" (chiếu lên cạnh gần nhất, tạo node ảo)
+SNAP_MODE = os.getenv("SNAP_MODE", "node")
+
+# Thuật toán tìm đường trên CSR: "dijkstra" (1 chiều), "bidir_astar" (A* 2 chiều, cận dưới chim bay)
+# "alt" (A* 2 chiều + cận landmark; snapshot không có bảng ALT thì dùng cận chim bay)
+# hoặc "cch" (Customizable Contraction Hierarchies trên CẢ bản đồ, cần snapshot có kèm CCH)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "alt")
+
+# Cách tìm đường thay thế:
+#   - via    : 1 lần tìm 2 chiều, chọn via-node theo độ dài/trùng lặp/tối ưu cục bộ (alternatives.py)
+#   - penalty: cách cũ, nhân x3 trọng số đường vừa tìm rồi tìm lại (tối đa 3 lần)
+ALTERNATIVES_MODE = os.getenv("ALTERNATIVES_MODE", "via")
+
+# Cách chấm điểm cạnh:
+#   - lazy : chỉ chấm cạnh mà thuật toán tìm đường duyệt tới (theo lô nhỏ, nhớ trong overlay),
+#            tìm trên CẢ bản đồ -> không cần đoán buffer BBox
+#   - eager: chấm toàn bộ hành lang cắt theo BBox trước khi tìm (cách cũ; networkx / CCH luôn dùng)
+WEIGHT_MODE = os.getenv("WEIGHT_MODE", "lazy")
+
+# Hành lang là cả bản đồ: map_data chỉ lấy môi trường quanh các tuyến tìm được (+ lề, độ)
+MAP_DATA_PAD_DEG = 0.003
+
+# Số ô tối đa của 1 ma trận thời gian đi (get_travel_matrix)
+MATRIX_MAX_CELLS = int(os.getenv("MATRIX_MAX_CELLS", "20000"))
+
+# Tốc độ đi bộ cố định (km/h) - giống calculate_segment_speeds
+WALK_SPEED_KMH = 5.0
+
+# Số lần tối đa nới rộng hành lang (mỗi lần x2 buffer) khi không tìm thấy đường
+CORRIDOR_MAX_WIDEN = 2
+
 # Load Risk Model
 RISK_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'risk_model.pkl')
 risk_model = None
 try:
-    with open(RISK_MODEL_PATH, 'rb') as f:
-        risk_model = pickle.load(f)
+    # Ưu tiên bản phẳng risk_model.npz (không cần sklearn), thiếu thì unpickle như cũ
+    risk_model = forest_model.load_model(RISK_MODEL_PATH)
     print("🤖 [CORE] Đã nạp thành công AI Risk Model!")
 except Exception as e:
     print(f"⚠️ [CORE] Không tìm thấy Risk Model ({e}). Sẽ dùng công thức cộng thủ công.")
 
+# Bảng tra rủi ro dựng sẵn từ model (khử trùng lặp + tra bảng, ngoài lưới mới gọi model)
+risk_lut = risk_engine.build_risk_lut(risk_model)
+
+def _print_lut_stats():
+    if risk_model and risk_lut is not None:
+        st = risk_lut.stats()
+        print(f"🧮 [RISK] Tra bảng: hit {st['hit_rate']:.1%} ({st['unique_rows']}/{st['rows']} bộ khác nhau từ lúc chạy)")
+
+
+class EdgeScorer:
+    """
+    Bộ chấm điểm cạnh của 1 request: chỉ mục + mảng hazard, hệ số ưu tiên dựng 1 LẦN,
+    sau đó chấm từng lô cạnh bất kỳ (cả hành lang một lượt, hoặc từng lô nhỏ khi tìm đường lười).
+    Điểm gốc (disaster, weather, crowd) và ETA KHÔNG phụ thuộc hệ số ưu tiên -> nhớ theo edge id,
+    đổi hệ số (with_preferences) chỉ phải ghép lại penalty (phiên re-weight, xem route_session.py).
+    """
+    def __init__(self, compact, env_data, curr_hour, vehicle_mode, preferences, is_weekend=False):
+        self.compact = compact
+        self.env_data = env_data
+        self.curr_hour = curr_hour
+        self.is_weekend = is_weekend
+        self.vehicle_mode = vehicle_mode
+        self.disaster_idx = standardization.create_spatial_index(env_data['disasters'])
+        self.weather_idx = standardization.create_spatial_index(env_data['weather'])
+        self.disaster_arrays = standardization.disaster_hazard_arrays(env_data['disasters'])
+        self.weather_arrays = standardization.weather_hazard_arrays(env_data['weather'])
+        self._set_factors(preferences)
+
+        # Nhớ penalty theo bộ đầu vào: nhiều cạnh cùng bộ điểm, các lô nhỏ không phải gọi lại model
+        self._penalty_memo = {}
+        # Điểm gốc + ETA đã tính, theo edge id (cấp phát khi cần)
+        self._known = None
+        self._eta = None
+        self._scores = None
+
+    def _set_factors(self, preferences):
+        def clip(val): return max(0.0, min(2.0, float(val)))
+        self.uf_disaster = clip(preferences.get('disaster', 1.0))
+        self.uf_weather  = clip(preferences.get('weather', 1.0))
+        self.uf_crowd    = clip(preferences.get('crowd', 1.0))
+
+    def with_preferences(self, preferences):
+        """Bản sao đổi hệ số ưu tiên, DÙNG CHUNG điểm gốc / ETA / penalty đã nhớ."""
+        other = copy.copy(self)
+        other._set_factors(preferences)
+        return other
+
+    def _hazard_scores(self, idx, arrays, edges, edge_bboxes):
+        if not len(arrays[3]):
+            return np.zeros(len(edges))   # không có vùng nào -> khỏi tra chỉ mục
+        return standardization.hazard_edge_scores(self.compact, edges, *arrays,
+                                                  candidates=idx.bulk_intersection(edge_bboxes))
+
+    def _predict(self, ai_inputs):
+        memo = self._penalty_memo
+        keys = [tuple(x) for x in ai_inputs]
+        missing = [list(k) for k in dict.fromkeys(k for k in keys if k not in memo)]
+        if missing:
+            preds = []
+            if risk_model:
+                try:
+                    if risk_lut is not None:
+                        preds = risk_lut.predict(missing)
+                    else:
+                        preds = risk_model.predict(missing)
+                except: preds = [(x[0]*1000 + x[1]*30 + x[2]*5) for x in missing]
+            else: preds = [(x[0]*1000 + x[1]*30 + x[2]*5) for x in missing]
+            memo.update(zip(map(tuple, missing), np.asarray(preds, dtype=np.float64).tolist()))
+        return [memo[k] for k in keys]
+
+    def _components(self, edges):
+        """Điểm gốc (n, 3): disaster, weather, crowd (đã cộng phạt xe lớn vào hẻm), chưa nhân hệ số."""
+        compact = self.compact
+        edge_ids = edges.tolist()
+
+        # Thiên tai & Thời tiết: kernel numpy trên hình học đã trải phẳng (1 lượt cho cả lô)
+        edge_bboxes = compact.edge_bounds()[edges]
+        s_disasters = self._hazard_scores(self.disaster_idx, self.disaster_arrays, edges, edge_bboxes)
+        s_weathers = self._hazard_scores(self.weather_idx, self.weather_arrays, edges, edge_bboxes)
+
+        # Đám đông: 1 lần gather cột khung giờ trong ma trận cạnh x khung giờ dựng sẵn lúc load
+        s_crowds = compact.crowd.scores(edges, self.curr_hour)
+
+        scores_real = []
+        for i, e in enumerate(edge_ids):
+            s_crowd = float(s_crowds[i])
+            # Phạt xe lớn vào đường nhỏ (OSM ghi nhiều loại đường -> không tính)
+            hw = '' if compact.highway_multi[e] else compact.highway_name(e)
+            if self.vehicle_mode in ['car', 'bus', 'truck'] and hw in ['residential', 'living_street']:
+                s_crowd += 5.0
+            scores_real.append((float(s_disasters[i]), float(s_weathers[i]), s_crowd))
+        return np.asarray(scores_real, dtype=np.float64).reshape(len(edge_ids), 3)
+
+    def penalties(self, scores):
+        """Điểm gốc (n, 3) x hệ số ưu tiên -> penalty >= 0 của risk model."""
+        ai_inputs = (scores * np.array([self.uf_disaster, self.uf_weather, self.uf_crowd])).tolist()
+        return np.maximum(0.0, np.asarray(self._predict(ai_inputs), dtype=np.float64))
+
+    def score(self, edges):
+        """Output: (penalties, scores) như RoutingEngine.score_edges."""
+        scores = self._components(edges)
+        return self.penalties(scores), scores
+
+    def raw(self, edges):
+        """
+        (etas, scores) của lô cạnh - phần không phụ thuộc hệ số ưu tiên, nhớ lại theo edge id.
+        """
+        if self._known is None:
+            m = self.compact.num_edges
+            self._known = np.zeros(m, dtype=bool)
+            self._eta = np.zeros(m)
+            self._scores = np.zeros((m, 3))
+        new = edges[~self._known[edges]]
+        if len(new):
+            scores = self._components(new)
+            # Tốc độ cơ bản dựng sẵn lúc load + điểm kẹt xe theo lô (có cache)
+            real_speed = standardization.calculate_segment_speeds(
+                self.compact.base_speed[new], self.curr_hour, self.is_weekend, scores[:, 1], self.vehicle_mode)
+            self._eta[new] = self.compact.length[new] / (real_speed / 3.6)
+            self._scores[new] = scores
+            self._known[new] = True
+        return self._eta[edges], self._scores[edges]
+
+    def weigh(self, edges):
+        """
+        Chấm điểm + ETA với traffic thật cho lô cạnh.
+        Output: (etas, penalties, scores) - final_weight = eta * (1 + penalty).
+        """
+        etas, scores = self.raw(edges)
+        return etas, self.penalties(scores), scores
+
+
 class RoutingEngine:
     def __init__(self):
         print("🚀 [CORE] Routing Engine khởi động...")
@@ -43,219 +215,611 @@ class RoutingEngine:
         if not graph_data:
             return {"status": "error", "message": "Không tải được bản đồ hoặc điểm đi/đến quá xa."}
             
-        sub_G, orig_node, dest_node, bbox = graph_data
+        corridor, orig_node, dest_node, snaps = graph_data
         
         # 2. Xử lý chính (Scan -> Weight -> Route)
-        return self._process_routing(sub_G, orig_node, dest_node, bbox, curr_hour, is_weekend, vehicle_mode, preferences)
+        result = self._process_routing(corridor, orig_node, dest_node, curr_hour, is_weekend, vehicle_mode, preferences, snaps)
+
+        # 3. Không có đường trong hành lang -> Nới rộng hành lang (chứ không nhảy thẳng lên cả thành phố)
+        widen = 1
+        while result.get('status') == 'error' and widen <= CORRIDOR_MAX_WIDEN and not corridor.is_full:
+            print(f"↔️ Không có đường trong hành lang, nới rộng lần {widen}...")
+            corridor, orig_node, dest_node, snaps = self._prepare_graph(start_coords, end_coords, vehicle_mode, widen)
+            result = self._process_routing(corridor, orig_node, dest_node, curr_hour, is_weekend, vehicle_mode, preferences, snaps)
+            widen += 1
+        return result
+
+    def reweight_routes(self, token, preferences=None):
+        """
+        Tìm lại với hệ số ưu tiên mới trên phiên đã có (route_session): không bám điểm,
+        không quét môi trường, không chấm lại hình học - chỉ ghép penalty và tìm đường.
+        Output: giống get_optimal_routes, hoặc None nếu phiên không tồn tại / đã hết hạn.
+        """
+        if preferences is None: preferences = {}
+        session = route_session.SESSIONS.get(token)
+        if session is None:
+            return None
+        print(f"🎚️ Re-weight phiên {token[:8]}: {session.vehicle_mode.upper()} | Prefs: {preferences}")
+        sc = session.scorer
+        return self._process_routing(session.corridor, session.orig_node, session.dest_node, sc.curr_hour,
+                                     sc.is_weekend, sc.vehicle_mode, preferences, session.snaps, session)
+
+    def get_pareto_routes(self, start_coords, end_coords, vehicle_mode="motorbike", preferences=None):
+        """
+        Các đường "đánh đổi" thời gian <-> rủi ro (tập Pareto, pareto.py) trong 1 lần tìm,
+        thay cho việc gọi get_optimal_routes nhiều lần với preferences khác nhau.
+        Output: giống get_optimal_routes (đường nhanh nhất + 'alternatives' an toàn dần), mỗi đường có
+        'pareto' (eta_s, risk), kèm 'pareto_search' (công sức tìm: số nhãn, chạm trần).
+        """
+        if preferences is None: preferences = {}
+        print(f"⚖️ Pareto: {vehicle_mode.upper()} | Prefs: {preferences}")
+
+        now = datetime.now()
+        curr_hour = now.hour + (now.minute / 60)
+        is_weekend = now.weekday() >= 5
+
+        graph_data = self._prepare_graph(start_coords, end_coords, vehicle_mode)
+        if not graph_data:
+            return {"status": "error", "message": "Không tải được bản đồ hoặc điểm đi/đến quá xa."}
+        corridor, orig_node, dest_node, snaps = graph_data
+        result = self._process_pareto(corridor, orig_node, dest_node, curr_hour, is_weekend, vehicle_mode, preferences, snaps)
+
+        widen = 1
+        while result.get('status') == 'error' and widen <= CORRIDOR_MAX_WIDEN and not corridor.is_full:
+            print(f"↔️ Không có đường trong hành lang, nới rộng lần {widen}...")
+            corridor, orig_node, dest_node, snaps = self._prepare_graph(start_coords, end_coords, vehicle_mode, widen)
+            result = self._process_pareto(corridor, orig_node, dest_node, curr_hour, is_weekend, vehicle_mode, preferences, snaps)
+            widen += 1
+        return result
 
-    def _prepare_graph(self, start, end, mode):
-        net_type = 'walk' if mode == 'walking' else 'drive'
-        G_full = traffic.load_graph_by_mode(net_type)
-        if G_full is None: return None
+    def _process_pareto(self, corridor, orig_node, dest_node, curr_hour, is_weekend, vehicle_mode, preferences, snaps=None):
+        compact = corridor.graph
+        env_data = self._scan_environment(corridor.bbox)
+        scorer = EdgeScorer(compact, env_data, curr_hour, vehicle_mode, preferences, is_weekend)
+        overlay = self._calculate_weights(corridor, scorer)
+        weights = overlay.search_weights()
+        eta, risk = overlay.criteria()
 
+        # Node ảo giữa cạnh: tách phần cạnh thành 2 chi phí (eta, risk)
+        source, target = self._endpoints(compact, orig_node, dest_node, snaps, weights)
+        if snaps and isinstance(source, dict):
+            risk_s = spatial_index.snap_sources(compact, snaps[0], risk)
+            source = {v: (c, risk_s[v]) for v, c in spatial_index.snap_sources(compact, snaps[0], eta).items()}
+        if snaps and isinstance(target, dict):
+            risk_t = spatial_index.snap_targets(compact, snaps[1], risk)
+            target = {v: (c, risk_t[v]) for v, c in spatial_index.snap_targets(compact, snaps[1], eta).items()}
+
+        t0 = time.perf_counter()
+        front = pareto.pareto_routes(compact, source, target, eta, risk, graph_engine.weight_lists(weights)[1],
+                                     self._max_speed_mps(compact, vehicle_mode))
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        print(f"⚖️ [PARETO] {len(front.routes)} đường, {front.labels} nhãn ({front.settled} chốt), {elapsed_ms:.1f} ms"
+              + (" - CHẠM TRẦN NHÃN" if front.truncated else ""))
+        if not front.routes:
+            return {"status": "error", "message": "Không tìm thấy đường đi an toàn."}
+
+        routes_found = []
+        for i, r in enumerate(front.routes):
+            if i == 0:
+                label = "Fastest Route"
+            elif i == len(front.routes) - 1:
+                label = "Safest Route"
+            else:
+                label = f"Trade-off {i}"
+            result = graph_engine.SearchResult(r.nodes, r.edges, r.eta, front.settled)
+            route_info = self._route_info(corridor, result, overlay, env_data, label, snaps)
+            route_info['pareto'] = {"eta_s": round(r.eta, 1), "risk": round(r.risk, 1)}
+            routes_found.append(route_info)
+
+        bbox = corridor.bbox
+        if corridor.is_full:
+            bbox = self._routes_bbox(routes_found)
+            env_data = self._scan_environment(bbox)
+
+        return {
+            **routes_found[0],
+            "alternatives": routes_found[1:],
+            "pareto_search": {"epsilon": pareto.PARETO_EPSILON, "labels": front.labels, "settled": front.settled,
+                       "truncated": front.truncated, "search_ms": round(elapsed_ms, 1)},
+            "map_data": {
+                "disasters": env_data['disasters'],
+                "weather": env_data['weather'],
+                "crowd": env_data['crowd'],
+                "bbox": bbox
+            }
+        }
+
+    def get_optimal_routes_batch(self, trips, vehicle_mode="motorbike", preferences=None):
+        """
+        Nhiều chuyến đi trong 1 request (công ty du lịch gửi cả chục chuyến một lúc):
+            - bám TẤT CẢ điểm trong 1 lần gọi vector hóa, quét môi trường 1 lần (1 snapshot hazard_store)
+            - 1 hành lang hợp của mọi chuyến -> mỗi cạnh chỉ chấm điểm 1 lần cho cả lô
+            - các chuyến chung điểm xuất phát gom thành 1 lần tìm 1-tới-nhiều (graph_engine.one_to_many)
+        trips: list {"start": [lat, lng], "end": [lat, lng]}.
+        Output: {"results": [...], "batch": thống kê} - results theo đúng thứ tự trips, mỗi phần tử là
+                thông tin đường tốt nhất (giống get_optimal_routes, không kèm đường phụ / map_data)
+                hoặc {"status": "error", "message": ...} của riêng chuyến đó.
+        """
+        if preferences is None: preferences = {}
+        t0 = time.perf_counter()
+        print(f"🧩 Lô {len(trips)} chuyến: {vehicle_mode.upper()} | Prefs: {preferences}")
+        results = [None] * len(trips)
+
+        # 1. Kiểm tra tọa độ từng chuyến
+        pending = []
+        for i, trip in enumerate(trips):
+            try:
+                start, end = trip.get('start'), trip.get('end')
+                pts = [float(start[0]), float(start[1]), float(end[0]), float(end[1])]
+                if not all(np.isfinite(pts)): raise ValueError
+                pending.append((i, pts))
+            except (AttributeError, TypeError, IndexError, ValueError):
+                results[i] = {"status": "error", "message": "Thiếu tọa độ start/end"}
+
+        net_type = self._net_type(vehicle_mode)
+        compact = traffic.load_compact_graph(net_type)
+        stats = {"trips": len(trips), "searches": 0, "scored_edges": 0, "rounds": 0}
+        if compact is None or not pending:
+            for i, _ in pending:
+                results[i] = {"status": "error", "message": "Không tải được bản đồ."}
+            return {"results": results, "batch": stats}
+
+        # 2. Bám mọi điểm trong 1 lần gọi
         try:
-            orig_node = ox.distance.nearest_nodes(G_full, start[1], start[0])
-            dest_node = ox.distance.nearest_nodes(G_full, end[1], end[0])
-            orig_point = G_full.nodes[orig_node]
-            dest_point = G_full.nodes[dest_node]
+            lats = [p[k] for _, p in pending for k in (0, 2)]
+            lons = [p[k] for _, p in pending for k in (1, 3)]
+            ends, snaps = self._snap_points(compact, net_type, lats, lons)
+        except Exception as e:
+            print(f"⚠️ Lỗi tìm node: {e}")
+            for i, _ in pending:
+                results[i] = {"status": "error", "message": "Không bám được điểm đi/đến vào bản đồ."}
+            return {"results": results, "batch": stats}
+        pairs = [(i, ends[2 * j], ends[2 * j + 1], (snaps[2 * j], snaps[2 * j + 1]) if snaps else None)
+                 for j, (i, _) in enumerate(pending)]
+
+        now = datetime.now()
+        curr_hour = now.hour + (now.minute / 60)
+        is_weekend = now.weekday() >= 5
+
+        # 3. Tìm trên hành lang hợp; chuyến nào không có đường thì nới rộng ở vòng sau (như get_optimal_routes)
+        widen = 0
+        while pairs:
+            corridor = self._batch_corridor(compact, net_type, [(orig, dest) for _, orig, dest, _ in pairs], widen)
+            failed = self._route_batch(corridor, pairs, curr_hour, is_weekend, vehicle_mode, preferences, results, stats)
+            stats['rounds'] += 1
+            if corridor.is_full or widen >= CORRIDOR_MAX_WIDEN:
+                break
+            pairs = failed
+            widen += 1
+        for i, *_ in failed:
+            results[i] = {"status": "error", "message": "Không tìm thấy đường đi an toàn."}
+
+        stats['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+        print(f"📦 [BATCH] {len(trips)} chuyến, {stats['searches']} lần tìm, chấm {stats['scored_edges']} cạnh, {stats['ms']} ms")
+        return {"results": results, "batch": stats}
+
+    def _batch_corridor(self, compact, net_type, node_pairs, widen):
+        """Hành lang hợp (BBox bao hành lang của từng cặp node), hoặc cả bản đồ với CCH / chấm điểm lười."""
+        corridors = traffic.load_corridor_index(net_type)
+        if self._use_cch(compact) or self._use_lazy_weights(compact):
+            return corridors.full_corridor()
+        boxes = [self._pair_bbox(compact, orig, dest, widen)[0] for orig, dest in node_pairs]
+        bbox = (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+        return corridors.corridor(bbox)
+
+    def _route_batch(self, corridor, pairs, curr_hour, is_weekend, vehicle_mode, preferences, results, stats):
+        """1 vòng của get_optimal_routes_batch: ghi kết quả vào `results`, trả về các chuyến chưa có đường."""
+        compact = corridor.graph
+        env_data = self._scan_environment(corridor.bbox)
+        scorer = EdgeScorer(compact, env_data, curr_hour, vehicle_mode, preferences, is_weekend)
+        overlay = self._calculate_weights(corridor, scorer)
+        weights = overlay.search_weights()
+
+        # Gom theo điểm xuất phát (node, hoặc tập node ảo khi bám giữa cạnh)
+        groups = {}
+        for pair in pairs:
+            _, orig, dest, snaps = pair
+            source, target = self._endpoints(compact, orig, dest, snaps, weights)
+            key = tuple(sorted(source.items())) if isinstance(source, dict) else source
+            groups.setdefault(key, (source, []))[1].append((pair, target))
+
+        failed = []
+        for source, members in groups.values():
+            if len(members) > 1 and ROUTING_BACKEND == "csr":
+                found = graph_engine.one_to_many(compact, source, [t for _, t in members], weights)
+                mode = "one_to_many"
+            else:
+                found = [self._shortest_path(corridor, source, t, weights, vehicle_mode) for _, t in members]
+                mode = None
+            stats['searches'] += 1 if mode else len(members)
+            for (pair, _), result in zip(members, found):
+                if result is None:
+                    failed.append(pair)
+                    continue
+                route_info = self._route_info(corridor, result, overlay, env_data, "Best Route", pair[3])
+                if mode:
+                    route_info['search']['mode'] = mode
+                results[pair[0]] = route_info
+        stats['scored_edges'] += getattr(overlay, 'num_scored', corridor.num_edges)
+        return failed
+
+    def get_travel_matrix(self, origins, destinations=None, vehicle_mode="motorbike", preferences=None, stream=False):
+        """
+        Ma trận N x M thời gian đi + rủi ro (travel_matrix.py), cùng mô hình final_weight với get_optimal_routes.
+        origins / destinations: list [lat, lng] hoặc {"lat", "lng", ...};
+        destinations = None: các điểm tham quan của crowd_zones.json nằm trong bản đồ.
+        Output: {"origins", "destinations", "eta" (float32 N x M, giây), "risk" (float32, penalty * mét), "stats"},
+                inf = không tới được. stream=True: thay eta/risk bằng "rows" - generator
+                (i, hàng eta, hàng risk, số node chốt) tính dần từng điểm đi.
+                Lỗi: {"status": "error", "message": ...}
+        """
+        if preferences is None: preferences = {}
+        net_type = self._net_type(vehicle_mode)
+        compact = traffic.load_compact_graph(net_type)
+        if compact is None:
+            return {"status": "error", "message": "Không tải được bản đồ."}
+
+        def parse(points):
+            out = []
+            for p in points:
+                lat, lng = (p.get('lat'), p.get('lng')) if isinstance(p, dict) else (p[0], p[1])
+                lat, lng = float(lat), float(lng)
+                if not (np.isfinite(lat) and np.isfinite(lng)): raise ValueError
+                item = dict(p) if isinstance(p, dict) else {}
+                item.update(lat=lat, lng=lng)
+                out.append(item)
+            return out
+
+        if destinations is None:
+            # Điểm tham quan trong khung bản đồ (crowd_zones.json phủ rộng hơn thành phố)
+            south, west, north, east = float(compact.y.min()), float(compact.x.min()), float(compact.y.max()), float(compact.x.max())
+            destinations = [{"name": z.get('name'), "type": z.get('type'), "lat": z['lat'], "lng": z['lng']}
+                            for z in standardization.CROWD_ZONES
+                            if south <= z['lat'] <= north and west <= z['lng'] <= east]
+        try:
+            origins, destinations = parse(origins), parse(destinations)
+        except (AttributeError, TypeError, IndexError, KeyError, ValueError):
+            return {"status": "error", "message": "Tọa độ origins/destinations không hợp lệ"}
+        if not origins or not destinations:
+            return {"status": "error", "message": "Thiếu điểm đi hoặc điểm đến"}
+        if len(origins) * len(destinations) > MATRIX_MAX_CELLS:
+            return {"status": "error", "message": f"Ma trận tối đa {MATRIX_MAX_CELLS} ô"}
+        print(f"🧮 Ma trận {len(origins)}x{len(destinations)}: {vehicle_mode.upper()} | Prefs: {preferences}")
+
+        # 1 lần bám cho mọi điểm, 1 hành lang hợp, 1 lần quét môi trường, 1 overlay cho cả ma trận
+        pts = origins + destinations
+        try:
+            nodes, _ = self._snap_points(compact, net_type, [p['lat'] for p in pts], [p['lng'] for p in pts])
+        except Exception as e:
+            print(f"⚠️ Lỗi tìm node: {e}")
+            return {"status": "error", "message": "Không bám được điểm vào bản đồ."}
+        src, dst = nodes[:len(origins)], nodes[len(origins):]
+        corridor = self._batch_corridor(compact, net_type, [(o, d) for o in set(src) for d in set(dst)], 0)
+
+        now = datetime.now()
+        env_data = self._scan_environment(corridor.bbox)
+        scorer = EdgeScorer(compact, env_data, now.hour + now.minute / 60, vehicle_mode, preferences, now.weekday() >= 5)
+        overlay = self._calculate_weights(corridor, scorer)
+        weights = overlay.search_weights()
+        eta, risk = overlay.criteria()
+
+        result = {"origins": origins, "destinations": destinations,
+                  "stats": {"corridor_nodes": len(corridor.nodes)}}
+        if stream:
+            result['rows'] = travel_matrix.matrix_rows(compact, src, dst, weights, eta, risk)
+            return result
+        t0 = time.perf_counter()
+        mat = travel_matrix.travel_matrix(compact, src, dst, weights, eta, risk)
+        result.update(eta=mat.eta, risk=mat.risk)
+        result['stats'].update(settled=mat.settled, scored_edges=getattr(overlay, 'num_scored', corridor.num_edges),
+                               ms=round((time.perf_counter() - t0) * 1000, 1))
+        print(f"🧮 [MATRIX] {mat.eta.size} ô, chốt {mat.settled} node, {result['stats']['ms']} ms")
+        return result
+
+    def _net_type(self, mode):
+        return 'walk' if mode == 'walking' else 'drive'
+
+    def _prepare_graph(self, start, end, mode, widen=0):
+        """
+        Bám điểm đi/đến + cắt hành lang (Corridor) quanh 2 điểm.
+        Hành lang là view trên bản CSR dùng chung, KHÔNG copy đồ thị.
+        `widen`: số lần nới rộng (buffer x2 mỗi lần).
+        """
+        net_type = self._net_type(mode)
+        compact = traffic.load_compact_graph(net_type)
+        if compact is None: return None
+
+        # Bám điểm bằng KD-tree dựng sẵn lúc load (1 lần gọi vector hóa cho cả 2 điểm)
+        try:
+            ends, snaps = self._snap_points(compact, net_type, [start[0], end[0]], [start[1], end[1]])
+            orig_node, dest_node = ends
         except Exception as e:
             print(f"⚠️ Lỗi tìm node: {e}")
             return None
+        if self._use_cch(compact) or self._use_lazy_weights(compact):
+            # CCH / chấm điểm lười: tìm trên toàn bản đồ, không cần cắt hành lang theo BBox
+            return traffic.load_corridor_index(net_type).full_corridor(), orig_node, dest_node, snaps
+
+        bbox, buffer = self._pair_bbox(compact, orig_node, dest_node, widen)
+        print(f"✂️ Dynamic Buffer: {buffer:.4f} (cho quãng đường ngắn)")
+
+        # Cắt hành lang bằng lưới chỉ mục (chi phí theo kích thước hành lang, không theo cả thành phố)
+        corridor = traffic.load_corridor_index(net_type).corridor(bbox)
+        if not (corridor.contains(orig_node) and corridor.contains(dest_node)):
+            # Điểm đi/đến lọt ra ngoài hộp -> Nới rộng hành lang
+            if widen < CORRIDOR_MAX_WIDEN:
+                return self._prepare_graph(start, end, mode, widen + 1)
+        return corridor, orig_node, dest_node, snaps
+
+    def _snap_points(self, compact, net_type, lats, lons):
+        """
+        Bám N điểm trong 1 lần gọi vector hóa.
+        Output: (list node đại diện, list EdgeSnap hoặc None nếu SNAP_MODE = "node").
+        """
+        snapper = traffic.load_snap_index(net_type)
+        if SNAP_MODE == "edge":
+            snaps = snapper.snap_edges(lats, lons)
+            # Node đại diện (để tính BBox / nhánh networkx): đầu mút gần hơn của cạnh
+            return [int(compact.sources[s.edge]) if s.t < 0.5 else int(compact.targets[s.edge]) for s in snaps], snaps
+        ends, _ = snapper.snap_nodes(lats, lons)
+        return [int(v) for v in ends], None
+
+    def _pair_bbox(self, compact, orig_node, dest_node, widen=0):
+        """BBox hành lang quanh 2 node với buffer động. Output: (bbox, buffer)."""
+        orig_y, orig_x = compact.y[orig_node], compact.x[orig_node]
+        dest_y, dest_x = compact.y[dest_node], compact.x[dest_node]
 
         # Tính khoảng cách Manhattan sơ bộ để ước lượng độ xa
-        dist_lat = abs(orig_point['y'] - dest_point['y'])
-        dist_lon = abs(orig_point['x'] - dest_point['x'])
+        dist_lat = abs(orig_y - dest_y)
+        dist_lon = abs(orig_x - dest_x)
         
         # Buffer động: Tối thiểu 0.005 (500m) cho đường cực ngắn, tối đa 0.03 (3km) cho đường xa
         # Công thức: Lấy khoảng cách lớn nhất giữa 2 điểm * 1.5 để có không gian thở
         raw_buffer = max(dist_lat, dist_lon) * 0.5
-        buffer = max(0.003, min(0.03, raw_buffer))
+        buffer = max(0.003, min(0.03, raw_buffer)) * (2 ** widen)
         
-        print(f"✂️ Dynamic Buffer: {buffer:.4f} (cho quãng đường ngắn)")
-        north = max(orig_point['y'], dest_point['y']) + buffer
-        south = min(orig_point['y'], dest_point['y']) - buffer
-        east = max(orig_point['x'], dest_point['x']) + buffer
-        west = min(orig_point['x'], dest_point['x']) - buffer
-        bbox = (south, west, north, east)
-
-        try:
-            nodes_in_bbox = [
-                n for n, d in G_full.nodes(data=True) 
-                if south < d['y'] < north and west < d['x'] < east
-            ]
-            sub_G = G_full.subgraph(nodes_in_bbox).copy()
-            if orig_node not in sub_G.nodes or dest_node not in sub_G.nodes:
-                return G_full, orig_node, dest_node, bbox
-            return sub_G, orig_node, dest_node, bbox
-        except:
-            return G_full, orig_node, dest_node, bbox
+        north = float(max(orig_y, dest_y) + buffer)
+        south = float(min(orig_y, dest_y) - buffer)
+        east = float(max(orig_x, dest_x) + buffer)
+        west = float(min(orig_x, dest_x) - buffer)
+        return (south, west, north, east), buffer
 
     def _scan_environment(self, bbox):
         """
         Quét dữ liệu môi trường CHỈ TRONG HỘP (BBox).
         Đây chính là dữ liệu 'Minh Chứng' mà Frontend sẽ vẽ.
+        Đọc từ snapshot của hazard_store (thread nền làm mới) -> không chờ mạng.
         """
-        south, west, north, east = bbox
-        
-        # --- 1. THIÊN TAI (Disasters) ---
-        raw_disasters = []
-        
-        # Bước A: Cố gắng lấy data từ nguồn (File thật hoặc Mock)
-        if os.path.exists('real_disasters.json'):
-            try:
-                with open('real_disasters.json', 'r', encoding='utf-8') as f:
-                    raw_disasters = json.load(f)
-            except: pass
-            
-        # Nếu không có file thật, gọi hàm lấy Mock (Lấy rộng ra 50km để chắc chắn không sót)
-        if not raw_disasters:
-            mid_lat, mid_lng = (south+north)/2, (west+east)/2
-            # Lưu ý: Hàm này trả về mọi thứ trong bán kính 50km
-            raw_disasters = disasters.get_natural_disasters(mid_lat, mid_lng, max_distance_km=50)
-
-        # Bước B: [QUAN TRỌNG] CẮT GỌT THEO HỘP (CLIPPING)
-        # Bất kể data đến từ đâu, nếu không nằm trong hộp BBox thì loại bỏ thẳng tay
-        disaster_zones = [
-            d for d in raw_disasters
-            if south <= d['lat'] <= north and west <= d['lng'] <= east
-        ]
-
-        # 2. Thời tiết (Realtime Grid Scan)
-        weather_zones = weather.get_weather_zones(bbox) # Hàm này đã có logic grid
-
-        # 3. Đám đông (Lọc từ global list)
-        crowd_zones = [
-            c for c in CROWD_ZONES 
-            if south < c['lat'] < north and west < c['lng'] < east
-        ]
-
-        print(f"📦 Môi trường trong hộp: {len(disaster_zones)} Disaster | {len(weather_zones)} Weather | {len(crowd_zones)} Crowd")
-        
-        return {
-            "disasters": disaster_zones,
-            "weather": weather_zones,
-            "crowd": crowd_zones
-        }
+        snap = hazard_store.STORE.snapshot()
+        env = snap.scan(bbox)
+        if snap.version == 0:
+            start_hazard_store()
+            print("⚠️ [HAZARD] Dữ liệu môi trường chưa nạp xong (thread nền đang chạy).")
 
-    def _calculate_weights(self, sub_G, env_data, curr_hour, is_weekend, vehicle_mode, preferences):
-        # ... (Giữ nguyên logic tính toán trọng số y hệt file cũ) ...
-        # Để tiết kiệm dung lượng hiển thị, mình xin phép tóm tắt phần này
-        # Logic: Duyệt cạnh -> Check cắt Disaster/Weather -> Gọi AI Model -> Gán final_weight
-        # (Copy nguyên hàm _calculate_weights từ file cũ vào đây nhé, không thay đổi gì)
-        
-        print(f"⚖️ Đang tính trọng số cho {sub_G.number_of_edges()} cạnh...")
-        base_traffic_score = standardization.calculate_traffic_score(curr_hour, is_weekend, weather_score=0.0)
-        disaster_idx = standardization.create_spatial_index(env_data['disasters'])
-        weather_idx  = standardization.create_spatial_index(env_data['weather'])
-        
-        def clip(val): return max(0.0, min(2.0, float(val)))
-        uf_disaster = clip(preferences.get('disaster', 1.0))
-        uf_weather  = clip(preferences.get('weather', 1.0))
-        uf_crowd    = clip(preferences.get('crowd', 1.0))
-        uf_traffic  = clip(preferences.get('traffic', 1.0))
+        print(f"📦 Môi trường trong hộp: {len(env['disasters'])} Disaster | {len(env['weather'])} Weather | "
+              f"{len(env['crowd'])} Crowd (snapshot v{snap.version})")
+        return env
 
-        edge_pointers = []
-        ai_inputs = []
+    def _calculate_weights(self, corridor, scorer):
+        """
+        Tính trọng số cho các cạnh trong hành lang bằng bộ chấm điểm `scorer` (EdgeScorer).
+        KHÔNG ghi vào đồ thị dùng chung: kết quả nằm trong WeightOverlay riêng của request.
+        WEIGHT_MODE = "lazy": cạnh được chấm khi thuật toán tìm đường duyệt tới.
+        """
+        compact = corridor.graph
+        if self._use_lazy_weights(compact):
+            return edge_weights.LazyWeightOverlay(corridor, scorer.weigh)
 
-        for u, v, data in sub_G.edges(data=True):
-            node_u, node_v = sub_G.nodes[u], sub_G.nodes[v]
-            edge_bbox = (min(node_u['x'], node_v['x']), min(node_u['y'], node_v['y']), max(node_u['x'], node_v['x']), max(node_u['y'], node_v['y']))
-            
-            s_disaster = 0
-            pot_d = list(disaster_idx.intersection(edge_bbox))
-            if pot_d: s_disaster = standardization.calculate_disaster_impact_advanced(data, node_u, node_v, [env_data['disasters'][i] for i in pot_d])
+        print(f"⚖️ Đang tính trọng số cho {corridor.num_edges} cạnh...")
+        etas, penalties, scores = scorer.weigh(corridor.edges)
+        _print_lut_stats()
 
-            s_weather = 0
-            pot_w = list(weather_idx.intersection(edge_bbox))
-            if pot_w: s_weather = standardization.calculate_weather_impact_geometry(data, node_u, node_v, [env_data['weather'][i] for i in pot_w])
+        # Trọng số cuối cùng: final_weight = eta * (1 + penalty), ghi vào overlay của request
+        overlay = edge_weights.WeightOverlay(corridor)
+        overlay.assign(etas, penalties, scores[:, 0], scores[:, 1], scores[:, 2])
+        return overlay
 
-            mid_lat, mid_lon = (node_u['y'] + node_v['y']) / 2, (node_u['x'] + node_v['x']) / 2
-            s_crowd = standardization.calculate_crowd_score(mid_lat, mid_lon, curr_hour)
+    def score_edges(self, compact, edges, env_data, curr_hour, vehicle_mode, preferences):
+        """
+        Điểm rủi ro của các cạnh `edges` (dùng chung cho tìm đường và tile heatmap).
+        Output: (penalties, scores) - penalty >= 0 của risk model và mảng (n, 3) điểm gốc
+        (disaster, weather, crowd) chưa nhân hệ số ưu tiên.
+        """
+        result = EdgeScorer(compact, env_data, curr_hour, vehicle_mode, preferences).score(edges)
+        _print_lut_stats()
+        return result
 
-            # Phạt xe lớn vào đường nhỏ
-            hw = data.get('highway', '')
-            if vehicle_mode in ['car', 'bus', 'truck'] and hw in ['residential', 'living_street']:
-                s_crowd += 5.0
+    def _shortest_path(self, corridor, source, target, weights, vehicle_mode):
+        """Gọi backend tìm đường. Cả 2 backend chỉ ĐỌC mảng weights, không ghi vào đồ thị."""
+        compact = corridor.graph
+        if ROUTING_BACKEND == "networkx":
+            # Bản tham chiếu: networkx trên subgraph VIEW (không copy) của hành lang
+            if isinstance(source, dict): source = min(source, key=source.get)
+            if isinstance(target, dict): target = min(target, key=target.get)
+            G_full = traffic.load_graph_by_mode(self._net_type(vehicle_mode))
+            G_view = G_full.subgraph(compact.to_osmids(corridor.nodes))
+            return graph_engine.reference_shortest_path(G_view, compact, source, target, weights)
+        if self._use_cch(compact):
+            t0 = time.perf_counter()
+            metric = compact.cch.customize(weights)
+            print(f"⚙️ [CCH] Customize {compact.cch.num_arcs} cung: {(time.perf_counter() - t0) * 1000:.1f} ms")
+            return metric.query(source, target)
+        if SEARCH_MODE == "alt" and compact.landmarks is not None:
+            seeds = source if isinstance(source, dict) else {source: 0.0}
+            goals = target if isinstance(target, dict) else {target: 0.0}
+            return graph_engine.bidirectional_astar(compact, seeds, goals, weights,
+                                                    bounds=self._landmark_bounds(corridor, seeds, goals))
+        if SEARCH_MODE in ("bidir_astar", "alt"):
+            return graph_engine.bidirectional_astar(compact, source, target, weights,
+                                                    self._max_speed_mps(compact, vehicle_mode))
+        return graph_engine.shortest_path(compact, source, target, weights)
 
-            ai_inputs.append([s_disaster * uf_disaster, s_weather * uf_weather, s_crowd * uf_crowd])
-            edge_pointers.append(data)
-            data['scores_real'] = (s_disaster, s_weather, s_crowd)
+    def _append_route(self, routes_found, corridor, result, overlay, env_data, labels, snaps=None):
+        """Thêm đường vào routes_found (nhãn theo thứ tự) nếu không trùng đường đã có."""
+        compact = corridor.graph
+        path = result.nodes
+        mid_node = int(compact.osmids[path[len(path)//2]])
+        for existing in routes_found:
+            # So sánh độ dài path (số node) và node giữa cho nhanh
+            if len(path) == existing['_path_len'] and mid_node == existing['_mid_node']:
+                return False
+        route_info = self._route_info(corridor, result, overlay, env_data, labels[len(routes_found)], snaps)
+        route_info['_mid_node'] = mid_node # Lưu node giữa để check trùng
+        route_info['_path_len'] = len(path)
+        routes_found.append(route_info)
+        return True
 
-        # Predict
-        preds = []
-        if risk_model and ai_inputs:
-            try: preds = risk_model.predict(ai_inputs)
-            except: preds = [(x[0]*1000 + x[1]*30 + x[2]*5) for x in ai_inputs]
-        else: preds = [(x[0]*1000 + x[1]*30 + x[2]*5) for x in ai_inputs]
+    def _routes_bbox(self, routes):
+        lats = [p[0] for r in routes for p in r['geometry']]
+        lngs = [p[1] for r in routes for p in r['geometry']]
+        pad = MAP_DATA_PAD_DEG
+        return (min(lats) - pad, min(lngs) - pad, max(lats) + pad, max(lngs) + pad)
 
-        for i, data in enumerate(edge_pointers):
-            penalty = float(max(0.0, preds[i]))
-            s_d, s_w, s_c = data['scores_real']
-            
-            # Tính lại ETA với traffic thật
-            real_speed = standardization.calculate_segment_speed(data, curr_hour, is_weekend, s_w, vehicle_mode)
-            eta = data.get('length', 10) / (real_speed / 3.6)
-            
-            # Trọng số cuối cùng
-            data['final_weight'] = eta * (1.0 + penalty)
-            data['meta_info'] = {
-                'eta': eta, 'penalty': penalty,
-                'risk_flags': {'disaster': s_d>0, 'weather': s_w>0, 'crowd': s_c>0.7}
-            }
-            del data['scores_real']
+    def _endpoints(self, compact, orig_node, dest_node, snaps, weights):
+        """Điểm đầu/cuối cho tìm đường: node, hoặc dict node ảo giữa cạnh khi có snaps."""
+        source, target = orig_node, dest_node
+        if snaps:
+            # Node ảo giữa cạnh (nếu cạnh nằm ngoài hành lang thì quay về node đại diện)
+            source = spatial_index.snap_sources(compact, snaps[0], weights) or source
+            target = spatial_index.snap_targets(compact, snaps[1], weights) or target
+        return source, target
+
+    def _alternative_routes(self, corridor, source, target, weights, vehicle_mode):
+        """Đường tốt nhất + đường thay thế từ 1 lần tìm 2 chiều (alternatives.py), cùng cận A* với SEARCH_MODE."""
+        compact = corridor.graph
+        if SEARCH_MODE == "alt" and compact.landmarks is not None:
+            seeds = source if isinstance(source, dict) else {source: 0.0}
+            goals = target if isinstance(target, dict) else {target: 0.0}
+            return alternatives.alternative_routes(compact, seeds, goals, weights,
+                                                   speed_mps=self._max_speed_mps(compact, vehicle_mode),
+                                                   bounds=self._landmark_bounds(corridor, seeds, goals))
+        if SEARCH_MODE in ("bidir_astar", "alt"):
+            return alternatives.alternative_routes(compact, source, target, weights,
+                                                   speed_mps=self._max_speed_mps(compact, vehicle_mode))
+        return alternatives.alternative_routes(compact, source, target, weights)
+
+    def _route_info(self, corridor, result, overlay, env_data, label, snaps=None):
+        compact = corridor.graph
+        route_info = self._audit_route(compact, result.nodes, result.edges, overlay, env_data, label)
+        # Công sức tìm kiếm (số node đã chốt) để so các thuật toán
+        route_info['search'] = {"mode": SEARCH_MODE if ROUTING_BACKEND == "csr" else "networkx",
+                                "settled": result.settled, "corridor_nodes": len(corridor.nodes),
+                                "scored_edges": getattr(overlay, 'num_scored', corridor.num_edges)}
+        if snaps:
+            # Nối thêm điểm chiếu (node ảo) vào 2 đầu để đường vẽ chạm đúng vị trí người dùng
+            route_info['geometry'] = [[snaps[0].lat, snaps[0].lng]] + route_info['geometry'] + [[snaps[1].lat, snaps[1].lng]]
+        return route_info
+
+    def _landmark_bounds(self, corridor, seeds, goals):
+        # Cả bản đồ: tính cận lười theo node được duyệt thay vì cho mọi node
+        return corridor.graph.landmarks.bounds(seeds, goals, None if corridor.is_full else corridor.nodes)
+
+    def _use_lazy_weights(self, compact):
+        return WEIGHT_MODE == "lazy" and ROUTING_BACKEND == "csr" and not self._use_cch(compact)
+
+    def _use_via_alternatives(self, compact):
+        # CCH không giữ cây tìm kiếm -> vẫn dùng cách phạt trọng số
+        return ALTERNATIVES_MODE == "via" and ROUTING_BACKEND == "csr" and not self._use_cch(compact)
+
+    def _use_cch(self, compact):
+        return SEARCH_MODE == "cch" and ROUTING_BACKEND == "csr" and compact.cch is not None
+
+    def _max_speed_mps(self, compact, vehicle_mode):
+        """
+        Tốc độ lớn nhất phương tiện có thể đạt (m/s) -> cận dưới thời gian cho A*.
+        Tốc độ thực = max(5, tốc độ cơ bản * hiệu suất <= 1) nên không vượt max(5, tốc độ cơ bản lớn nhất).
+        """
+        if vehicle_mode == "walking" or compact.base_speed is None or not len(compact.base_speed):
+            kmh = WALK_SPEED_KMH if vehicle_mode == "walking" else 130.0
+        else:
+            kmh = max(WALK_SPEED_KMH, float(compact.base_speed.max()))
+        return kmh / 3.6
+
+    def _process_routing(self, corridor, orig_node, dest_node, curr_hour, is_weekend, vehicle_mode, preferences, snaps=None, session=None):
+        bbox = corridor.bbox
+        compact = corridor.graph
 
-    def _process_routing(self, sub_G, orig_node, dest_node, bbox, curr_hour, is_weekend, vehicle_mode, preferences):
-        # 1. Quét môi trường (Lấy data minh chứng)
-        env_data = self._scan_environment(bbox)
+        if session is None:
+            # 1. Quét môi trường (Lấy data minh chứng)
+            env_data = self._scan_environment(bbox)
+            scorer = EdgeScorer(compact, env_data, curr_hour, vehicle_mode, preferences, is_weekend)
+        else:
+            # Phiên re-weight: môi trường + điểm gốc đã có, chỉ đổi hệ số ưu tiên
+            env_data = session.scorer.env_data
+            scorer = session.scorer.with_preferences(preferences)
         
-        # 2. Tính trọng số
-        self._calculate_weights(sub_G, env_data, curr_hour, is_weekend, vehicle_mode, preferences)
+        # 2. Tính trọng số (overlay riêng của request này)
+        overlay = self._calculate_weights(corridor, scorer)
+        weights = overlay.search_weights()
         
-        # 3. Tìm 3 Tuyến Đường (Loop 3 lần)
+        # 3. Tìm 3 Tuyến Đường
         routes_found = []
         labels = ["Best Route", "Alternative 1", "Alternative 2"] # 1 Chính, 2 Phụ
-        
-        for i in range(3): # Lặp 3 lần
+
+        penalty_rounds = 3
+        if self._use_via_alternatives(compact):
+            # 1 lần tìm 2 chiều -> đường tốt nhất + đường thay thế (via-node), không phạt trọng số
+            try:
+                source, target = self._endpoints(compact, orig_node, dest_node, snaps, weights)
+                results = self._alternative_routes(corridor, source, target, weights, vehicle_mode)
+            except Exception as e:
+                # Lỗi ở nhánh via -> vẫn trả đường bằng cách cũ bên dưới (tìm thường + phạt x3)
+                print(f"Lỗi tìm đường thay thế (via), chuyển sang cách phạt trọng số: {e}")
+                results = []
+            if results:
+                print(f"🔀 [via] {len(results) - 1} đường thay thế, chốt {results[0].settled} lượt node (2 cây + T-test), hành lang {len(corridor.nodes)} node")
+            for result in results[:len(labels)]:
+                self._append_route(routes_found, corridor, result, overlay, env_data, labels, snaps)
+                overlay.penalize(result.edges, 3.0)
+            # Bộ lọc via (stretch / overlap / T-test) hay loại hết ứng viên -> bù bằng cách phạt trọng số
+            penalty_rounds = len(labels) - len(routes_found)
+            if routes_found and penalty_rounds:
+                print(f"🔀 [via] Thiếu {penalty_rounds} đường thay thế, bù bằng cách phạt trọng số")
+
+        for i in range(penalty_rounds): # Cách cũ: tìm -> phạt x3 các cạnh vừa đi -> tìm lại
             try:
                 # Tìm đường ngắn nhất theo trọng số đã tính
-                path = nx.shortest_path(sub_G, orig_node, dest_node, weight='final_weight')
-                
-                # Kiểm tra trùng lặp: Nếu đường này giống y hệt đường trước thì bỏ qua
-                is_duplicate = False
-                for existing in routes_found:
-                    # So sánh độ dài path (số node) và node đầu/cuối/giữa cho nhanh
-                    if len(path) == len(existing['geometry']) and path[len(path)//2] == existing['_mid_node']:
-                        is_duplicate = True
-                        break
-                
-                if not is_duplicate:
-                    # Audit lộ trình (Tính tổng risk, gắn nhãn)
-                    route_info = self._audit_route(sub_G, path, env_data, labels[len(routes_found)])
-                    route_info['_mid_node'] = path[len(path)//2] # Lưu node giữa để check trùng
-                    routes_found.append(route_info)
-                
+                source, target = self._endpoints(compact, orig_node, dest_node, snaps, weights)
+                result = self._shortest_path(corridor, source, target, weights, vehicle_mode)
+                if result is None: raise nx.NetworkXNoPath()
+                if ROUTING_BACKEND == "csr":
+                    print(f"🔍 [{SEARCH_MODE}] Chốt {result.settled}/{len(corridor.nodes)} node trong hành lang")
+
+                # Audit lộ trình (Tính tổng risk, gắn nhãn) nếu không trùng đường đã có
+                self._append_route(routes_found, corridor, result, overlay, env_data, labels, snaps)
+
                 # --- PHẠT TRỌNG SỐ (PENALTY) ĐỂ TÌM ĐƯỜNG KHÁC ---
                 # Nhân trọng số các cạnh của đường vừa tìm được lên X lần
                 # Để lần lặp sau thuật toán Dijkstra buộc phải né đường này ra
-                for k in range(len(path) - 1):
-                    u, v = path[k], path[k+1]
-                    if sub_G.has_edge(u, v):
-                        for key in sub_G[u][v]:
-                            # Nhân 3.0 để phạt nặng -> Ép đi đường khác hẳn
-                            sub_G[u][v][key]['final_weight'] *= 3.0 
-                            
+                # (Nhân 3.0 trên overlay của request, không đụng vào đồ thị dùng chung)
+                overlay.penalize(result.edges, 3.0)
+
             except nx.NetworkXNoPath:
                 break # Hết đường rồi
             except Exception as e:
                 print(f"Lỗi tìm đường phụ {i}: {e}")
                 break
-                
+
             # Nếu tìm đủ 3 đường rồi thì dừng sớm
-            if len(routes_found) >= 3: break
+            if len(routes_found) >= len(labels): break
+
+        if isinstance(overlay, edge_weights.LazyWeightOverlay):
+            print(f"🐢 [LAZY] Đã chấm {overlay.num_scored}/{corridor.num_edges} cạnh ({overlay.num_batches} lô)")
+            _print_lut_stats()
 
         if not routes_found:
              return {"status": "error", "message": "Không tìm thấy đường đi an toàn."}
+
+        if corridor.is_full:
+            # Hộp "minh chứng" cho frontend: quanh các tuyến, không phải cả thành phố
+            bbox = self._routes_bbox(routes_found)
+            env_data = self._scan_environment(bbox)
              
+        # Lưu phiên để kéo thanh trượt ưu tiên không phải tìm lại từ đầu
+        if session is None:
+            session = route_session.RouteSession(corridor, orig_node, dest_node, snaps, scorer)
+            route_session.SESSIONS.put(session)
+
         # 4. Trả kết quả kèm Map Data (Minh chứng)
         # Frontend sẽ dùng cục "map_data" này để vẽ vòng tròn
         return {
@@ -266,13 +830,13 @@ class RoutingEngine:
                 "weather": env_data['weather'],
                 "crowd": env_data['crowd'],
                 "bbox": bbox # Gửi luôn tọa độ hộp về cho chắc
-            }
+            },
+            "session": session.token # Gửi lại kèm preferences mới ở /api/find-routes/reweight
         }
 
-    def _audit_route(self, G, route_nodes, env_data, route_name="Route"):
+    def _audit_route(self, G, route_nodes, route_edges, overlay, env_data, route_name="Route"):
         # (Hàm này giữ nguyên như cũ, chỉ trả về JSON thống kê)
-        # ... Copy nội dung hàm _audit_route cũ vào đây ...
-        # (Mình viết gọn lại phần return để bạn dễ hình dung)
+        # G: bản CSR, route_nodes/route_edges: id nội bộ, overlay: trọng số của request
         
         total_dist = 0
         total_eta = 0
@@ -281,23 +845,21 @@ class RoutingEngine:
         hit_disasters = set()
         hit_weathers = set()
         
-        for i in range(len(route_nodes) - 1):
-            u, v = route_nodes[i], route_nodes[i+1]
-            data = G.get_edge_data(u, v)[0]
-            meta = data.get('meta_info', {})
-            length = data.get('length', 10)
+        for u, e in zip(route_nodes[:-1], route_edges):
+            m = overlay.meta_info(e)
+            length = float(G.length[e])
             
             total_dist += length
-            total_eta += meta.get('eta', 0)
-            total_risk += (meta.get('penalty',0) * length)
+            total_eta += m.get('eta', 0)
+            total_risk += (m.get('penalty',0) * length)
             
-            path_coords.append([G.nodes[u]['y'], G.nodes[u]['x']])
+            path_coords.append([float(G.y[u]), float(G.x[u])])
             
-            flags = meta.get('risk_flags', {})
+            flags = m.get('risk_flags', {})
             if flags.get('disaster'): hit_disasters.add("Vùng nguy hiểm")
             if flags.get('weather'): hit_weathers.add("Mưa/Gió")
 
-        path_coords.append([G.nodes[route_nodes[-1]]['y'], G.nodes[route_nodes[-1]]['x']])
+        path_coords.append([float(G.y[route_nodes[-1]]), float(G.x[route_nodes[-1]])])
         
         # Logic gán nhãn màu sắc
         safety_label = "🟢 An toàn"
@@ -314,6 +876,7 @@ class RoutingEngine:
             "geometry": path_coords,
             "distance_km": round(total_dist/1000, 2),
             "duration_min": round(total_eta/60),
+            "risk_score": round(total_risk, 1), # Tổng penalty * chiều dài (tiêu chí rủi ro của Pareto)
             "summary": {
                 "safety_label": safety_label,
                 "safety_color": safety_color,
@@ -325,6 +888,37 @@ class RoutingEngine:
             }
         }
 
+def _hazard_region():
+    """Vùng phục vụ của hazard_store: HAZARD_REGION nếu có, không thì khung bản đồ drive."""
+    if hazard_store.STORE.region is not None:
+        return hazard_store.STORE.region
+    compact = traffic.COMPACT_GRAPHS.get("drive")
+    if compact is None:
+        return None
+    return (float(compact.y.min()), float(compact.x.min()), float(compact.y.max()), float(compact.x.max()))
+
+def start_hazard_store():
+    """
+    Bật thread nền làm mới dữ liệu môi trường (gọi nhiều lần cũng chỉ 1 thread).
+    KHÔNG chạy khi import: app.py gọi lúc khởi động server, _scan_environment gọi khi dùng lần đầu
+    -> benchmark.py / các bản tự kiểm tra import core_logic không kéo theo thread + gọi mạng.
+    """
+    region = _hazard_region()
+    if region is not None:
+        hazard_store.STORE.start(region)
+
 engine = RoutingEngine()
 def get_optimal_routes(start, end, vehicle_mode="walking", preferences=None):
-    return engine.get_optimal_routes(start, end, vehicle_mode, preferences)
\ No newline at end of file
+    return engine.get_optimal_routes(start, end, vehicle_mode, preferences)
+
+def reweight_routes(token, preferences=None):
+    return engine.reweight_routes(token, preferences)
+
+def get_optimal_routes_batch(trips, vehicle_mode="walking", preferences=None):
+    return engine.get_optimal_routes_batch(trips, vehicle_mode, preferences)
+
+def get_travel_matrix(origins, destinations=None, vehicle_mode="walking", preferences=None, stream=False):
+    return engine.get_travel_matrix(origins, destinations, vehicle_mode, preferences, stream)
+
+def get_pareto_routes(start, end, vehicle_mode="walking", preferences=None):
+    return engine.get_pareto_routes(start, end, vehicle_mode, preferences)
\ No newline at end of file
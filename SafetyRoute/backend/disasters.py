@@ -1,32 +1,32 @@
 import requests
 import json
 import os
+import threading
+import time
+import numpy as np
 from utils import haversine # Import hàm chung
+import standardization
 
 DEMO_MODE = False # <--- CÔNG TẮC DEMO
 
-def get_natural_disasters(user_lat, user_lon, max_distance_km=500):
-    # 1. Chọn nguồn dữ liệu
-    raw_events = []
-    if DEMO_MODE:
-        try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            file_path = os.path.join(script_dir, 'mock_disasters.json')
-            with open(file_path, 'r', encoding='utf-8') as f:
-                raw_events = json.load(f)
-        except Exception as e:
-            print(f"Lỗi đọc Mock: {e}")
-            return []
-    else:
-        # API NASA thật
-        bbox = "102.14,8.18,109.46,23.39"
-        url = f"https://eonet.gsfc.nasa.gov/api/v3/events?status=open&bbox={bbox}"
-        try:
-            resp = requests.get(url, timeout=10)
-            if resp.status_code == 200: raw_events = resp.json().get("events", [])
-        except: return []
+# Địa chỉ API NASA EONET (đổi được qua biến môi trường, VD trỏ về server giả lập khi kiểm thử)
+EONET_URL = os.getenv("EONET_URL", "https://eonet.gsfc.nasa.gov/api/v3/events")
+EONET_BBOX = "102.14,8.18,109.46,23.39"   # Toàn Việt Nam
+EONET_TTL_S = float(os.getenv("EONET_TTL_S", "300"))  # Hết hạn thì hỏi lại NASA (có điều kiện ETag)
+EONET_TIMEOUT_S = 10
 
-    # 2. Xử lý & Lọc
+# Sai khác |khoảng cách - bán kính lọc| nhỏ hơn mức này thì tính lại bằng utils.haversine (khớp bản cũ)
+QUERY_EDGE_TOLERANCE_KM = 1e-6
+
+_SESSION = requests.Session()
+_FEED_LOCK = threading.Lock()
+# Cache feed theo nguồn ('nasa' / 'mock'): {'table', 'etag', 'last_modified', 'fetched_at', 'mtime'}
+_FEEDS = {}
+
+def _parse_events(raw_events):
+    """
+    Chuẩn hóa danh sách sự kiện EONET (hoặc Mock) -> list dict như output cũ (chưa lọc khoảng cách).
+    """
     formatted_list = []
     for event in raw_events:
         geo = event.get("geometry", [])
@@ -44,24 +44,107 @@ def get_natural_disasters(user_lat, user_lon, max_distance_km=500):
                 e_lon, e_lat = coords[0][0]
 
         if e_lat and e_lon:
-            dist = haversine(user_lat, user_lon, e_lat, e_lon)
-            if dist <= max_distance_km:
-                cats = event.get("categories", [])
-                
-                # [FIX] Thêm dòng này: Lấy radius từ Mock, nếu không có (API thật) thì gán 10km
-                # Nếu là Polygon của NASA, có thể gán mặc định to hơn (ví dụ 20km)
-                default_radius = 20.0 if etype == 'Polygon' else 10.0
-                event_radius = event.get("radius", default_radius)
-
-                formatted_list.append({
-                    'lat': e_lat, 'lng': e_lon,
-                    'name': event.get("title"),
-                    'type': etype,
-                    'radius': event_radius,  # <--- QUAN TRỌNG: Thêm cái này vào output
-                    'categories_raw': [c.get("id") for c in cats] 
-                })
+            cats = event.get("categories", [])
+            
+            # [FIX] Thêm dòng này: Lấy radius từ Mock, nếu không có (API thật) thì gán 10km
+            # Nếu là Polygon của NASA, có thể gán mặc định to hơn (ví dụ 20km)
+            default_radius = 20.0 if etype == 'Polygon' else 10.0
+            event_radius = event.get("radius", default_radius)
+
+            formatted_list.append({
+                'lat': e_lat, 'lng': e_lon,
+                'name': event.get("title"),
+                'type': etype,
+                'radius': event_radius,  # <--- QUAN TRỌNG: Thêm cái này vào output
+                'categories_raw': [c.get("id") for c in cats] 
+            })
     return formatted_list
 
+class EventTable:
+    """
+    Sự kiện đã parse sẵn dạng mảng (lat, lng, radius, severity) + chỉ mục lưới.
+    Truy vấn theo bán kính = lọc vector hóa, không parse lại JSON.
+    """
+    def __init__(self, events):
+        self.events = events
+        self.lat, self.lng, self.radius, self.severity = standardization.disaster_hazard_arrays(events)
+        self.index = standardization.create_spatial_index(events)
+
+    def query(self, user_lat, user_lon, max_distance_km):
+        """Các sự kiện có tâm cách (user_lat, user_lon) <= max_distance_km (giữ thứ tự feed)."""
+        if not self.events:
+            return []
+        # Lọc thô bằng lưới: hộp bao quanh vòng tròn truy vấn (rộng theo vĩ độ cao nhất + 1 độ dự phòng)
+        d_lat = max_distance_km / 110.57
+        d_lon = max_distance_km / (111.32 * np.cos(np.radians(min(abs(user_lat) + d_lat + 1.0, 89.0))))
+        cand = np.array(sorted(self.index.intersection(
+            (user_lon - d_lon, user_lat - d_lat, user_lon + d_lon, user_lat + d_lat))), dtype=np.int64)
+        if len(cand) == 0:
+            return []
+
+        dist = standardization.haversine_np(user_lat, user_lon, self.lat[cand], self.lng[cand])
+        keep = dist <= max_distance_km
+        # Sát mép: tính lại bằng utils.haversine để khớp tuyệt đối bản cũ
+        for j in np.flatnonzero(np.abs(dist - max_distance_km) < QUERY_EDGE_TOLERANCE_KM).tolist():
+            i = int(cand[j])
+            keep[j] = haversine(user_lat, user_lon, self.events[i]['lat'], self.events[i]['lng']) <= max_distance_km
+        return [self.events[i] for i in cand[keep].tolist()]
+
+def _load_mock_table():
+    """Mock: đọc lại file chỉ khi file đổi (so mtime)."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(script_dir, 'mock_disasters.json')
+    mtime = os.path.getmtime(file_path)
+    feed = _FEEDS.get('mock')
+    if feed and feed['mtime'] == mtime:
+        return feed['table']
+    with open(file_path, 'r', encoding='utf-8') as f:
+        table = EventTable(_parse_events(json.load(f)))
+    _FEEDS['mock'] = {'table': table, 'mtime': mtime}
+    return table
+
+def _load_nasa_table():
+    """
+    NASA EONET có cache: còn hạn TTL -> dùng luôn; hết hạn -> hỏi lại có điều kiện
+    (If-None-Match / If-Modified-Since), 304 thì giữ bảng cũ. Lỗi mạng -> dùng bảng cũ (nếu có).
+    """
+    feed = _FEEDS.get('nasa')
+    now = time.time()
+    if feed and now - feed['fetched_at'] < EONET_TTL_S:
+        return feed['table']
+
+    headers = {}
+    if feed and feed.get('etag'): headers['If-None-Match'] = feed['etag']
+    if feed and feed.get('last_modified'): headers['If-Modified-Since'] = feed['last_modified']
+    url = f"{EONET_URL}?status=open&bbox={EONET_BBOX}"
+    try:
+        resp = _SESSION.get(url, headers=headers, timeout=EONET_TIMEOUT_S)
+        if resp.status_code == 304 and feed:
+            feed['fetched_at'] = now
+            return feed['table']
+        if resp.status_code == 200:
+            table = EventTable(_parse_events(resp.json().get("events", [])))
+            _FEEDS['nasa'] = {'table': table, 'fetched_at': now,
+                              'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+            return table
+    except Exception as e:
+        print(f"⚠️ [DISASTER] Không gọi được NASA EONET ({e})")
+    return feed['table'] if feed else None
+
+def get_natural_disasters(user_lat, user_lon, max_distance_km=500):
+    # 1. Chọn nguồn dữ liệu (đã parse sẵn + cache)
+    with _FEED_LOCK:
+        try:
+            table = _load_mock_table() if DEMO_MODE else _load_nasa_table()
+        except Exception as e:
+            print(f"Lỗi đọc Mock: {e}")
+            return []
+    if table is None:
+        return []
+
+    # 2. Lọc theo khoảng cách (vector hóa)
+    return table.query(user_lat, user_lon, max_distance_km)
+
 # --- HÀM SETTER ĐỂ APP GỌI (ĐỒNG BỘ VỚI WEATHER) ---
 def set_demo_mode(status: bool):
     global DEMO_MODE
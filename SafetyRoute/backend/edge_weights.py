@@ -0,0 +1,207 @@
+# file: edge_weights.py
+"""
+Lớp trọng số riêng cho từng request (Weight Overlay).
+
+Trước đây _calculate_weights ghi 'final_weight', 'meta_info', 'scores_real' thẳng vào
+dict cạnh của đồ thị, và vòng tìm đường phụ nhân final_weight x3 tại chỗ.
+-> Nếu dùng chung G_full thì request này làm hỏng đồ thị của request khác.
+
+Giờ mọi thứ nằm trong WeightOverlay (mảng numpy theo edge id):
+    - final_weight: mảng đủ kích thước (m) để thuật toán tìm đường đọc trực tiếp
+    - eta / penalty / điểm thành phần: chỉ lưu cho các cạnh trong hành lang
+Đồ thị đã load (CompactGraph) chỉ được ĐỌC -> nhiều thread dùng chung an toàn.
+
+LazyWeightOverlay: cùng giao diện nhưng KHÔNG chấm trước cả hành lang - thuật toán tìm đường
+gọi expand_out / expand_in ngay trước khi duyệt cạnh của 1 node, overlay chấm theo lô nhỏ
+(node đó + các node đầu hàng đợi, sắp được duyệt) rồi nhớ lại kết quả.
+"""
+import numpy as np
+
+import graph_engine
+
+INF = graph_engine.INF
+
+# Số node đầu hàng đợi được chấm kèm mỗi lô (micro-batch cho risk model / kernel numpy)
+LAZY_BATCH_NODES = 32
+
+# Số bước kề được chấm trước (lớn hơn: ít lô hơn nhưng chấm thừa nhiều cạnh hơn)
+LAZY_LOOKAHEAD = 2
+
+
+class WeightOverlay:
+    def __init__(self, corridor):
+        self.graph = corridor.graph
+        self.edges = corridor.edges   # id cạnh trong hành lang (tăng dần)
+        n = len(self.edges)
+
+        # Trọng số tìm đường (INF = cạnh ngoài hành lang, không đi được)
+        self.final_weight = np.full(self.graph.num_edges, np.inf)
+
+        # Thông tin chi tiết, theo vị trí cạnh trong self.edges
+        self.eta = np.zeros(n)
+        self.penalty = np.zeros(n)
+        self.s_disaster = np.zeros(n)
+        self.s_weather = np.zeros(n)
+        self.s_crowd = np.zeros(n)
+
+    def assign(self, eta, penalty, s_disaster, s_weather, s_crowd):
+        """Gán kết quả chấm điểm cho TOÀN BỘ cạnh trong hành lang (cùng thứ tự self.edges)."""
+        self.eta[:] = eta
+        self.penalty[:] = penalty
+        self.s_disaster[:] = s_disaster
+        self.s_weather[:] = s_weather
+        self.s_crowd[:] = s_crowd
+        # Trọng số cuối cùng
+        self.final_weight[self.edges] = self.eta * (1.0 + self.penalty)
+
+    def local(self, edges):
+        """Đổi edge id (toàn cục) -> vị trí trong hành lang."""
+        return np.searchsorted(self.edges, edges)
+
+    def meta_info(self, e):
+        """Dạng dict giống 'meta_info' cũ (eta, penalty, risk_flags) cho 1 cạnh."""
+        i = int(self.local(e))
+        return {
+            'eta': float(self.eta[i]), 'penalty': float(self.penalty[i]),
+            'risk_flags': {
+                'disaster': bool(self.s_disaster[i] > 0),
+                'weather': bool(self.s_weather[i] > 0),
+                'crowd': bool(self.s_crowd[i] > 0.7),
+            }
+        }
+
+    def penalize(self, path_edges, factor):
+        """Phạt trọng số các cạnh trên đường đi (để tìm đường phụ). Chỉ sửa overlay này."""
+        graph_engine.penalize_path(self.graph, self.final_weight, path_edges, factor)
+
+    def search_weights(self):
+        """Trọng số đưa vào thuật toán tìm đường."""
+        return self.final_weight
+
+    def criteria(self):
+        """
+        2 chi phí riêng cho tìm đường 2 tiêu chí (pareto.py): (eta, risk) dạng list theo edge id,
+        risk = penalty * chiều dài (giống total_risk của _audit_route), INF = ngoài hành lang.
+        """
+        m = self.graph.num_edges
+        eta = np.full(m, np.inf)
+        risk = np.full(m, np.inf)
+        eta[self.edges] = self.eta
+        risk[self.edges] = self.penalty * np.asarray(self.graph.length, dtype=np.float64)[self.edges]
+        return eta.tolist(), risk.tolist()
+
+
+class LazyWeightOverlay(WeightOverlay):
+    """
+    Overlay chấm điểm LƯỜI: chỉ các cạnh mà thuật toán tìm đường thực sự duyệt tới mới được chấm.
+    `weigh(edges) -> (etas, penalties, scores (n, 3))` là hàm chấm theo lô (core_logic.EdgeScorer.weigh).
+    Mảng chi tiết có đủ m phần tử (vị trí = edge id), cạnh ngoài hành lang luôn INF.
+    """
+    def __init__(self, corridor, weigh):
+        self.graph = corridor.graph
+        self.edges = corridor.edges
+        self.weigh = weigh
+        m, n = self.graph.num_edges, self.graph.num_nodes
+
+        self.final_weight = np.full(m, np.inf)
+        self.values = [INF] * m   # bản list của final_weight cho vòng lặp tìm đường (đọc nhanh hơn numpy)
+        self.eta = np.zeros(m)
+        self.penalty = np.zeros(m)
+        self.s_disaster = np.zeros(m)
+        self.s_weather = np.zeros(m)
+        self.s_crowd = np.zeros(m)
+
+        # Cạnh đã chấm (hoặc bị chặn vì ngoài hành lang) + node đã chấm hết cạnh ra / vào
+        self._scored = np.zeros(m, dtype=bool)
+        if not corridor.is_full:
+            self._scored[:] = True
+            self._scored[self.edges] = False
+        self._out_done = bytearray(n)
+        self._in_done = bytearray(n)
+        self.num_scored = 0
+        self.num_batches = 0
+        self._criteria = None   # (eta, risk) dạng list, chỉ tạo khi tìm Pareto
+
+    def local(self, edges):
+        return edges
+
+    def _score(self, edges):
+        edges = np.asarray(edges, dtype=np.int64)
+        edges = edges[~self._scored[edges]]
+        if not len(edges):
+            return
+        edges = np.unique(edges)
+        etas, penalties, scores = self.weigh(edges)
+        self.eta[edges] = etas
+        self.penalty[edges] = penalties
+        self.s_disaster[edges] = scores[:, 0]
+        self.s_weather[edges] = scores[:, 1]
+        self.s_crowd[edges] = scores[:, 2]
+        weight = etas * (1.0 + penalties)
+        self.final_weight[edges] = weight
+        values = self.values
+        for e, w in zip(edges.tolist(), weight.tolist()):
+            values[e] = w
+        if self._criteria is not None:
+            eta_l, risk_l = self._criteria
+            risk = penalties * np.asarray(self.graph.length, dtype=np.float64)[edges]
+            for e, a, r in zip(edges.tolist(), etas.tolist(), risk.tolist()):
+                eta_l[e] = a
+                risk_l[e] = r
+        self._scored[edges] = True
+        self.num_scored += len(edges)
+        self.num_batches += 1
+
+    def _expand(self, node, heap, done, offsets, edge_of, far):
+        if done[node]:
+            return
+        # Lô = node đang duyệt + các node đầu heap (mảng heap: vài tầng đầu là các khóa nhỏ nhất)
+        # + LAZY_LOOKAHEAD bước kề tiếp theo (node vừa được đẩy vào heap thường bị lấy ra ngay sau đó)
+        nodes = [node] + [item[-1] for item in heap[:LAZY_BATCH_NODES]]
+        batch = []
+        for hop in range(LAZY_LOOKAHEAD + 1):
+            start = len(batch)
+            for v in nodes:
+                if not done[v]:
+                    done[v] = 1
+                    batch.extend(edge_of[i] for i in range(offsets[v], offsets[v + 1]))
+            nodes = [far[e] for e in batch[start:]]
+        self._score(batch)
+
+    def expand_out(self, node, heap):
+        """Chấm các cạnh RA của `node` (và của các node sắp duyệt trong `heap`)."""
+        offsets, targets = self.graph.adjacency()
+        self._expand(node, heap, self._out_done, offsets, range(len(self.values)), targets)
+
+    def expand_in(self, node, heap):
+        """Chấm các cạnh VÀO của `node` (tìm ngược)."""
+        in_offsets, in_edges, sources = self.graph.reverse_adjacency()
+        self._expand(node, heap, self._in_done, in_offsets, in_edges, sources)
+
+    def __getitem__(self, e):
+        self._score([e])
+        return self.values[e]
+
+    def __setitem__(self, e, value):
+        self.values[e] = value
+        self.final_weight[e] = value
+
+    def penalize(self, path_edges, factor):
+        # Cạnh song song u->v chưa chắc đã được chấm -> chấm hết cạnh ra của các node trên đường trước
+        offsets = self.graph.adjacency()[0]
+        sources = self.graph.sources
+        self._score([e2 for e in path_edges for e2 in range(offsets[int(sources[e])], offsets[int(sources[e]) + 1])])
+        graph_engine.penalize_path(self.graph, self, path_edges, factor)
+
+    def criteria(self):
+        # Cạnh chưa chấm để INF, được điền dần khi hook expand_out chấm tới (list dùng chung với _score)
+        if self._criteria is None:
+            ok = np.isfinite(self.final_weight)
+            eta = np.where(ok, self.eta, np.inf)
+            risk = np.where(ok, self.penalty * np.asarray(self.graph.length, dtype=np.float64), np.inf)
+            self._criteria = (eta.tolist(), risk.tolist())
+        return self._criteria
+
+    def search_weights(self):
+        # Thuật toán tìm đường nhận diện overlay lười qua expand_out / expand_in (graph_engine.weight_lists)
+        return self
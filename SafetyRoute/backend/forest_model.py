@@ -0,0 +1,198 @@
+# file: forest_model.py
+"""
+Biên dịch RandomForest (sklearn) thành mảng numpy phẳng + bộ đánh giá vector hóa.
+
+risk_model.pkl / traffic_model.pkl phải unpickle lúc import -> kéo theo cả sklearn,
+và mỗi lần predict lại tốn phí kiểm tra đầu vào của sklearn.
+Bước export OFFLINE (chạy 1 lần, hoặc tự chạy sau khi train):
+    python forest_model.py risk_model.pkl traffic_model.pkl
+ghi ra 'risk_model.npz' gồm các mảng nối liền của MỌI cây:
+    - feature / threshold / left / right / value theo node (chỉ số node là toàn cục)
+    - roots: node gốc của từng cây
+Lúc chạy, load_model() ưu tiên file .npz (không cần sklearn), thiếu/cũ thì quay về pickle.
+"""
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+# Tăng số này mỗi khi đổi định dạng file .npz
+FOREST_FORMAT_VERSION = 1
+
+# Số hàng đánh giá mỗi lượt (giới hạn mảng tạm n_hàng x n_cây)
+PREDICT_CHUNK = 20000
+
+
+def _file_sha1(path, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class FlatForest:
+    """
+    Rừng cây hồi quy dạng mảng phẳng. predict() cho kết quả GIỐNG HỆT sklearn
+    (ép X về float32, đi trái nếu x <= ngưỡng, cộng dồn theo thứ tự cây rồi chia trung bình).
+    """
+    def __init__(self, feature, threshold, left, right, value, roots, n_features):
+        self.feature = feature        # int32: đặc trưng tách (-1 = lá)
+        self.threshold = threshold    # float64: ngưỡng tách
+        self.left = left              # int32: con trái (chỉ số toàn cục)
+        self.right = right            # int32: con phải
+        self.value = value            # float64: giá trị dự báo tại node
+        self.roots = roots            # int32: node gốc của từng cây
+        self.n_features = int(n_features)
+
+        # Bảng duyệt cây: con [trái, phải] xen kẽ, lá trỏ về chính nó (đặc trưng 0, ngưỡng +inf)
+        leaf = self.feature < 0
+        own = np.arange(len(feature), dtype=np.int32)
+        self._children = np.column_stack((np.where(leaf, own, left), np.where(leaf, own, right))).ravel()
+        self._split_feature = np.where(leaf, 0, feature).astype(np.int32)
+        self.threshold = np.where(leaf, np.inf, threshold)
+        self.depth = self._max_depth()
+
+    def _max_depth(self):
+        depth, frontier = 0, self.roots
+        while True:
+            frontier = frontier[self.feature[frontier] >= 0]
+            if len(frontier) == 0:
+                return depth
+            frontier = np.concatenate((self.left[frontier], self.right[frontier]))
+            depth += 1
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32).astype(np.float64).reshape(-1, self.n_features)
+        out = np.zeros(len(X))
+        for lo in range(0, len(X), PREDICT_CHUNK):
+            out[lo:lo + PREDICT_CHUNK] = self._predict_chunk(X[lo:lo + PREDICT_CHUNK])
+        return out
+
+    def _predict_chunk(self, X):
+        # Lá tự trỏ về chính nó -> mọi (hàng, cây) đi đúng `depth` bước, không cần lọc
+        n = len(X)
+        node = np.tile(self.roots, n)                                             # (hàng, cây) trải phẳng
+        base = np.repeat(np.arange(n, dtype=np.int32) * self.n_features, self.n_trees)
+        flat_x = X.ravel()
+        for _ in range(self.depth):
+            go_right = flat_x[base + self._split_feature[node]] > self.threshold[node]
+            node = self._children[2 * node + go_right]
+
+        # Cộng dồn theo thứ tự cây giống sklearn (tránh sai khác ở chữ số cuối)
+        leaf_values = self.value[node].reshape(n, self.n_trees)
+        total = np.zeros(n)
+        for t in range(self.n_trees):
+            total += leaf_values[:, t]
+        return total / self.n_trees
+
+    def split_thresholds(self, f):
+        """Các ngưỡng tách (đã sắp, không trùng) của đặc trưng f trên toàn rừng."""
+        return np.unique(self.threshold[self.feature == f])
+
+
+def flatten_forest(model):
+    """RandomForestRegressor / DecisionTreeRegressor đã fit -> FlatForest."""
+    trees = [est.tree_ for est in getattr(model, 'estimators_', [model])]
+    parts = {'feature': [], 'threshold': [], 'left': [], 'right': [], 'value': []}
+    roots = []
+    base = 0
+    for t in trees:
+        leaf = t.children_left < 0
+        roots.append(base)
+        parts['feature'].append(np.where(leaf, -1, t.feature).astype(np.int32))
+        parts['threshold'].append(np.asarray(t.threshold, dtype=np.float64))
+        parts['left'].append(np.where(leaf, -1, t.children_left + base).astype(np.int32))
+        parts['right'].append(np.where(leaf, -1, t.children_right + base).astype(np.int32))
+        parts['value'].append(np.asarray(t.value, dtype=np.float64).reshape(t.node_count, -1)[:, 0])
+        base += t.node_count
+    return FlatForest(roots=np.array(roots, dtype=np.int32), n_features=model.n_features_in_,
+                      **{k: np.concatenate(v) for k, v in parts.items()})
+
+
+def export_forest(model, npz_path, source_path=None):
+    """Ghi rừng cây ra .npz (kèm SHA-1 của file pickle gốc để phát hiện bản cũ)."""
+    forest = model if isinstance(model, FlatForest) else flatten_forest(model)
+    source_sha1 = _file_sha1(source_path) if source_path and os.path.exists(source_path) else ''
+    np.savez(npz_path, version=FOREST_FORMAT_VERSION, source_sha1=source_sha1,
+             n_features=forest.n_features, roots=forest.roots, feature=forest.feature,
+             threshold=forest.threshold, left=forest.left, right=forest.right, value=forest.value)
+    return forest
+
+
+def load_forest(npz_path, source_path=None):
+    """
+    Đọc .npz -> FlatForest. Output None nếu thiếu file / sai phiên bản /
+    file pickle gốc đã đổi (so SHA-1).
+    """
+    if not os.path.exists(npz_path):
+        return None
+    try:
+        with np.load(npz_path) as data:
+            if int(data['version']) != FOREST_FORMAT_VERSION:
+                return None
+            sha1 = str(data['source_sha1'])
+            if sha1 and source_path and os.path.exists(source_path) and _file_sha1(source_path) != sha1:
+                print(f"⚠️ [FOREST] '{npz_path}' đã cũ so với '{source_path}'. Bỏ qua.")
+                return None
+            return FlatForest(**{k: data[k] for k in
+                                 ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'n_features')})
+    except Exception as e:
+        print(f"⚠️ [FOREST] Không đọc được '{npz_path}' ({e}).")
+        return None
+
+
+def load_model(pkl_path):
+    """
+    Nạp model cho lúc chạy: ưu tiên bản phẳng '.npz' (không import sklearn),
+    không có thì unpickle file gốc như trước. Lỗi cả 2 -> raise như pickle.load.
+    """
+    forest = load_forest(os.path.splitext(pkl_path)[0] + '.npz', source_path=pkl_path)
+    if forest is not None:
+        return forest
+    with open(pkl_path, 'rb') as f:
+        return pickle.load(f)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    files = sys.argv[1:] or ['risk_model.pkl', 'traffic_model.pkl']
+    ok = True
+    for path in files:
+        if not os.path.exists(path):
+            print(f"❌ Không thấy '{path}'")
+            continue
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        out = os.path.splitext(path)[0] + '.npz'
+        export_forest(model, out, source_path=path)
+        forest = load_forest(out, source_path=path)
+        print(f"💾 Đã ghi '{out}' ({forest.n_trees} cây, {len(forest.feature)} node)")
+
+        # Kiểm tra khớp với sklearn trên đầu vào ngẫu nhiên
+        rng = np.random.default_rng(0)
+        X = rng.uniform(0, 2, (20000, forest.n_features))
+        if forest.n_features == 3 and 'traffic' in path:
+            X[:, 0] *= 12                       # giờ 0 -> 24
+            X[:, 1] = X[:, 1] > 1               # cuối tuần 0/1
+        t0 = time.perf_counter()
+        ref = model.predict(X)
+        t_ref = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        got = forest.predict(X)
+        t_got = time.perf_counter() - t0
+        single = time.perf_counter()
+        forest.predict(X[:1])
+        single = time.perf_counter() - single
+        ok = ok and bool(np.array_equal(ref, got))
+        print(f"   khớp sklearn: {np.array_equal(ref, got)} | max lệch {np.max(np.abs(ref - got)):.2e}"
+              f" | sklearn {t_ref * 1000:.1f} ms, numpy {t_got * 1000:.1f} ms (1 hàng: {single * 1000:.2f} ms)")
+    if not ok:
+        sys.exit(1)
@@ -0,0 +1,783 @@
+# file: graph_engine.py
+"""
+Động cơ đồ thị nén (CSR - Compressed Sparse Row) cho tìm đường.
+
+Đồ thị osmnx (MultiDiGraph) lưu mỗi cạnh là một dict Python -> tra cứu chậm và
+tốn bộ nhớ. Module này chuyển đồ thị sang dạng mảng (numpy) MỘT LẦN khi load:
+    - Node: id nội bộ int32 (0..n-1), tọa độ x/y.
+    - Cạnh: offsets/targets theo kiểu CSR + các cột trọng số dạng float.
+Sau đó chạy Dijkstra / A* bằng binary heap trên các mảng này.
+
+Nhánh networkx cũ vẫn giữ làm bản tham chiếu (reference) để đối chiếu kết quả.
+"""
+import heapq
+import math
+from collections import namedtuple
+
+import numpy as np
+
+INF = float('inf')
+
+# Kết quả 1 lần tìm đường:
+#   - nodes: danh sách id nội bộ của các node trên đường đi
+#   - edges: danh sách id cạnh (vị trí trong CSR) tương ứng
+#   - cost: tổng trọng số
+#   - settled: số node đã "chốt" (đo công sức tìm kiếm)
+SearchResult = namedtuple('SearchResult', ['nodes', 'edges', 'cost', 'settled'])
+
+# 2 cây của 1 lần tìm 2 chiều (bidirectional_search):
+#   - dist_f / pred_f / done_f: khoảng cách từ source, cạnh đến node, các node đã chốt (chiều xuôi)
+#   - dist_b / succ_b / done_b: khoảng cách tới target, cạnh đi tiếp, các node đã chốt (chiều ngược)
+#   - mu / meet: chi phí đường tốt nhất và node gặp nhau (None nếu không có đường)
+SearchTrees = namedtuple('SearchTrees', ['dist_f', 'pred_f', 'done_f', 'dist_b', 'succ_b', 'done_b', 'mu', 'meet'])
+
+# Các đoạn thẳng của mọi cạnh, trải phẳng (đoạn của cạnh e: [first[e], first[e+1]))
+#   - edge: cạnh chứa đoạn, a_lon/a_lat -> b_lon/b_lat: 2 đầu đoạn
+Segments = namedtuple('Segments', ['edge', 'first', 'a_lon', 'a_lat', 'b_lon', 'b_lat'])
+
+
+class CompactGraph:
+    """
+    Đồ thị dạng mảng (CSR).
+    Cạnh của node u nằm trong đoạn [offsets[u], offsets[u+1]) của các mảng cạnh.
+    Id cạnh (edge id) chính là vị trí trong đoạn đó.
+    """
+    def __init__(self, osmids, x, y, offsets, sources, targets, edge_keys,
+                 length, highway, highway_multi, highway_names, maxspeed,
+                 geom_offsets, geom_x, geom_y, edge_data=None):
+        # --- Node ---
+        self.osmids = osmids          # int64: id nội bộ -> id OSM
+        self.x = x                    # float64: Kinh độ (Lon)
+        self.y = y                    # float64: Vĩ độ (Lat)
+
+        # --- Topology (CSR) ---
+        self.offsets = offsets        # int64 (n+1)
+        self.sources = sources        # int32 (m): node đầu của cạnh
+        self.targets = targets        # int32 (m): node cuối của cạnh
+        self.edge_keys = edge_keys    # int32 (m): key của cạnh song song (MultiDiGraph)
+
+        # --- Thuộc tính cạnh (cột trọng số) ---
+        self.length = length                  # float64: chiều dài (m)
+        self.highway = highway                # int16: mã loại đường
+        self.highway_multi = highway_multi    # bool: OSM ghi nhiều loại đường (list)
+        self.highway_names = highway_names    # list: mã -> tên loại đường
+        self.maxspeed = maxspeed              # float32: tốc độ tối đa đã parse (km/h)
+        self.base_speed = None                # float64: tốc độ cơ bản tĩnh (km/h), traffic.py dựng lúc load
+        self.crowd = None                     # standardization.CrowdTensor: điểm đám đông cạnh x khung giờ
+        self.cch = None                       # cch.CCH: cấu trúc CCH (nạp từ snapshot nếu có)
+        self.landmarks = None                 # landmarks.LandmarkTable: bảng ALT (nạp từ snapshot nếu có)
+
+        # --- Hình học cạnh (packed polyline) ---
+        # Điểm của cạnh e nằm trong [geom_offsets[e], geom_offsets[e+1]) của geom_x/geom_y
+        self.geom_offsets = geom_offsets      # int64 (m+1)
+        self.geom_x = geom_x                  # float64: Lon
+        self.geom_y = geom_y                  # float64: Lat
+
+        # Dict cạnh gốc của osmnx (theo thứ tự CSR) - chỉ có khi dựng từ networkx.
+        # Đồ thị nạp từ snapshot (graph_snapshot.py) không có -> code chính chỉ đọc mảng.
+        self.edge_data = edge_data
+
+        # Mảng phụ lưu kèm snapshot (VD bảng landmark)
+        self.extras = {}
+
+        self.node_index = {int(n): i for i, n in enumerate(osmids.tolist())}
+        self._edge_index = None
+        self._adjacency = None
+        self._reverse_adjacency = None
+        self._unit_vectors = None
+        self._segments = None
+        self._edge_bounds = None
+
+    @property
+    def num_nodes(self):
+        return len(self.osmids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def adjacency(self):
+        """
+        Trả về (offsets, targets) dạng list Python.
+        Vòng lặp heap thuần Python đọc list nhanh hơn nhiều so với từng phần tử numpy.
+        """
+        if self._adjacency is None:
+            self._adjacency = (self.offsets.tolist(), self.targets.tolist())
+        return self._adjacency
+
+    def reverse_adjacency(self):
+        """
+        CSR ngược (cạnh ĐI VÀO mỗi node) dạng list Python: (in_offsets, in_edges, sources).
+        Cạnh vào node v: in_edges[in_offsets[v]:in_offsets[v+1]] (edge id gốc, tăng dần),
+        node đầu của cạnh e: sources[e]. Dùng cho nhánh tìm ngược của A* 2 chiều.
+        """
+        if self._reverse_adjacency is None:
+            order = np.argsort(self.targets, kind='stable')
+            in_offsets = np.zeros(self.num_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.targets, minlength=self.num_nodes), out=in_offsets[1:])
+            self._reverse_adjacency = (in_offsets.tolist(), order.tolist(), self.sources.tolist())
+        return self._reverse_adjacency
+
+    def unit_vectors(self):
+        """Tọa độ node trên mặt cầu đơn vị (x, y, z) dạng list - cho cận dưới khoảng cách của A*."""
+        if self._unit_vectors is None:
+            lat, lon = np.radians(self.y), np.radians(self.x)
+            self._unit_vectors = ((np.cos(lat) * np.cos(lon)).tolist(), (np.cos(lat) * np.sin(lon)).tolist(),
+                                  np.sin(lat).tolist())
+        return self._unit_vectors
+
+    def edge_index(self):
+        """
+        Map (u_osm, v_osm, key) -> edge id. Dùng để chuyển dữ liệu từ networkx sang mảng.
+        """
+        if self._edge_index is None:
+            self._edge_index = {
+                (u, v, k): e for e, (u, v, k) in enumerate(zip(
+                    self.osmids[self.sources].tolist(),
+                    self.osmids[self.targets].tolist(),
+                    self.edge_keys.tolist()))
+            }
+        return self._edge_index
+
+    def edge_points(self, e):
+        """Danh sách điểm (Lon, Lat) tạo nên cạnh e (giống list(geometry.coords))."""
+        a, b = self.geom_offsets[e], self.geom_offsets[e + 1]
+        return list(zip(self.geom_x[a:b].tolist(), self.geom_y[a:b].tolist()))
+
+    def segments(self):
+        """
+        Trải phẳng hình học của mọi cạnh thành mảng đoạn thẳng (dựng 1 lần, cache lại).
+        Dùng cho các kernel numpy (khoảng cách thiên tai -> cạnh, bám cạnh...).
+        """
+        if self._segments is None:
+            # Mỗi cặp điểm liên tiếp TRONG cùng 1 cạnh là 1 đoạn thẳng
+            is_start = np.ones(len(self.geom_x), dtype=bool)
+            is_start[self.geom_offsets[1:] - 1] = False
+            a = np.flatnonzero(is_start)
+            counts = np.diff(self.geom_offsets) - 1
+            first = np.zeros(self.num_edges + 1, dtype=np.int64)
+            np.cumsum(counts, out=first[1:])
+            self._segments = Segments(
+                edge=np.repeat(np.arange(self.num_edges, dtype=np.int32), counts), first=first,
+                a_lon=self.geom_x[a], a_lat=self.geom_y[a],
+                b_lon=self.geom_x[a + 1], b_lat=self.geom_y[a + 1],
+            )
+        return self._segments
+
+    def edge_bounds(self):
+        """
+        BBox (min_lon, min_lat, max_lon, max_lat) theo HÌNH HỌC thật của từng cạnh (cache lại).
+        Đường cong có thể lồi ra ngoài khung của 2 node đầu/cuối.
+        """
+        if self._edge_bounds is None:
+            starts = self.geom_offsets[:-1]
+            self._edge_bounds = np.column_stack((
+                np.minimum.reduceat(self.geom_x, starts), np.minimum.reduceat(self.geom_y, starts),
+                np.maximum.reduceat(self.geom_x, starts), np.maximum.reduceat(self.geom_y, starts),
+            ))
+        return self._edge_bounds
+
+    def edge_segment_ids(self, edges):
+        """Id các đoạn thẳng của danh sách cạnh + vị trí cạnh sở hữu (trong `edges`)."""
+        first = self.segments().first
+        starts = first[edges]
+        counts = first[np.asarray(edges) + 1] - starts
+        owner = np.repeat(np.arange(len(starts)), counts)
+        return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum()), owner
+
+    def find_twin(self, e):
+        """
+        Tìm cạnh ngược chiều v->u của cạnh e (u->v) - cùng con đường, chiều ngược lại.
+        Đường 1 chiều -> None.
+        """
+        offsets, targets = self.adjacency()
+        u, v = int(self.sources[e]), targets[e]
+        best, best_diff = None, INF
+        for e2 in range(offsets[v], offsets[v + 1]):
+            if targets[e2] == u:
+                diff = abs(self.length[e2] - self.length[e])
+                if diff < best_diff:
+                    best, best_diff = e2, diff
+        return best
+
+    def highway_name(self, e):
+        return self.highway_names[self.highway[e]]
+
+    def edge_record(self, e):
+        """
+        Dựng lại dict thuộc tính tối thiểu của cạnh e (length/highway/maxspeed)
+        cho các hàm chấm điểm dạng scalar trong standardization.py.
+        """
+        hw = self.highway_name(e)
+        return {
+            'length': float(self.length[e]),
+            'highway': [hw] if self.highway_multi[e] else hw,
+            'maxspeed': float(self.maxspeed[e]),
+        }
+
+    def weights_from_graph(self, G, attr, default=INF):
+        """
+        Đọc thuộc tính `attr` của các cạnh trong G (có thể là subgraph) thành cột trọng số.
+        Cạnh không có trong G -> `default` (INF = bị chặn).
+        """
+        weights = np.full(self.num_edges, default, dtype=np.float64)
+        index = self.edge_index()
+        for u, v, k, data in G.edges(keys=True, data=True):
+            e = index.get((u, v, k))
+            if e is not None and attr in data:
+                weights[e] = data[attr]
+        return weights
+
+    def to_osmids(self, nodes):
+        return [int(n) for n in self.osmids[nodes]]
+
+
+def _parse_maxspeed(raw):
+    """
+    Parse 'maxspeed' giống hệt standardization.calculate_segment_speed:
+    lấy phần tử đầu nếu là list, lỗi thì mặc định 30 km/h.
+    """
+    if isinstance(raw, list):
+        raw = raw[0]
+    try:
+        return float(raw)
+    except:
+        return 30.0
+
+
+def build_compact_graph(G):
+    """
+    Chuyển MultiDiGraph của osmnx thành CompactGraph (chạy 1 lần khi load bản đồ).
+    """
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    osmids = np.array(nodes, dtype=np.int64)
+    x = np.array([G.nodes[n]['x'] for n in nodes], dtype=np.float64)
+    y = np.array([G.nodes[n]['y'] for n in nodes], dtype=np.float64)
+
+    src, dst, keys, length, hw_codes, hw_multi, speeds, datas = [], [], [], [], [], [], [], []
+    geoms = []
+    highway_names = []
+    highway_lookup = {}
+
+    for u, v, k, data in G.edges(keys=True, data=True):
+        src.append(index[u])
+        dst.append(index[v])
+        keys.append(k)
+        length.append(data.get('length', 10))
+
+        hw = data.get('highway', '')
+        hw_multi.append(isinstance(hw, list))
+        if isinstance(hw, list): hw = hw[0]
+        if hw not in highway_lookup:
+            highway_lookup[hw] = len(highway_names)
+            highway_names.append(hw)
+        hw_codes.append(highway_lookup[hw])
+
+        speeds.append(_parse_maxspeed(data.get('maxspeed', 30)))
+        datas.append(data)
+
+        # Đường cong: lấy các điểm của LineString (Lon, Lat), đường thẳng: 2 đầu mút
+        if 'geometry' in data:
+            geoms.append(list(data['geometry'].coords))
+        else:
+            geoms.append([(x[index[u]], y[index[u]]), (x[index[v]], y[index[v]])])
+
+    # Sắp xếp cạnh theo node đầu (stable để giữ thứ tự key) -> CSR
+    src = np.array(src, dtype=np.int32)
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(nodes)), out=offsets[1:])
+
+    # Đóng gói hình học theo thứ tự CSR
+    geoms = [geoms[i] for i in order.tolist()]
+    geom_offsets = np.zeros(len(geoms) + 1, dtype=np.int64)
+    np.cumsum([len(g) for g in geoms], out=geom_offsets[1:])
+    flat = np.array([p for g in geoms for p in g], dtype=np.float64).reshape(-1, 2)
+
+    return CompactGraph(
+        osmids=osmids, x=x, y=y,
+        offsets=offsets,
+        sources=src[order],
+        targets=np.array(dst, dtype=np.int32)[order],
+        edge_keys=np.array(keys, dtype=np.int32)[order],
+        length=np.array(length, dtype=np.float64)[order],
+        highway=np.array(hw_codes, dtype=np.int16)[order],
+        highway_multi=np.array(hw_multi, dtype=bool)[order],
+        highway_names=highway_names,
+        maxspeed=np.array(speeds, dtype=np.float32)[order],
+        geom_offsets=geom_offsets, geom_x=flat[:, 0].copy(), geom_y=flat[:, 1].copy(),
+        edge_data=[datas[i] for i in order.tolist()],
+    )
+
+
+# ==========================================
+# THUẬT TOÁN TÌM ĐƯỜNG (Binary Heap)
+# ==========================================
+def weight_lists(weights):
+    """
+    Trọng số -> (list đọc theo edge id, hook xuôi, hook ngược) cho vòng lặp tìm đường.
+    weights là mảng numpy / list: không có hook. Là overlay lười (edge_weights.LazyWeightOverlay):
+    hook(node, heap) được gọi ngay trước khi duyệt cạnh ra (xuôi) / cạnh vào (ngược) của node.
+    """
+    if hasattr(weights, 'expand_out'):
+        return weights.values, weights.expand_out, weights.expand_in
+    return (weights.tolist() if isinstance(weights, np.ndarray) else weights), None, None
+
+
+def shortest_path(graph, source, target, weights, heuristic=None):
+    """
+    Dijkstra (heuristic=None) hoặc A* trên CompactGraph.
+    Input:
+        - source, target: id nội bộ của node, HOẶC dict {node: chi phí cộng thêm}
+          (dùng cho "node ảo" khi bám vào giữa cạnh - xem spatial_index.EdgeSnap)
+        - weights: mảng trọng số theo edge id (INF = cạnh bị chặn) hoặc overlay lười (weight_lists)
+        - heuristic: cận dưới chi phí tới target, là mảng theo node hoặc hàm h(node).
+          Phải "admissible" (không vượt quá chi phí thật) thì kết quả mới tối ưu.
+    Output: SearchResult hoặc None nếu không có đường.
+    """
+    offsets, targets = graph.adjacency()
+    w, expand, _ = weight_lists(weights)
+    seeds = source if isinstance(source, dict) else {source: 0.0}
+    goals = target if isinstance(target, dict) else {target: 0.0}
+
+    if heuristic is None:
+        h = None
+    elif callable(heuristic):
+        h = heuristic
+    else:
+        h = (heuristic.tolist() if isinstance(heuristic, np.ndarray) else heuristic).__getitem__
+
+    dist = {}
+    pred = {}
+    heap = []
+    for s, c in seeds.items():
+        if c < dist.get(s, INF):
+            dist[s] = c
+            pred[s] = -1
+            heap.append(((h(s) if h else 0.0) + c, c, s))
+    heapq.heapify(heap)
+
+    done = set()
+    best_cost, best_goal = INF, None
+    push, pop = heapq.heappush, heapq.heappop
+
+    while heap:
+        f, d, u = pop(heap)
+        if f >= best_cost: break
+        if u in done: continue
+        done.add(u)
+        if u in goals:
+            total = d + goals[u]
+            if total < best_cost:
+                best_cost, best_goal = total, u
+            # 1 đích duy nhất (chi phí cộng thêm = 0) -> dừng ngay như Dijkstra chuẩn
+            if len(goals) == 1 and goals[u] == 0: break
+
+        if expand is not None: expand(u, heap)
+        for e in range(offsets[u], offsets[u + 1]):
+            we = w[e]
+            if we == INF: continue
+            v = targets[e]
+            nd = d + we
+            if nd < dist.get(v, INF):
+                dist[v] = nd
+                pred[v] = e
+                push(heap, (nd + h(v) if h else nd, nd, v))
+
+    if best_goal is None:
+        return None
+
+    # Truy vết ngược theo cạnh
+    sources = graph.sources
+    edges = []
+    node = best_goal
+    while pred[node] != -1:
+        e = pred[node]
+        edges.append(e)
+        node = int(sources[e])
+    edges.reverse()
+    nodes = [node] + [targets[e] for e in edges]
+    return SearchResult(nodes, edges, best_cost, len(done))
+
+
+def one_to_many(graph, source, targets_list, weights):
+    """
+    1 lần Dijkstra từ `source` tới NHIỀU đích (các chuyến đi chung điểm xuất phát).
+    Input: source giống shortest_path, targets_list: list đích (id node hoặc dict {node: chi phí cộng thêm}),
+           weights: mảng trọng số hoặc overlay lười (weight_lists).
+    Dừng khi mọi đích đã chắc chắn có chi phí tốt nhất (hoặc hết node để duyệt).
+    Output: list SearchResult / None theo đúng thứ tự targets_list; settled = công sức của cả lần tìm.
+    """
+    offsets, targets = graph.adjacency()
+    w, expand, _ = weight_lists(weights)
+    seeds = source if isinstance(source, dict) else {source: 0.0}
+
+    # node đích -> [(vị trí đích, chi phí cộng thêm)]
+    goal_of = {}
+    for i, goals in enumerate(targets_list):
+        for g, c in (goals if isinstance(goals, dict) else {goals: 0.0}).items():
+            goal_of.setdefault(g, []).append((i, c))
+    best = [INF] * len(targets_list)
+    best_goal = [None] * len(targets_list)
+    bound = INF if targets_list else -INF   # chi phí tốt nhất lớn nhất trong các đích (INF: còn đích chưa tới)
+
+    dist = {}
+    pred = {}
+    heap = []
+    for s, c in seeds.items():
+        if c < dist.get(s, INF):
+            dist[s] = c
+            pred[s] = -1
+            heap.append((c, s))
+    heapq.heapify(heap)
+
+    done = set()
+    push, pop = heapq.heappush, heapq.heappop
+    while heap:
+        d, u = pop(heap)
+        if d >= bound: break
+        if u in done: continue
+        done.add(u)
+        if u in goal_of:
+            for i, c in goal_of[u]:
+                if d + c < best[i]:
+                    best[i], best_goal[i] = d + c, u
+            bound = max(best)
+
+        if expand is not None: expand(u, heap)
+        for e in range(offsets[u], offsets[u + 1]):
+            we = w[e]
+            if we == INF: continue
+            v = targets[e]
+            nd = d + we
+            if nd < dist.get(v, INF):
+                dist[v] = nd
+                pred[v] = e
+                push(heap, (nd, v))
+
+    sources = graph.reverse_adjacency()[2]
+    results = []
+    for i, goal in enumerate(best_goal):
+        if goal is None:
+            results.append(None)
+            continue
+        edges = []
+        node = goal
+        while pred[node] != -1:
+            e = pred[node]
+            edges.append(e)
+            node = sources[e]
+        edges.reverse()
+        results.append(SearchResult([node] + [targets[e] for e in edges], edges, best[i], len(done)))
+    return results
+
+
+def distances_from(graph, source, weights, reverse=False):
+    """
+    Dijkstra 1-tới-tất-cả: chi phí từ `source` tới MỌI node (reverse=True: từ mọi node TỚI source).
+    source có thể là id node hoặc dict {node: chi phí ban đầu}.
+    Output: mảng float64 (n), INF = không tới được.
+    """
+    if reverse:
+        offsets, edge_list, ends = graph.reverse_adjacency()
+    else:
+        offsets, ends = graph.adjacency()
+        edge_list = None
+    w = weights.tolist() if isinstance(weights, np.ndarray) else weights
+    seeds = source if isinstance(source, dict) else {source: 0.0}
+
+    dist = {}
+    heap = []
+    for s, c in seeds.items():
+        if c < dist.get(s, INF):
+            dist[s] = c
+            heap.append((c, s))
+    heapq.heapify(heap)
+    done = set()
+    push, pop = heapq.heappush, heapq.heappop
+    while heap:
+        d, u = pop(heap)
+        if u in done: continue
+        done.add(u)
+        for i in range(offsets[u], offsets[u + 1]):
+            e = edge_list[i] if edge_list is not None else i
+            we = w[e]
+            if we == INF: continue
+            v = ends[e]
+            nd = d + we
+            if nd < dist.get(v, INF):
+                dist[v] = nd
+                push(heap, (nd, v))
+
+    out = np.full(graph.num_nodes, INF)
+    if dist:
+        out[np.fromiter(dist.keys(), dtype=np.int64, count=len(dist))] = np.fromiter(dist.values(), dtype=np.float64, count=len(dist))
+    return out
+
+
+def straight_line_heuristic(graph, target, speed_mps):
+    """
+    Cận dưới thời gian (giây) = Khoảng cách đường chim bay / Tốc độ tối đa.
+    Vector hóa Haversine cho mọi node (dùng cho A* khi trọng số là thời gian).
+    """
+    lat1, lon1 = np.radians(graph.y), np.radians(graph.x)
+    lat2, lon2 = math.radians(graph.y[target]), math.radians(graph.x[target])
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * math.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    dist_m = 2 * 6371000.0 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    return dist_m / speed_mps
+
+
+# Hệ số an toàn cho cận dưới địa lý (chiều dài OSM làm tròn / bán kính Trái Đất khác nhau chút ít)
+HEURISTIC_SAFETY = 0.999
+
+
+def geo_potential(graph, anchors, speed_mps):
+    """
+    Cận dưới thời gian (giây) từ node bất kỳ tới tập `anchors` {node: chi phí cộng thêm}:
+        h(v) = min_a (khoảng cách thẳng(v, a) / speed_mps + chi phí của a)
+    Khoảng cách thẳng = dây cung 3D trên mặt cầu (<= cung tròn lớn, rẻ hơn haversine nhiều).
+    Tính LƯỜI từng node (có nhớ) -> chuyến ngắn không phải tính cho cả đồ thị.
+    Là hàm "consistent": |h(u) - h(v)| <= dây cung(u, v) / speed <= trọng số cạnh u->v
+    (trọng số = eta * (1 + penalty) >= chiều dài / tốc độ tối đa).
+    """
+    ux, uy, uz = graph.unit_vectors()
+    pts = [(ux[a], uy[a], uz[a], c) for a, c in anchors.items()]
+    scale = HEURISTIC_SAFETY * 6371000.0 / speed_mps
+    cache = {}
+    sqrt = math.sqrt
+
+    if len(pts) == 1:
+        ax, ay, az, c = pts[0]
+
+        def h(v):
+            val = cache.get(v)
+            if val is None:
+                val = cache[v] = scale * sqrt((ux[v] - ax) ** 2 + (uy[v] - ay) ** 2 + (uz[v] - az) ** 2) + c
+            return val
+        return h
+
+    def h(v):
+        val = cache.get(v)
+        if val is None:
+            x, y, z = ux[v], uy[v], uz[v]
+            val = cache[v] = min(scale * sqrt((x - ax) ** 2 + (y - ay) ** 2 + (z - az) ** 2) + c
+                                 for ax, ay, az, c in pts)
+        return val
+    return h
+
+
+def bidirectional_search(graph, source, target, weights, speed_mps=None, bounds=None, stretch=0.0):
+    """
+    Lõi của A* 2 chiều, trả về CẢ 2 cây tìm kiếm (SearchTrees) thay vì chỉ 1 đường đi.
+    Thế năng trung bình (Ikeda): p(v) = (h_t(v) - h_s(v)) / 2 cho chiều xuôi, -p(v) cho chiều ngược,
+    với h_t / h_s là cận dưới chim bay tới target / từ source (geo_potential).
+    -> trọng số rút gọn không âm ở CẢ 2 chiều, dừng khi min khóa xuôi + min khóa ngược >= mu * (1 + stretch).
+    stretch > 0: tìm tiếp quá điểm dừng thường để 2 cây phủ thêm các node "đi vòng" không quá
+    (1 + stretch) lần đường tốt nhất (ứng viên via-node cho đường thay thế, xem alternatives.py).
+    speed_mps = bounds = None: không có cận (Dijkstra 2 chiều).
+    bounds: (h_t, h_s) tự chọn thay cho cận chim bay (VD landmarks.LandmarkTable.bounds) - phải consistent.
+    """
+    offsets, targets = graph.adjacency()
+    in_offsets, in_edges, sources = graph.reverse_adjacency()
+    w, expand_f, expand_b = weight_lists(weights)
+    seeds = source if isinstance(source, dict) else {source: 0.0}
+    goals = target if isinstance(target, dict) else {target: 0.0}
+
+    if bounds is not None:
+        h_t, h_s = bounds
+    elif speed_mps is not None:
+        h_t = geo_potential(graph, goals, speed_mps)
+        h_s = geo_potential(graph, seeds, speed_mps)
+    else:
+        h_t = h_s = lambda v: 0.0
+
+    pot = {}
+
+    def p(v):
+        val = pot.get(v)
+        if val is None:
+            val = pot[v] = (h_t(v) - h_s(v)) / 2
+        return val
+
+    dist_f, dist_b = {}, {}
+    pred_f, succ_b = {}, {}
+    heap_f, heap_b = [], []
+    for s, c in seeds.items():
+        if c < dist_f.get(s, INF):
+            dist_f[s], pred_f[s] = c, -1
+    for t, c in goals.items():
+        if c < dist_b.get(t, INF):
+            dist_b[t], succ_b[t] = c, -1
+    heap_f = [(d + p(v), d, v) for v, d in dist_f.items()]
+    heap_b = [(d - p(v), d, v) for v, d in dist_b.items()]
+    heapq.heapify(heap_f)
+    heapq.heapify(heap_b)
+
+    # mu: chi phí đường tốt nhất đã thấy, meet: node gặp nhau
+    mu, meet = INF, None
+    for v in dist_f.keys() & dist_b.keys():
+        if dist_f[v] + dist_b[v] < mu:
+            mu, meet = dist_f[v] + dist_b[v], v
+
+    done_f, done_b = set(), set()
+    push, pop = heapq.heappush, heapq.heappop
+    factor = 1.0 + stretch
+
+    while heap_f and heap_b:
+        if heap_f[0][0] + heap_b[0][0] >= mu * factor:
+            break
+        # Luân phiên theo hàng đợi nhỏ hơn (cân bằng 2 chiều)
+        if len(heap_f) <= len(heap_b):
+            _, d, u = pop(heap_f)
+            if u in done_f: continue
+            done_f.add(u)
+            if expand_f is not None: expand_f(u, heap_f)
+            for e in range(offsets[u], offsets[u + 1]):
+                we = w[e]
+                if we == INF: continue
+                v = targets[e]
+                nd = d + we
+                if nd < dist_f.get(v, INF):
+                    dist_f[v] = nd
+                    pred_f[v] = e
+                    push(heap_f, (nd + p(v), nd, v))
+                    db = dist_b.get(v)
+                    if db is not None and nd + db < mu:
+                        mu, meet = nd + db, v
+        else:
+            _, d, u = pop(heap_b)
+            if u in done_b: continue
+            done_b.add(u)
+            if expand_b is not None: expand_b(u, heap_b)
+            for i in range(in_offsets[u], in_offsets[u + 1]):
+                e = in_edges[i]
+                we = w[e]
+                if we == INF: continue
+                v = sources[e]
+                nd = d + we
+                if nd < dist_b.get(v, INF):
+                    dist_b[v] = nd
+                    succ_b[v] = e
+                    push(heap_b, (nd - p(v), nd, v))
+                    df = dist_f.get(v)
+                    if df is not None and df + nd < mu:
+                        mu, meet = df + nd, v
+
+    return SearchTrees(dist_f, pred_f, done_f, dist_b, succ_b, done_b, mu, meet)
+
+
+def via_path(graph, trees, via):
+    """
+    Đường đi source -> via (cây xuôi, truy ngược pred) + via -> target (cây ngược, theo succ).
+    Output: (nodes, edges).
+    """
+    sources, targets = graph.reverse_adjacency()[2], graph.adjacency()[1]
+    edges = []
+    node = via
+    while trees.pred_f[node] != -1:
+        e = trees.pred_f[node]
+        edges.append(e)
+        node = sources[e]
+    edges.reverse()
+    start = node
+    node = via
+    while trees.succ_b[node] != -1:
+        e = trees.succ_b[node]
+        edges.append(e)
+        node = targets[e]
+    return [start] + [targets[e] for e in edges], edges
+
+
+def bidirectional_astar(graph, source, target, weights, speed_mps=None, bounds=None):
+    """
+    A* 2 chiều (tìm xuôi từ source + tìm ngược từ target, gặp nhau ở giữa), xem bidirectional_search.
+    Input/Output giống shortest_path (source/target có thể là dict node ảo);
+    settled = tổng số node đã chốt của 2 chiều.
+    """
+    trees = bidirectional_search(graph, source, target, weights, speed_mps, bounds)
+    if trees.meet is None:
+        return None
+    nodes, edges = via_path(graph, trees, trees.meet)
+    return SearchResult(nodes, edges, trees.mu, len(trees.done_f) + len(trees.done_b))
+
+
+def penalize_path(graph, weights, path_edges, factor):
+    """
+    Nhân trọng số các cạnh trên đường đi (kể cả cạnh song song u->v) lên `factor` lần.
+    Tương đương vòng lặp phạt sub_G[u][v][key]['final_weight'] *= factor của bản networkx.
+    """
+    offsets, targets = graph.adjacency()
+    sources = graph.sources
+    for e in path_edges:
+        u, v = int(sources[e]), targets[e]
+        for e2 in range(offsets[u], offsets[u + 1]):
+            if targets[e2] == v:
+                weights[e2] *= factor
+
+
+# ==========================================
+# ĐỐI CHIẾU VỚI NETWORKX (Reference)
+# ==========================================
+def reference_shortest_path(G, graph, source, target, weights):
+    """
+    Bản tham chiếu: networkx thuần (chậm nhưng 'chuẩn') trên G - thường là
+    G_full.subgraph(...) (view, không copy). Trọng số đọc từ mảng `weights`
+    theo edge id, KHÔNG ghi gì vào đồ thị.
+    Output: SearchResult giống shortest_path (settled = 0 vì networkx không báo).
+    """
+    import networkx as nx
+    index = graph.edge_index()
+
+    def weight(u, v, d):
+        w = min(weights[index[(u, v, k)]] for k in d)
+        return None if w == INF else w  # None = networkx bỏ qua cạnh
+
+    try:
+        path = nx.shortest_path(G, int(graph.osmids[source]), int(graph.osmids[target]), weight=weight)
+    except nx.NetworkXNoPath:
+        return None
+
+    # Đổi đường đi (id OSM) sang id nội bộ + chọn cạnh song song nhẹ nhất (giống networkx)
+    nodes = [graph.node_index[n] for n in path]
+    edges = [min((index[(u, v, k)] for k in G[u][v]), key=lambda e: weights[e]) for u, v in zip(path[:-1], path[1:])]
+    return SearchResult(nodes, edges, float(sum(weights[e] for e in edges)), 0)
+
+
+def check_against_networkx(G, graph, pairs, weight='length', tol=1e-6):
+    """
+    So sánh chi phí đường đi của CSR với networkx trên các cặp (orig_osm, dest_osm).
+    Trả về danh sách các cặp bị lệch (rỗng = khớp hoàn toàn).
+    """
+    weights = graph.weights_from_graph(G, weight)
+    mismatches = []
+    for orig, dest in pairs:
+        s, t = graph.node_index[orig], graph.node_index[dest]
+        ref = reference_shortest_path(G, graph, s, t, weights)
+        res = shortest_path(graph, s, t, weights)
+        ref_cost = ref.cost if ref else None
+        cost = res.cost if res else None
+        if (ref_cost is None) != (cost is None) or (cost is not None and abs(cost - ref_cost) > tol):
+            mismatches.append((orig, dest, ref_cost, cost))
+    return mismatches
+
+
+if __name__ == '__main__':
+    # Tự kiểm tra nhanh: python graph_engine.py <file.graphml>
+    import random
+    import sys
+    import time
+    import osmnx as ox
+
+    G = ox.load_graphml(sys.argv[1] if len(sys.argv) > 1 else 'vietnam_d1_map.graphml')
+    t0 = time.time()
+    cg = build_compact_graph(G)
+    print(f"🧱 CSR: {cg.num_nodes} node, {cg.num_edges} cạnh ({time.time() - t0:.2f}s)")
+
+    nodes = list(G.nodes)
+    pairs = [(random.choice(nodes), random.choice(nodes)) for _ in range(50)]
+    bad = check_against_networkx(G, cg, pairs)
+    print(f"✅ Khớp networkx {len(pairs) - len(bad)}/{len(pairs)} cặp" if not bad else f"❌ Lệch: {bad[:5]}")
+    if bad:
+        sys.exit(1)
@@ -0,0 +1,182 @@
+# file: graph_snapshot.py
+"""
+Ảnh chụp nhị phân (Binary Snapshot) của bản đồ để khởi động nhanh.
+
+ox.load_graphml phải parse XML + import osmnx/geopandas -> worker khởi động rất lâu.
+Bước build OFFLINE (chạy 1 lần):
+    python graph_snapshot.py hcm_map_drive.graphml hcm_map_walk.graphml
+sẽ ghi ra thư mục 'hcm_map_drive.snapshot/' gồm:
+    - Các mảng .npy: CSR topology, tọa độ, length/highway/maxspeed, hình học cạnh (packed)
+    - manifest.json: phiên bản định dạng + checksum của file GraphML gốc
+    - Mảng phụ (extras): cấu trúc CCH (cch.py) dựng sẵn, không phụ thuộc trọng số
+      + bảng landmark ALT (landmarks.py) dạng float32
+Lúc chạy, load_snapshot() memory-map (mmap) các mảng -> N worker dùng chung 1 bản trong
+page cache của hệ điều hành. Thiếu snapshot / phiên bản cũ / GraphML đã đổi -> trả về None
+để traffic.py quay về đường GraphML cũ.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import cch
+import graph_engine
+import landmarks
+
+# Tăng số này mỗi khi đổi định dạng (thêm/bớt mảng, đổi kiểu dữ liệu...)
+SNAPSHOT_VERSION = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+# Các mảng bắt buộc của CompactGraph (tên file = tên thuộc tính)
+GRAPH_ARRAYS = [
+    'osmids', 'x', 'y',
+    'offsets', 'sources', 'targets', 'edge_keys',
+    'length', 'highway', 'highway_multi', 'maxspeed',
+    'geom_offsets', 'geom_x', 'geom_y',
+]
+
+
+def snapshot_dir(graphml_path):
+    """hcm_map_drive.graphml -> hcm_map_drive.snapshot"""
+    return os.path.splitext(graphml_path)[0] + '.snapshot'
+
+
+def _file_sha1(path, chunk=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _source_info(graphml_path):
+    st = os.stat(graphml_path)
+    return {
+        'name': os.path.basename(graphml_path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha1': _file_sha1(graphml_path),
+    }
+
+
+def write_snapshot(graph, out_dir, source=None, extra_arrays=None):
+    """
+    Ghi CompactGraph ra thư mục snapshot (ghi vào thư mục tạm rồi đổi tên -> không bao giờ
+    để lại snapshot dở dang).
+    extra_arrays: dict {tên: mảng} lưu kèm (VD bảng landmark), đọc lại qua graph.extras.
+    """
+    tmp_dir = out_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    arrays = {name: getattr(graph, name) for name in GRAPH_ARRAYS}
+    arrays.update(extra_arrays or {})
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.ascontiguousarray(arr))
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'num_nodes': graph.num_nodes,
+        'num_edges': graph.num_edges,
+        'highway_names': list(graph.highway_names),
+        'arrays': sorted(arrays),
+        'extras': sorted(extra_arrays or {}),
+        'source': source,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+
+def build_snapshot(graphml_path, out_dir=None):
+    """Bước build OFFLINE: GraphML -> CompactGraph -> snapshot."""
+    import osmnx as ox
+
+    out_dir = out_dir or snapshot_dir(graphml_path)
+    print(f"📂 Đang đọc '{graphml_path}'...")
+    G = ox.load_graphml(graphml_path)
+    graph = graph_engine.build_compact_graph(G)
+    extras = {}
+    try:
+        extras.update(cch.build_cch(graph).to_extras())
+    except Exception as e:
+        print(f"⚠️ [SNAPSHOT] Không dựng được CCH ({e}). Snapshot không kèm CCH.")
+    try:
+        extras.update(landmarks.build_landmarks(graph).to_extras())
+    except Exception as e:
+        print(f"⚠️ [SNAPSHOT] Không dựng được bảng landmark ({e}). Snapshot không kèm ALT.")
+    write_snapshot(graph, out_dir, source=_source_info(graphml_path), extra_arrays=extras)
+    print(f"💾 Đã ghi snapshot '{out_dir}' ({graph.num_nodes} node, {graph.num_edges} cạnh)")
+    return out_dir
+
+
+def _is_fresh(manifest, graphml_path):
+    """
+    Snapshot còn khớp với GraphML gốc không?
+    Nhanh: so size + mtime. Nếu mtime khác (copy file, git checkout...) thì so SHA-1 nội dung.
+    Không có file GraphML (chỉ deploy snapshot) -> coi như hợp lệ.
+    """
+    source = manifest.get('source')
+    if not os.path.exists(graphml_path) or not source:
+        return True
+    st = os.stat(graphml_path)
+    if st.st_size != source.get('size'):
+        return False
+    if st.st_mtime_ns == source.get('mtime_ns'):
+        return True
+    return _file_sha1(graphml_path) == source.get('sha1')
+
+
+def load_snapshot(graphml_path, snap_dir=None, mmap=True):
+    """
+    Nạp snapshot của graphml_path dưới dạng CompactGraph (mảng mmap, chỉ đọc).
+    Output: CompactGraph, hoặc None nếu snapshot thiếu / sai phiên bản / lỗi thời.
+    """
+    snap_dir = snap_dir or snapshot_dir(graphml_path)
+    manifest_path = os.path.join(snap_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != SNAPSHOT_VERSION:
+            print(f"⚠️ [SNAPSHOT] '{snap_dir}' là phiên bản {manifest.get('version')}, cần {SNAPSHOT_VERSION}. Bỏ qua.")
+            return None
+        if not _is_fresh(manifest, graphml_path):
+            print(f"⚠️ [SNAPSHOT] '{snap_dir}' đã cũ so với '{graphml_path}'. Bỏ qua.")
+            return None
+
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(snap_dir, name + '.npy'), mmap_mode=mode)
+                  for name in manifest['arrays']}
+        graph = graph_engine.CompactGraph(
+            highway_names=manifest['highway_names'],
+            **{name: arrays[name] for name in GRAPH_ARRAYS}
+        )
+        graph.extras = {name: arrays[name] for name in manifest.get('extras', [])}
+        return graph
+    except Exception as e:
+        print(f"⚠️ [SNAPSHOT] Không đọc được '{snap_dir}' ({e}). Quay về GraphML.")
+        return None
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    files = sys.argv[1:] or ['hcm_map_drive.graphml', 'hcm_map_walk.graphml']
+    for path in files:
+        if not os.path.exists(path):
+            print(f"❌ Không thấy '{path}'")
+            continue
+        out = build_snapshot(path)
+        t0 = time.time()
+        g = load_snapshot(path)
+        print(f"⚡ Nạp lại bằng mmap: {(time.time() - t0) * 1000:.1f} ms")
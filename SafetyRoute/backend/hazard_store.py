@@ -0,0 +1,360 @@
+# file: hazard_store.py
+"""
+Kho dữ liệu môi trường (Hazard Store) được cập nhật NỀN.
+
+Trước đây MỖI request tìm đường (và /api/map-data) tự đọc real_disasters.json, có thể gọi
+NASA EONET (timeout 10s) và 9 lần Open-Meteo tuần tự -> request bị treo theo mạng.
+Giờ một thread nền làm mới từng lớp (thiên tai / thời tiết / đám đông) theo TTL trên toàn vùng
+phục vụ, dựng sẵn chỉ mục, rồi công bố 1 HazardSnapshot mới (bất biến) bằng phép gán nguyên tử.
+Request chỉ lấy snapshot hiện tại và lọc theo BBox -> không bao giờ chờ mạng, và mọi lớp
+trong 1 request đều đến từ CÙNG 1 snapshot (nhất quán).
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import disasters
+import standardization
+import weather
+
+LAYERS = ('disasters', 'weather', 'crowd')
+
+# Thời gian sống (giây) của từng lớp trước khi thread nền làm mới
+LAYER_TTL_S = {
+    'disasters': float(os.getenv("DISASTER_TTL_S", "600")),
+    'weather': float(os.getenv("WEATHER_TTL_S", "900")),
+    'crowd': float('inf'),   # crowd_zones.json tĩnh, nạp 1 lần
+}
+
+# Vùng phục vụ "south,west,north,east" (mặc định: khung của bản đồ drive đã load)
+HAZARD_REGION = os.getenv("HAZARD_REGION")
+
+# Thời tiết: chia vùng phục vụ thành các ô ~WEATHER_TILE_DEG độ, mỗi ô quét như get_weather_zones cũ
+WEATHER_TILE_DEG = float(os.getenv("WEATHER_TILE_DEG", "0.25"))
+
+# Thiên tai: lấy trong bán kính (nửa đường chéo vùng + lề) quanh tâm vùng
+DISASTER_MARGIN_KM = 50
+REAL_DISASTERS_FILE = 'real_disasters.json'
+
+# Nghỉ tối thiểu giữa 2 vòng làm mới khi có lỗi liên tục (giây)
+MIN_REFRESH_WAIT_S = 5.0
+
+
+class HazardLayer:
+    """1 lớp dữ liệu (bất biến): danh sách gốc + mảng tọa độ + chỉ mục lưới theo bán kính."""
+    def __init__(self, items, version):
+        self.items = items
+        self.version = version
+        self.lat = np.array([it['lat'] for it in items], dtype=np.float64)
+        self.lng = np.array([it['lng'] for it in items], dtype=np.float64)
+        self.index = standardization.create_spatial_index(items)
+        # Dấu vân tay nội dung: giống nhau giữa các tiến trình/lần khởi động -> dùng làm ETag
+        self.digest = hashlib.sha1(json.dumps(items, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def within(self, bbox, strict=False):
+        """Các item có TÂM nằm trong bbox (south, west, north, east)."""
+        south, west, north, east = bbox
+        # Tâm trong bbox thì vùng ảnh hưởng chắc chắn chạm bbox -> lọc thô bằng lưới rồi mới so tâm
+        cand = np.array(self.index.intersection((west, south, east, north)), dtype=np.int64)
+        lat, lng = self.lat[cand], self.lng[cand]
+        if strict:
+            mask = (south < lat) & (lat < north) & (west < lng) & (lng < east)
+        else:
+            mask = (south <= lat) & (lat <= north) & (west <= lng) & (lng <= east)
+        return [self.items[i] for i in cand[mask].tolist()]
+
+    def touching(self, bbox):
+        """Các item có VÙNG ẢNH HƯỞNG (bán kính) chạm bbox (south, west, north, east)."""
+        south, west, north, east = bbox
+        return [self.items[i] for i in self.index.intersection((west, south, east, north))]
+
+
+class HazardSnapshot:
+    """Ảnh chụp nhất quán của mọi lớp tại 1 thời điểm. Không bao giờ bị sửa sau khi công bố."""
+    def __init__(self, version, layers, updated_at):
+        self.version = version          # tăng mỗi khi có lớp đổi dữ liệu
+        self.layers = layers            # {tên lớp: HazardLayer}
+        self.updated_at = updated_at    # {tên lớp: thời điểm làm mới gần nhất (epoch)}
+
+    @property
+    def versions(self):
+        return {name: layer.version for name, layer in self.layers.items()}
+
+    @property
+    def digests(self):
+        return tuple(self.layers[name].digest for name in LAYERS)
+
+    def scan(self, bbox):
+        """
+        Dữ liệu môi trường trong hộp (south, west, north, east) cho 1 request tìm đường.
+        Thiên tai / đám đông: lọc theo tâm (như _scan_environment cũ).
+        Thời tiết: các vùng có bán kính chạm hộp.
+        """
+        return {
+            "disasters": self.layers['disasters'].within(bbox),
+            "weather": self.layers['weather'].touching(bbox),
+            "crowd": self.layers['crowd'].within(bbox, strict=True),
+        }
+
+
+class HazardStore:
+    def __init__(self, region=None):
+        self.region = region
+        self._snapshot = HazardSnapshot(0, {name: HazardLayer([], 0) for name in LAYERS},
+                                        {name: 0.0 for name in LAYERS})
+        self._refresh_lock = threading.Lock()   # chỉ 1 lượt làm mới tại 1 thời điểm (đọc KHÔNG cần khóa)
+        self._wake = threading.Event()
+        self._force = False
+        self._thread = None
+        self._fetchers = {
+            'disasters': self._fetch_disasters,
+            'weather': self._fetch_weather,
+            'crowd': self._fetch_crowd,
+        }
+
+    # --- ĐỌC (gọi từ request) ---
+    def snapshot(self):
+        return self._snapshot
+
+    # --- NGUỒN DỮ LIỆU (chạy trong thread nền) ---
+    def _fetch_disasters(self):
+        # 1. Ưu tiên file thực
+        if os.path.exists(REAL_DISASTERS_FILE):
+            try:
+                with open(REAL_DISASTERS_FILE, 'r', encoding='utf-8') as f:
+                    items = json.load(f)
+                if items:
+                    return items
+            except Exception as e:
+                print(f"⚠️ [HAZARD] Lỗi đọc '{REAL_DISASTERS_FILE}' ({e})")
+
+        # 2. Mock / NASA EONET quanh tâm vùng phục vụ
+        south, west, north, east = self.region
+        mid_lat, mid_lng = (south + north) / 2, (west + east) / 2
+        half_diag = standardization.haversine(south, west, north, east) / 2
+        return disasters.get_natural_disasters(mid_lat, mid_lng, max_distance_km=half_diag + DISASTER_MARGIN_KM)
+
+    def _fetch_weather(self):
+        south, west, north, east = self.region
+        n_lat = max(1, math.ceil((north - south) / WEATHER_TILE_DEG))
+        n_lng = max(1, math.ceil((east - west) / WEATHER_TILE_DEG))
+        lat_edges = np.linspace(south, north, n_lat + 1)
+        lng_edges = np.linspace(west, east, n_lng + 1)
+        tiles = [(lat_edges[i], lng_edges[j], lat_edges[i + 1], lng_edges[j + 1])
+                 for i in range(n_lat) for j in range(n_lng)]
+        return [z for zones in weather.get_weather_zones_many(tiles) for z in zones]
+
+    def _fetch_crowd(self):
+        return standardization.CROWD_ZONES
+
+    # --- LÀM MỚI ---
+    def refresh(self, layers=None, force=False):
+        """
+        Làm mới các lớp đã hết TTL (hoặc tất cả nếu force) rồi công bố snapshot mới.
+        Lỗi nguồn nào thì giữ nguyên dữ liệu cũ của lớp đó.
+        Output: snapshot hiện tại sau khi làm mới.
+        """
+        with self._refresh_lock:
+            snap = self._snapshot
+            now = time.time()
+            due = [name for name in (layers or LAYERS)
+                   if force or snap.layers[name].version == 0 or now - snap.updated_at[name] >= LAYER_TTL_S[name]]
+            if not due or self.region is None:
+                return snap
+
+            new_layers, updated_at, changed = dict(snap.layers), dict(snap.updated_at), False
+            for name in due:
+                try:
+                    items = self._fetchers[name]()
+                except Exception as e:
+                    print(f"⚠️ [HAZARD] Không làm mới được lớp '{name}' ({e}). Giữ dữ liệu cũ.")
+                    continue
+                updated_at[name] = now
+                old = snap.layers[name]
+                if old.version == 0 or items != old.items:
+                    new_layers[name] = HazardLayer(items, old.version + 1)
+                    changed = True
+
+            self._snapshot = HazardSnapshot(snap.version + 1 if changed else snap.version, new_layers, updated_at)
+            if changed:
+                print(f"🛰️ [HAZARD] Snapshot v{self._snapshot.version}: " +
+                      ", ".join(f"{n}={len(l.items)} (v{l.version})" for n, l in new_layers.items()))
+            return self._snapshot
+
+    def _next_wait(self):
+        """Số giây tới khi có lớp hết TTL."""
+        snap, now = self._snapshot, time.time()
+        waits = [snap.updated_at[n] + LAYER_TTL_S[n] - now if snap.layers[n].version else 0.0 for n in LAYERS]
+        return max(MIN_REFRESH_WAIT_S, min(waits))
+
+    def _run(self):
+        while True:
+            force, self._force = self._force, False
+            try:
+                self.refresh(force=force)
+            except Exception as e:
+                print(f"⚠️ [HAZARD] Lỗi thread làm mới ({e})")
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+
+    def start(self, region=None):
+        """Bật thread nền (daemon). Gọi nhiều lần cũng chỉ chạy 1 thread."""
+        if region is not None:
+            self.region = tuple(float(v) for v in region)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='hazard-store', daemon=True)
+        self._thread.start()
+        print(f"🛰️ [HAZARD] Thread làm mới dữ liệu môi trường đã chạy (vùng {self.region})")
+
+    def invalidate(self):
+        """Yêu cầu làm mới TẤT CẢ các lớp ngay (VD khi bật/tắt DEMO). Không chờ."""
+        self._force = True
+        self._wake.set()
+
+
+def parse_region(text):
+    """'south,west,north,east' -> tuple float, lỗi -> None."""
+    try:
+        south, west, north, east = (float(v) for v in text.split(','))
+        return south, west, north, east
+    except Exception:
+        return None
+
+
+# Kho dùng chung của tiến trình (app.py bật thread nền khi khởi động: core_logic.start_hazard_store)
+STORE = HazardStore(parse_region(HAZARD_REGION) if HAZARD_REGION else None)
+
+
+if __name__ == '__main__':
+    # Tự kiểm tra với server HTTP giả lập EONET + Open-Meteo chạy cục bộ (không cần mạng)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import sys
+    from urllib.parse import parse_qs, urlparse
+
+    delay = {'s': 0.0}
+    weather_code = {'v': 63}   # 63 = mưa vừa; đổi sang 0 (trời quang) để giả lập dữ liệu đổi
+    calls = {'weather': 0, 'points': 0, 'events': 0, 'not_modified': 0}
+    EVENTS_ETAG = '"stub-v1"'
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay['s'])
+            if self.path.startswith('/events'):
+                calls['events'] += 1
+                if self.headers.get('If-None-Match') == EVENTS_ETAG:
+                    calls['not_modified'] += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = {"events": [{"title": "Stub flood", "categories": [{"id": "floods"}],
+                                    "geometry": [{"type": "Point", "coordinates": [106.70, 10.78]}]}]}
+            else:
+                # Open-Meteo: nhiều tọa độ (cách nhau dấu phẩy) -> trả list, 1 tọa độ -> object
+                lats = parse_qs(urlparse(self.path).query).get('latitude', [''])[0].split(',')
+                calls['weather'] += 1
+                calls['points'] += len(lats)
+                items = [{"current_weather": {"weathercode": weather_code['v'], "windspeed": 4.0}} for _ in lats]
+                body = items if len(items) > 1 else items[0]
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            if self.path.startswith('/events'):
+                self.send_header('ETag', EVENTS_ETAG)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    disasters.EONET_URL = base + '/events'
+    weather.OPEN_METEO_URL = base + '/v1/forecast'
+    disasters.DEMO_MODE = weather.DEMO_MODE = False
+    disasters.EONET_TTL_S = 0          # luôn hỏi lại NASA -> kiểm tra được ETag / 304
+    REAL_DISASTERS_FILE = '__missing__.json'
+
+    def check(cond, msg):
+        print(f"{'✅' if cond else '❌'} {msg}")
+        return cond
+
+    store = HazardStore(region=(10.74, 106.66, 10.82, 106.74))
+    snap = store.refresh(force=True)
+    env = snap.scan((10.76, 106.68, 10.80, 106.72))
+    ok = check(snap.version == 1 and snap.versions == {n: 1 for n in LAYERS}
+               and len(env['disasters']) == 1 and len(env['weather']) > 0,
+               f"Làm mới lần 1: v{snap.version} {snap.versions} | trong hộp: {len(env['disasters'])} thiên tai, "
+               f"{len(env['weather'])} vùng mưa, {len(env['crowd'])} điểm nóng")
+    print(f"   Open-Meteo: {calls['weather']} lần gọi cho {calls['points']} ô (gộp nhiều tọa độ / lần)")
+
+    # Hộp của user khác lệch chút so với vùng đã quét -> rơi vào cùng ô cache, không gọi lại API
+    before = calls['weather']
+    weather.get_weather_zones((10.743, 106.662, 10.823, 106.738))
+    ok &= check(calls['weather'] == before, f"Hộp chồng lấn: {calls['weather'] - before} lần gọi thêm (cache theo ô lưới)")
+
+    # Chưa hết TTL -> không gọi nguồn nào, trả đúng snapshot cũ
+    before = dict(calls)
+    ok &= check(store.refresh() is snap and calls == before, "Làm mới khi chưa hết TTL: giữ nguyên snapshot, 0 lần gọi")
+
+    # Dữ liệu không đổi -> không tăng phiên bản, dấu vân tay giữ nguyên
+    weather.WEATHER_CACHE.clear()
+    again = store.refresh(force=True)
+    ok &= check(again.version == snap.version and again.versions == snap.versions and again.digests == snap.digests,
+                f"Làm mới lần 2 (không đổi): v{again.version}")
+    ok &= check(calls['not_modified'] > 0,
+                f"EONET: {calls['events']} lần gọi, {calls['not_modified']} lần 304 (dùng lại bảng sự kiện đã parse)")
+
+    # Chỉ thời tiết đổi -> snapshot + lớp weather tăng phiên bản, các lớp khác và dấu vân tay của chúng giữ nguyên
+    weather_code['v'] = 0
+    weather.WEATHER_CACHE.clear()
+    clear = store.refresh(force=True)
+    ok &= check(clear.version == again.version + 1
+                and clear.versions == dict(again.versions, weather=again.versions['weather'] + 1)
+                and clear.digests[0] == again.digests[0] and clear.digests[1] != again.digests[1]
+                and clear.digests[2] == again.digests[2] and not clear.scan((10.76, 106.68, 10.80, 106.72))['weather'],
+                f"Thời tiết đổi: v{clear.version} {clear.versions}")
+
+    # Nguồn lỗi -> giữ dữ liệu cũ của lớp đó, không tăng phiên bản; snapshot cũ không bị sửa
+    def broken():
+        raise RuntimeError("nguồn lỗi giả lập")
+    fetch_weather, store._fetchers['weather'] = store._fetchers['weather'], broken
+    failed = store.refresh(force=True)
+    store._fetchers['weather'] = fetch_weather
+    ok &= check(failed.version == clear.version and failed.layers['weather'] is clear.layers['weather']
+                and snap.versions == {n: 1 for n in LAYERS}, "Nguồn lỗi: giữ lớp cũ, snapshot đã công bố bất biến")
+
+    # Nguồn chậm: thread nền đang làm mới nhưng request đọc snapshot KHÔNG bị chặn
+    delay['s'] = 0.5
+    weather_code['v'] = 63
+    weather.WEATHER_CACHE.clear()
+    store.start()
+    store.invalidate()
+    time.sleep(0.1)
+    t_read, t_max = time.perf_counter(), 0.0
+    for _ in range(1000):
+        t0 = time.perf_counter()
+        store.snapshot().scan((10.76, 106.68, 10.80, 106.72))
+        t_max = max(t_max, time.perf_counter() - t0)
+    t_read = time.perf_counter() - t_read
+    # Bị chặn bởi lượt làm mới thì 1 lần đọc phải chờ cả độ trễ nguồn (0.5 s)
+    ok &= check(t_max < delay['s'] / 2, f"1000 lần đọc khi nguồn chậm: {t_read * 1000:.1f} ms"
+                f" (chậm nhất {t_max * 1000:.2f} ms)")
+
+    # Thread nền công bố snapshot mới (mưa trở lại) mà không ai gọi refresh
+    deadline = time.time() + 30
+    while store.snapshot().version == failed.version and time.time() < deadline:
+        time.sleep(0.05)
+    bg = store.snapshot()
+    ok &= check(bg.version == failed.version + 1 and len(bg.layers['weather'].items) > 0,
+                f"Thread nền làm mới: v{bg.version} {bg.versions}")
+    server.shutdown()
+    if not ok:
+        sys.exit(1)
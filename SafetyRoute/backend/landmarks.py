@@ -0,0 +1,211 @@
+# file: landmarks.py
+"""
+ALT (A*, Landmarks, Triangle inequality) cho tìm đường có trọng số rủi ro.
+
+Cận chim bay / tốc độ tối đa rất lỏng (đường phố chạy chậm hơn nhiều so với tốc độ tối đa),
+còn CCH phải customize lại mỗi request. ALT nằm giữa:
+    - OFFLINE: chọn ~16 landmark ở rìa bản đồ (farthest-point), lưu thời gian đi lúc đường vắng
+      (free-flow) TỪ và TỚI từng landmark dạng float32 (K x n) vào snapshot.
+    - LÚC CHẠY: bất đẳng thức tam giác cho cận dưới d(v, t):
+          d(v, t) >= d(L, t) - d(L, v)   và   d(v, t) >= d(v, L) - d(t, L)
+Trọng số thật = eta * (1 + penalty) >= eta >= thời gian free-flow, nên cận vẫn đúng dù
+penalty rủi ro tăng bao nhiêu (chỉ là lỏng hơn). Dùng với graph_engine.bidirectional_astar.
+"""
+import numpy as np
+
+import graph_engine
+
+INF = graph_engine.INF
+
+ALT_NUM_LANDMARKS = 16
+
+# Số landmark "hiệu lực" dùng cho 1 truy vấn (chọn theo cận tốt nhất giữa s và t)
+ALT_ACTIVE = 4
+
+# Tốc độ sàn (km/h) của calculate_segment_speeds: tốc độ thực không bao giờ nhỏ hơn mức này
+MIN_SPEED_KMH = 5.0
+
+EXTRAS_NAMES = ('alt_landmarks', 'alt_from', 'alt_to')
+
+
+def free_flow_weights(graph, base_speed=None):
+    """
+    Thời gian đi (giây) của mọi cạnh lúc đường vắng: length / max(tốc độ cơ bản, 5 km/h).
+    Tốc độ thực = max(5, cơ bản * hiệu suất <= 1) và đi bộ = 5 km/h -> không bao giờ nhanh hơn.
+    """
+    if base_speed is None:
+        import standardization   # nặng (nạp model) -> chỉ import khi build offline
+        base_speed = standardization.base_speed_array(graph)
+    speed = np.maximum(np.asarray(base_speed, dtype=np.float64), MIN_SPEED_KMH) / 3.6
+    return np.asarray(graph.length, dtype=np.float64) / speed
+
+
+def select_landmarks(graph, weights, k=ALT_NUM_LANDMARKS):
+    """
+    Chọn landmark kiểu farthest-point: landmark mới là node xa nhất (đi + về) so với các landmark đã chọn.
+    Output: (landmarks, dist_from (k x n), dist_to (k x n)) - bảng khoảng cách tính luôn khi chọn.
+    """
+    cx, cy = float(np.mean(graph.x)), float(np.mean(graph.y))
+    center = int(np.argmin((graph.x - cx) ** 2 + (graph.y - cy) ** 2))
+    # Chỉ chọn trong thành phần liên thông của node trung tâm
+    reach = graph_engine.distances_from(graph, center, weights) + graph_engine.distances_from(graph, center, weights, reverse=True)
+    score = np.where(np.isfinite(reach), reach, -1.0)
+
+    landmarks, rows_from, rows_to = [], [], []
+    for _ in range(min(k, int(np.isfinite(reach).sum()))):
+        lm = int(np.argmax(score))
+        d_from = graph_engine.distances_from(graph, lm, weights)
+        d_to = graph_engine.distances_from(graph, lm, weights, reverse=True)
+        landmarks.append(lm)
+        rows_from.append(d_from)
+        rows_to.append(d_to)
+        # Khoảng cách tới tập landmark = min theo từng landmark
+        score = np.minimum(score, np.where(np.isfinite(d_from + d_to), d_from + d_to, -1.0))
+        score[landmarks] = -1.0
+    return (np.array(landmarks, dtype=np.int32),
+            np.array(rows_from, dtype=np.float32).reshape(-1, graph.num_nodes),
+            np.array(rows_to, dtype=np.float32).reshape(-1, graph.num_nodes))
+
+
+class LandmarkTable:
+    def __init__(self, landmarks, dist_from, dist_to):
+        self.landmarks = landmarks    # int32 (K): id node của landmark
+        self.dist_from = dist_from    # float32 (K, n): d(L, v)
+        self.dist_to = dist_to        # float32 (K, n): d(v, L)
+        # Sai số làm tròn float32 khi trừ 2 giá trị lớn -> trừ bớt để cận không bao giờ vượt giá trị thật
+        finite = np.concatenate((dist_from[np.isfinite(dist_from)], dist_to[np.isfinite(dist_to)]))
+        self.tol = 4 * float(np.finfo(np.float32).eps) * (float(finite.max()) if len(finite) else 0.0)
+
+    @property
+    def num_landmarks(self):
+        return len(self.landmarks)
+
+    def to_extras(self):
+        return {'alt_landmarks': self.landmarks, 'alt_from': self.dist_from, 'alt_to': self.dist_to}
+
+    @staticmethod
+    def _pair_bound(f_a, t_a, f_b, t_b):
+        """Cận dưới d(a, b) theo từng landmark (hàng) từ các cột d(L,a), d(a,L), d(L,b), d(b,L)."""
+        with np.errstate(invalid='ignore'):
+            lb = np.maximum(f_b - f_a, t_a - t_b)
+        return np.where(np.isnan(lb), 0.0, lb)
+
+    def _active_rows(self, s, t):
+        """Các landmark cho cận d(s, t) tốt nhất."""
+        lb = self._pair_bound(self.dist_from[:, s].astype(np.float64), self.dist_to[:, s].astype(np.float64),
+                              self.dist_from[:, t].astype(np.float64), self.dist_to[:, t].astype(np.float64))
+        return np.argsort(-lb, kind='stable')[:ALT_ACTIVE]
+
+    def _bound_to(self, rows, nodes, anchors, toward):
+        """
+        min_a (cận d(v, a) + chi phí a)  (toward=True)  hoặc  min_a (cận d(a, v) + chi phí a)
+        cho mọi v trong `nodes`. Output: mảng float64 theo `nodes`.
+        """
+        f = self.dist_from[np.ix_(rows, nodes)].astype(np.float64)
+        t = self.dist_to[np.ix_(rows, nodes)].astype(np.float64)
+        best = np.full(len(nodes), INF)
+        for a, c in anchors.items():
+            fa = self.dist_from[rows, a].astype(np.float64)[:, None]
+            ta = self.dist_to[rows, a].astype(np.float64)[:, None]
+            lb = self._pair_bound(f, t, fa, ta) if toward else self._pair_bound(fa, ta, f, t)
+            best = np.minimum(best, np.maximum(lb.max(axis=0) - self.tol, 0.0) + c)
+        return best
+
+    def _lazy_bound_to(self, rows, anchors, toward):
+        """Giống _bound_to nhưng tính LƯỜI từng node (có nhớ) - cho tìm đường trên cả bản đồ."""
+        f_rows = [self.dist_from[r] for r in rows]
+        t_rows = [self.dist_to[r] for r in rows]
+        consts = [(c, [float(f[a]) for f in f_rows], [float(t[a]) for t in t_rows]) for a, c in anchors.items()]
+        tol = self.tol
+        cache = {}
+
+        def h(v):
+            val = cache.get(v)
+            if val is None:
+                fv = [float(f[v]) for f in f_rows]
+                tv = [float(t[v]) for t in t_rows]
+                val = INF
+                for c, fa, ta in consts:
+                    lb = 0.0
+                    for i in range(len(fv)):
+                        # toward: d(v, a) >= d(L, a) - d(L, v), d(v, L) - d(a, L); ngược lại đổi vai v <-> a
+                        x, y = (fa[i] - fv[i], tv[i] - ta[i]) if toward else (fv[i] - fa[i], ta[i] - tv[i])
+                        if x == x and y == y:   # inf - inf = NaN -> landmark này không cho cận
+                            lb = max(lb, x, y)
+                    val = min(val, max(lb - tol, 0.0) + c)
+                cache[v] = val
+            return val
+        return h
+
+    def bounds(self, seeds, goals, nodes=None):
+        """
+        (h_t, h_s) cho graph_engine.bidirectional_astar, tính sẵn cho các node `nodes`
+        (VD node của hành lang). Node ngoài danh sách nhận cận 0 (vẫn đúng).
+        nodes = None: tính lười theo node được duyệt (hành lang là cả bản đồ).
+        """
+        s, t = min(seeds, key=seeds.get), min(goals, key=goals.get)
+        rows = self._active_rows(s, t)
+        if nodes is None:
+            return self._lazy_bound_to(rows, goals, True), self._lazy_bound_to(rows, seeds, False)
+        nodes = np.asarray(nodes, dtype=np.int64)
+        keys = nodes.tolist()
+        to_goal = dict(zip(keys, self._bound_to(rows, nodes, goals, True).tolist()))
+        from_seed = dict(zip(keys, self._bound_to(rows, nodes, seeds, False).tolist()))
+        return (lambda v: to_goal.get(v, 0.0)), (lambda v: from_seed.get(v, 0.0))
+
+
+def build_landmarks(graph, k=ALT_NUM_LANDMARKS, base_speed=None):
+    """Pha OFFLINE: chọn landmark + bảng khoảng cách free-flow."""
+    return LandmarkTable(*select_landmarks(graph, free_flow_weights(graph, base_speed), k))
+
+
+def load_landmarks(graph):
+    """Bảng landmark lưu trong snapshot (graph.extras). Không có -> None."""
+    if not all(name in graph.extras for name in EXTRAS_NAMES):
+        return None
+    ex = graph.extras
+    return LandmarkTable(np.asarray(ex['alt_landmarks']), ex['alt_from'], ex['alt_to'])
+
+
+if __name__ == '__main__':
+    # Đối chiếu ALT với Dijkstra: python landmarks.py [file.graphml]
+    import sys
+    import time
+
+    import benchmark
+    import standardization
+
+    g = benchmark.load_bench_graph(sys.argv[1] if len(sys.argv) > 1 else 'hcm_map_drive.graphml')
+    base = standardization.base_speed_array(g)
+    t0 = time.perf_counter()
+    table = build_landmarks(g, base_speed=base)
+    print(f"📍 ALT: {table.num_landmarks} landmark ({time.perf_counter() - t0:.2f}s),"
+          f" {(table.dist_from.nbytes + table.dist_to.nbytes) / 1024:.0f} KB")
+
+    rng = np.random.default_rng(0)
+    weights = free_flow_weights(g, base) * (1 + np.where(rng.random(g.num_edges) < 0.2, rng.uniform(0, 3, g.num_edges), 0.0))
+    speed_mps = max(MIN_SPEED_KMH, float(base.max())) / 3.6
+    all_nodes = np.arange(g.num_nodes)
+    ok, settled, t_alt, t_geo = True, {'geo': 0, 'alt': 0}, 0.0, 0.0
+    pairs = rng.integers(0, g.num_nodes, (200, 2)).tolist()
+    for s, t in pairs:
+        ref = graph_engine.shortest_path(g, s, t, weights)
+        t0 = time.perf_counter()
+        geo = graph_engine.bidirectional_astar(g, s, t, weights, speed_mps)
+        t_geo += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        alt = graph_engine.bidirectional_astar(g, s, t, weights, bounds=table.bounds({s: 0.0}, {t: 0.0}, all_nodes))
+        t_alt += time.perf_counter() - t0
+        lazy = graph_engine.bidirectional_astar(g, s, t, weights, bounds=table.bounds({s: 0.0}, {t: 0.0}))
+        ok = ok and (lazy is None) == (alt is None) and (lazy is None or lazy.settled == alt.settled)
+        if (ref is None) != (alt is None):
+            ok = False
+        elif ref is not None:
+            ok = ok and abs(ref.cost - alt.cost) <= 1e-6 * max(1.0, ref.cost)
+            settled['geo'] += geo.settled
+            settled['alt'] += alt.settled
+    n = len(pairs)
+    print(f"🧭 A* 2 chiều: chim bay {t_geo / n * 1000:.2f} ms, chốt {settled['geo'] // n}"
+          f" | ALT {t_alt / n * 1000:.2f} ms, chốt {settled['alt'] // n} | khớp Dijkstra: {ok}")
+    if not ok:
+        sys.exit(1)
@@ -0,0 +1,201 @@
+# file: pareto.py
+"""
+Tìm đường 2 tiêu chí (thời gian vs rủi ro) - tập Pareto trong 1 lần tìm.
+
+Muốn cho người dùng thấy "nhanh hơn bao nhiêu thì nguy hiểm hơn bao nhiêu" thì cách cũ phải gọi
+get_optimal_routes nhiều lần với preferences khác nhau. Ở đây mỗi cạnh có 2 chi phí riêng:
+    c1 = eta (giây)            c2 = penalty * chiều dài (giống total_risk của _audit_route)
+và tìm kiểu gán nhãn (label-setting, Martins) - mỗi node giữ NHIỀU nhãn (c1, c2) không trội lẫn nhau:
+    - Heap xếp theo (c1 + h(v), c2), h = cận dưới thời gian chim bay (graph_engine.geo_potential)
+      -> nhãn của cùng 1 node ra khỏi heap theo c1 tăng dần, nên kiểm tra trội chỉ cần so c2
+         với c2 nhỏ nhất đã chốt ở node đó (O(1), không phải so với cả túi nhãn).
+    - Cắt theo đích (ε): bỏ nhãn mà đường đã tới đích tốt hơn trong phạm vi (1 + ε) ở CẢ 2 tiêu chí
+      (c1 cộng cận dưới h, c2 không giảm) -> tập kết quả phủ tập Pareto thật với sai số (1 + ε).
+    - Trần số nhãn PARETO_MAX_LABELS: vượt trần thì dừng, kết quả đánh dấu truncated
+      (vẫn hợp lệ nhưng có thể thiếu phần đuôi nhiều rủi ro / chậm).
+"""
+import heapq
+import os
+from collections import namedtuple
+
+import graph_engine
+
+INF = graph_engine.INF
+
+# ε: 2 đường chênh nhau dưới 5% ở cả 2 tiêu chí coi như 1
+PARETO_EPSILON = float(os.getenv("PARETO_EPSILON", "0.05"))
+
+# Trần số nhãn tạo ra trong 1 lần tìm (giới hạn công sức)
+PARETO_MAX_LABELS = int(os.getenv("PARETO_MAX_LABELS", "50000"))
+
+# Số đường tối đa trả về (giữ 2 đầu mút: nhanh nhất, an toàn nhất)
+PARETO_MAX_ROUTES = int(os.getenv("PARETO_MAX_ROUTES", "5"))
+
+# 1 đường trên tập Pareto: nodes/edges giống SearchResult, eta (giây), risk (penalty * mét)
+ParetoRoute = namedtuple('ParetoRoute', ['nodes', 'edges', 'eta', 'risk'])
+
+# Kết quả: routes (eta tăng dần, risk giảm dần), labels (số nhãn tạo), settled (số nhãn chốt),
+# truncated (chạm trần nhãn)
+ParetoFront = namedtuple('ParetoFront', ['routes', 'labels', 'settled', 'truncated'])
+
+
+def _thin(front, epsilon, max_routes):
+    """
+    front: list (c1, c2, label) của các nhãn tới đích. Bỏ nhãn bị trội / ε-trội,
+    rồi nếu còn nhiều hơn max_routes thì lấy đều theo c1 (luôn giữ 2 đầu mút).
+    """
+    front = sorted(front, key=lambda f: (f[0], f[1]))
+    kept = []
+    for f in front:
+        if not kept or f[1] * (1 + epsilon) < kept[-1][1]:
+            kept.append(f)
+    if len(kept) > max_routes > 1:
+        step = (len(kept) - 1) / (max_routes - 1)
+        kept = [kept[round(i * step)] for i in range(max_routes)]
+    return kept[:max(max_routes, 1)]
+
+
+def pareto_routes(graph, source, target, eta, risk, expand=None, speed_mps=None,
+                  epsilon=PARETO_EPSILON, max_labels=PARETO_MAX_LABELS, max_routes=PARETO_MAX_ROUTES):
+    """
+    Input:
+        - source, target: id node, HOẶC dict {node: (c1, c2) cộng thêm} (node ảo khi bám giữa cạnh)
+        - eta, risk: list chi phí theo edge id (INF = cạnh bị chặn), c2 phải >= 0
+        - expand: hook(node, heap) gọi trước khi duyệt cạnh ra (overlay lười, graph_engine.weight_lists)
+        - speed_mps: tốc độ tối đa -> cận dưới thời gian cho A*; None = không có cận
+    Output: ParetoFront (routes rỗng nếu không có đường).
+    """
+    offsets, targets = graph.adjacency()
+    seeds = source if isinstance(source, dict) else {source: (0.0, 0.0)}
+    goals = target if isinstance(target, dict) else {target: (0.0, 0.0)}
+    if speed_mps is not None:
+        h = graph_engine.geo_potential(graph, {g: c[0] for g, c in goals.items()}, speed_mps)
+    else:
+        h = lambda v: 0.0
+
+    # Nhãn lưu dạng các list song song (chỉ số nhãn = vị trí)
+    lab_node, lab_c1, lab_c2, lab_pred, lab_edge = [], [], [], [], []
+    heap = []
+    for s, (c1, c2) in seeds.items():
+        lab_node.append(s)
+        lab_c1.append(c1)
+        lab_c2.append(c2)
+        lab_pred.append(-1)
+        lab_edge.append(-1)
+        heap.append((c1 + h(s), c2, len(lab_node) - 1, s))
+    heapq.heapify(heap)
+
+    best_c2 = {}   # node -> c2 nhỏ nhất trong các nhãn đã chốt
+    front = []     # (c1, c2, nhãn) đã tới đích
+    settled = 0
+    truncated = False
+    scale = 1 + epsilon
+    push, pop = heapq.heappush, heapq.heappop
+
+    def target_dominated(key, c2):
+        # Đường tới đích đã có tốt hơn (trong phạm vi ε) mọi cách đi tiếp từ nhãn này
+        for f1, f2, _ in front:
+            if f1 <= scale * key and f2 <= scale * c2:
+                return True
+        return False
+
+    while heap:
+        key, c2, lab, u = pop(heap)
+        if c2 >= best_c2.get(u, INF) or target_dominated(key, c2):
+            continue
+        best_c2[u] = c2
+        settled += 1
+        c1 = lab_c1[lab]
+        if u in goals:
+            g1, g2 = goals[u]
+            if not target_dominated(c1 + g1, c2 + g2):
+                front.append((c1 + g1, c2 + g2, lab))
+
+        if expand is not None: expand(u, heap)
+        for e in range(offsets[u], offsets[u + 1]):
+            w1 = eta[e]
+            if w1 == INF:
+                continue
+            v = targets[e]
+            n2 = c2 + risk[e]
+            # Nhãn đã chốt ở v có c1 <= nhãn mới (h consistent) -> chỉ cần so c2
+            if n2 >= best_c2.get(v, INF):
+                continue
+            if len(lab_node) >= max_labels:
+                truncated = True
+                break
+            n1 = c1 + w1
+            lab_node.append(v)
+            lab_c1.append(n1)
+            lab_c2.append(n2)
+            lab_pred.append(lab)
+            lab_edge.append(e)
+            push(heap, (n1 + h(v), n2, len(lab_node) - 1, v))
+        if truncated:
+            break
+
+    routes = []
+    for f1, f2, lab in _thin(front, epsilon, max_routes):
+        nodes, edges = [], []
+        while lab != -1:
+            nodes.append(lab_node[lab])
+            if lab_edge[lab] != -1:
+                edges.append(lab_edge[lab])
+            lab = lab_pred[lab]
+        routes.append(ParetoRoute(nodes[::-1], edges[::-1], f1, f2))
+    return ParetoFront(routes, len(lab_node), settled, truncated)
+
+
+if __name__ == '__main__':
+    # Kiểm tra tập Pareto: python pareto.py [file.graphml]
+    # - đầu nhanh nhất khớp Dijkstra theo eta, đầu an toàn nhất khớp (trong ε) Dijkstra theo risk
+    # - chi phí mỗi đường = tổng theo cạnh, không đường nào bị đường khác trội
+    import sys
+    import time
+
+    import numpy as np
+
+    import benchmark
+    import landmarks
+    import standardization
+
+    g = benchmark.load_bench_graph(sys.argv[1] if len(sys.argv) > 1 else 'hcm_map_drive.graphml')
+    base = standardization.base_speed_array(g)
+    rng = np.random.default_rng(0)
+    eta_arr = landmarks.free_flow_weights(g, base) * rng.uniform(1.0, 2.0, g.num_edges)
+    risk_arr = np.where(rng.random(g.num_edges) < 0.2, rng.uniform(0, 3, g.num_edges), 0.0) * np.asarray(g.length)
+    speed_mps = max(landmarks.MIN_SPEED_KMH, float(base.max())) / 3.6
+    eta_l, risk_l = eta_arr.tolist(), risk_arr.tolist()
+    # Trọng số phụ để Dijkstra theo risk phân định các đường risk bằng nhau (chọn đường nhanh hơn)
+    risk_tie = risk_arr + 1e-9 * eta_arr
+
+    ok, sizes, labels, t_par, truncated = True, 0, 0, 0.0, 0
+    pairs = rng.integers(0, g.num_nodes, (100, 2)).tolist()
+    for s, t in pairs:
+        ref_eta = graph_engine.shortest_path(g, s, t, eta_arr)
+        ref_risk = graph_engine.shortest_path(g, s, t, risk_tie)
+        t0 = time.perf_counter()
+        res = pareto_routes(g, s, t, eta_l, risk_l, speed_mps=speed_mps)
+        t_par += time.perf_counter() - t0
+        if (ref_eta is None) != (not res.routes):
+            ok = False
+            continue
+        if ref_eta is None:
+            continue
+        truncated += res.truncated
+        sizes += len(res.routes)
+        labels += res.labels
+        fast, safe = res.routes[0], res.routes[-1]
+        ok = ok and abs(fast.eta - ref_eta.cost) <= 1e-6 * max(1.0, ref_eta.cost)
+        best_risk = float(risk_arr[ref_risk.edges].sum())
+        ok = ok and (res.truncated or safe.risk <= (1 + PARETO_EPSILON) * best_risk + 1e-6)
+        for r in res.routes:
+            ok = ok and all(g.adjacency()[1][e] == v for e, v in zip(r.edges, r.nodes[1:]))
+            ok = ok and abs(float(eta_arr[r.edges].sum()) - r.eta) <= 1e-6 * max(1.0, r.eta)
+        for a, b in zip(res.routes, res.routes[1:]):
+            ok = ok and a.eta <= b.eta and a.risk > b.risk
+    n = len(pairs)
+    print(f"⚖️ Pareto: {n} cặp | {t_par / n * 1000:.2f} ms, {labels // n} nhãn, {sizes / n:.2f} đường/cặp,"
+          f" chạm trần {truncated} | hợp lệ: {ok}")
+    if not ok:
+        sys.exit(1)
@@ -0,0 +1,128 @@
+# file: response_cache.py
+"""
+Cache phản hồi HTTP dùng chung cho các API chỉ-đọc (/api/map-data, tiles...).
+
+- ETag tính từ KHÓA (phiên bản dữ liệu + tham số), KHÔNG từ nội dung -> trình duyệt gửi
+  If-None-Match trùng thì trả 304 ngay, không dựng lại JSON.
+- Thân phản hồi (bytes) giữ trong LRU, bản nén gzip/brotli tạo lười 1 lần cho mỗi mã hóa.
+- brotli là tùy chọn: không cài thì chỉ dùng gzip.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Số phản hồi giữ trong RAM cho mỗi cache
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "512"))
+
+# Nhỏ hơn mức này thì không nén (header gzip còn to hơn phần tiết kiệm)
+COMPRESS_MIN_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def make_etag(*parts):
+    """Khóa bất kỳ (phiên bản lớp, bbox...) -> ETag mạnh dạng chuỗi có ngoặc kép."""
+    return '"' + hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20] + '"'
+
+
+class CachedBody:
+    """Thân phản hồi đã tuần tự hóa + các bản nén (tạo khi cần lần đầu)."""
+    def __init__(self, etag, raw, mimetype='application/json'):
+        self.etag = etag
+        self.raw = raw
+        self.mimetype = mimetype
+        self._encoded = {}
+
+    def encoded(self, encoding):
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == 'br':
+                data = brotli.compress(self.raw, quality=BROTLI_QUALITY)
+            else:
+                data = gzip.compress(self.raw, compresslevel=GZIP_LEVEL)
+            self._encoded[encoding] = data   # gán nguyên tử, 2 thread cùng nén cũng không sao
+        return data
+
+
+class ResponseCache:
+    """LRU {khóa: CachedBody}, an toàn khi nhiều thread cùng đọc/ghi."""
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._items.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._items[key] = body
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _pick_encoding(accept_encoding):
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def etag_matches(req, etag):
+    """If-None-Match của request có chứa etag (hoặc '*')."""
+    header = req.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+
+def not_modified(etag, max_age=0):
+    resp = Response(status=304)
+    resp.headers['ETag'] = etag
+    resp.headers['Cache-Control'] = f'public, max-age={max_age}'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+def send(req, body, max_age=0):
+    """CachedBody -> Response (304 nếu ETag khớp, nén theo Accept-Encoding của client)."""
+    if etag_matches(req, body.etag):
+        return not_modified(body.etag, max_age)
+    encoding = _pick_encoding(req.headers.get('Accept-Encoding')) if len(body.raw) >= COMPRESS_MIN_BYTES else None
+    resp = Response(body.encoded(encoding) if encoding else body.raw, mimetype=body.mimetype)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['ETag'] = body.etag
+    resp.headers['Cache-Control'] = f'public, max-age={max_age}'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
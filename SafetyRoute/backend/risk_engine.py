@@ -0,0 +1,154 @@
+# file: risk_engine.py
+"""
+Lớp suy luận rủi ro (Risk Inference) cho risk_model.pkl.
+
+_calculate_weights gửi bộ [disaster, weather, crowd] của MỌI cạnh vào risk_model.predict,
+trong khi phần lớn các bộ trùng nhau ((0, 0, 0) chiếm đa số, điểm thiên tai chỉ có vài mức).
+RiskLUT:
+    1. Khử trùng lặp đầu vào (np.unique theo hàng).
+    2. Tra bảng 3 chiều dựng SẴN từ model lúc load.
+    3. Chỉ các bộ nằm NGOÀI lưới mới gọi model.predict (1 lần cho cả lô).
+
+Bảng không lưu theo giá trị mà theo "khoảng ngưỡng": RandomForest chỉ so x <= ngưỡng, nên
+mọi giá trị nằm giữa 2 ngưỡng liên tiếp (của cùng 1 đặc trưng) cho CÙNG kết quả.
+Lưới (RISK_GRID_STEPS) chỉ quyết định những khoảng nào được tính trước; các điểm lưới rơi vào
+cùng khoảng được gộp lại -> bảng nhỏ, và tra trúng bảng thì kết quả khớp model tuyệt đối.
+"""
+import os
+
+import numpy as np
+
+# Bước lưới của từng đặc trưng (disaster, weather, crowd), đã nhân hệ số ưu tiên 0 -> 2 (bước 0.5)
+RISK_GRID_STEPS = (0.05, 0.05, 0.005)
+RISK_GRID_MAX = float(os.getenv("RISK_GRID_MAX", "2.0"))
+
+# Số điểm ngẫu nhiên dùng để đo sai số bảng so với model lúc load
+RISK_VALIDATE_SAMPLES = 2000
+
+
+def _forest_thresholds(model, n_features):
+    """Các ngưỡng tách (đã sắp, không trùng) của từng đặc trưng trên toàn bộ rừng cây."""
+    if hasattr(model, 'split_thresholds'):   # forest_model.FlatForest
+        return [model.split_thresholds(f) for f in range(n_features)]
+    thresholds = []
+    for f in range(n_features):
+        th = [t.tree_.threshold[t.tree_.feature == f] for t in model.estimators_]
+        thresholds.append(np.unique(np.concatenate(th)) if th else np.zeros(0))
+    return thresholds
+
+
+class RiskLUT:
+    def __init__(self, model, steps=RISK_GRID_STEPS, grid_max=RISK_GRID_MAX):
+        self.model = model
+        self.thresholds = _forest_thresholds(model, len(steps))
+
+        # Trên mỗi trục: điểm lưới -> khoảng ngưỡng; giữ 1 điểm đại diện cho mỗi khoảng phủ được
+        self.axis_pos = []       # khoảng ngưỡng -> vị trí trong bảng (-1 = ngoài lưới)
+        reps = []
+        for th, step in zip(self.thresholds, steps):
+            grid = np.arange(0.0, grid_max + step / 2, step)
+            bins = self._bins(th, grid)
+            covered, first = np.unique(bins, return_index=True)
+            pos = np.full(len(th) + 1, -1, dtype=np.int64)
+            pos[covered] = np.arange(len(covered))
+            self.axis_pos.append(pos)
+            reps.append(grid[first])
+
+        # Bảng 3 chiều: predict 1 lần cho mọi tổ hợp đại diện
+        mesh = np.meshgrid(*reps, indexing='ij')
+        self.table = self._predict(np.column_stack([m.ravel() for m in mesh])).reshape(mesh[0].shape)
+
+        self.rows = 0            # số bộ đầu vào đã xử lý
+        self.unique_rows = 0     # số bộ khác nhau (sau khi khử trùng)
+        self.hits = 0            # số bộ (tính cả trùng) trả lời bằng bảng
+        self.max_abs_error = self.validate()
+
+    @staticmethod
+    def _bins(th, values):
+        # sklearn ép X về float32 rồi đi trái nếu x <= ngưỡng -> đếm số ngưỡng < x
+        return np.searchsorted(th, np.asarray(values, dtype=np.float32).astype(np.float64), side='left')
+
+    def _predict(self, X):
+        return np.asarray(self.model.predict(X), dtype=np.float64)
+
+    def _lookup(self, X):
+        """Vị trí trong bảng của từng hàng X + mặt nạ các hàng tra được."""
+        idx = [pos[self._bins(th, X[:, f])] for f, (th, pos) in enumerate(zip(self.thresholds, self.axis_pos))]
+        ok = np.logical_and.reduce([i >= 0 for i in idx])
+        return idx, ok
+
+    def predict(self, X):
+        """Thay cho model.predict(X). Output: mảng penalty (giống model)."""
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(self.thresholds))
+        if len(X) == 0:
+            return np.zeros(0)
+        uniq, inverse, counts = np.unique(X, axis=0, return_inverse=True, return_counts=True)
+
+        idx, ok = self._lookup(uniq)
+        values = np.empty(len(uniq))
+        values[ok] = self.table[tuple(i[ok] for i in idx)]
+        if not ok.all():
+            values[~ok] = self._predict(uniq[~ok])   # Ngoài lưới -> model thật
+
+        self.rows += len(X)
+        self.unique_rows += len(uniq)
+        self.hits += int(counts[ok].sum())
+        return values[inverse.reshape(-1)]
+
+    def validate(self, n_samples=RISK_VALIDATE_SAMPLES, seed=0):
+        """Sai số tuyệt đối lớn nhất giữa bảng và model trên các điểm ngẫu nhiên tra được bảng."""
+        rng = np.random.default_rng(seed)
+        X = rng.uniform(0.0, RISK_GRID_MAX, (n_samples, len(self.thresholds)))
+        idx, ok = self._lookup(X)
+        if not ok.any():
+            return 0.0
+        return float(np.max(np.abs(self.table[tuple(i[ok] for i in idx)] - self._predict(X[ok]))))
+
+    def stats(self):
+        return {
+            'table_cells': int(self.table.size),
+            'rows': self.rows,
+            'unique_rows': self.unique_rows,
+            'hit_rate': self.hits / self.rows if self.rows else 0.0,
+            'max_abs_error': self.max_abs_error,
+        }
+
+
+def build_risk_lut(model):
+    """
+    Hàm Factory: dựng bảng tra từ risk_model (FlatForest hoặc RandomForest của sklearn).
+    Model không có cấu trúc cây -> None (core_logic gọi thẳng model.predict).
+    """
+    if model is None or not (hasattr(model, 'estimators_') or hasattr(model, 'split_thresholds')):
+        return None
+    try:
+        lut = RiskLUT(model)
+        print(f"🧮 [RISK] Bảng tra rủi ro {lut.table.shape} ({lut.table.size} ô), sai số tối đa {lut.max_abs_error:.2e}")
+        return lut
+    except Exception as e:
+        print(f"⚠️ [RISK] Không dựng được bảng tra ({e}). Dùng model.predict trực tiếp.")
+        return None
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    import forest_model
+
+    model = forest_model.load_model(os.path.join(os.path.dirname(__file__) or '.', 'risk_model.pkl'))
+    t0 = time.time()
+    lut = build_risk_lut(model)
+    print(f"⏱️ Dựng bảng: {(time.time() - t0) * 1000:.0f} ms")
+
+    # Đầu vào giống _calculate_weights: điểm rời rạc x hệ số ưu tiên, thêm vài giá trị lẻ (ngoài lưới)
+    rng = np.random.default_rng(1)
+    uf = rng.choice([0.0, 0.5, 1.0, 1.5, 2.0], (5000, 3))
+    X = np.column_stack((rng.choice([0.0, 0.0, 0.0, 0.5, 1.0], 5000),
+                         rng.choice([0.0, 0.0, 0.1, 0.3, 0.6, 0.9], 5000),
+                         np.round(rng.uniform(0, 1, 5000), 2))) * uf
+    X[:50] = rng.uniform(0, 3, (50, 3))
+    same = np.allclose(lut.predict(X), model.predict(X), rtol=0, atol=1e-9)
+    print(f"📊 {lut.stats()} | khớp model: {same}")
+    if not same:
+        sys.exit(1)
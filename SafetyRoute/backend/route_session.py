@@ -0,0 +1,78 @@
+# file: route_session.py
+"""
+Phiên tìm đường (route session) cho thanh trượt ưu tiên trên frontend.
+
+Kéo thanh trượt (weather / crowd / disaster) chỉ đổi HỆ SỐ nhân vào điểm gốc của từng cạnh,
+còn bám điểm, cắt hành lang, quét môi trường, hình học thiên tai/thời tiết, đám đông, ETA
+đều giữ nguyên. /api/find-routes trả kèm 'session' (token); /api/find-routes/reweight gửi token
++ preferences mới -> chỉ ghép lại penalty (risk model có nhớ theo bộ đầu vào) và tìm lại.
+
+Phiên nằm trong RAM (LRU + hết hạn sau SESSION_TTL_S giây không dùng).
+Điểm gốc của phiên là ảnh chụp môi trường lúc tạo: muốn dữ liệu mới thì gọi lại /api/find-routes.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_TTL_S = int(os.getenv("SESSION_TTL_S", "600"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "256"))
+
+
+class RouteSession:
+    """Ngữ cảnh đã dựng của 1 lần tìm đường: hành lang, điểm đi/đến, bộ chấm điểm (nhớ điểm gốc)."""
+    def __init__(self, corridor, orig_node, dest_node, snaps, scorer):
+        self.corridor = corridor
+        self.orig_node = orig_node
+        self.dest_node = dest_node
+        self.snaps = snaps
+        self.scorer = scorer          # core_logic.EdgeScorer
+        self.token = None
+        self.last_used = time.time()
+
+    @property
+    def vehicle_mode(self):
+        return self.scorer.vehicle_mode
+
+
+class SessionStore:
+    """{token: RouteSession}, an toàn khi nhiều thread cùng đọc/ghi."""
+    def __init__(self, ttl_s=SESSION_TTL_S, max_sessions=SESSION_MAX):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._items:
+            token, sess = next(iter(self._items.items()))
+            if now - sess.last_used <= self.ttl_s and len(self._items) <= self.max_sessions:
+                break
+            del self._items[token]
+
+    def put(self, session):
+        """Lưu phiên, trả về token."""
+        session.token = secrets.token_urlsafe(16)
+        with self._lock:
+            self._items[session.token] = session
+            self._expire(time.time())
+        return session.token
+
+    def get(self, token):
+        """Phiên còn hạn (gia hạn thêm) hoặc None."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            sess = self._items.get(token)
+            if sess is None:
+                return None
+            sess.last_used = now
+            self._items.move_to_end(token)
+            return sess
+
+    def __len__(self):
+        return len(self._items)
+
+
+SESSIONS = SessionStore()
@@ -0,0 +1,370 @@
+# file: spatial_index.py
+"""
+Chỉ mục không gian (Spatial Index) cho đồ thị đường phố.
+
+Thay cho ox.distance.nearest_nodes (dựng lại BallTree mỗi lần gọi), ta dựng 1 KD-tree
+DUY NHẤT khi load bản đồ rồi giữ trong RAM (xem traffic.SNAP_INDEXES).
+    - snap_nodes(): Bám điểm vào NODE gần nhất.
+    - snap_edges(): Bám điểm vào CẠNH gần nhất (chiếu vuông góc lên đoạn thẳng),
+      sinh ra "node ảo" nằm giữa cạnh.
+Cả 2 hàm đều nhận N tọa độ 1 lúc (vector hóa).
+
+GridIndex: lưới đều trên tọa độ node -> cắt "hành lang" (Corridor) theo BBox
+mà không phải quét toàn bộ node hay copy subgraph.
+"""
+import math
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None  # Không có scipy -> quét vét cạn bằng numpy (chậm hơn nhưng vẫn đúng)
+
+INF = float('inf')
+
+# Hệ số quy đổi độ -> mét (cùng phép chiếu Equirectangular với utils.get_min_distance_to_segment)
+M_PER_DEG_LAT = 110570.0
+M_PER_DEG_LON = 111320.0
+
+# Chiều dài tối đa của 1 "mẩu" đoạn thẳng khi đưa vào KD-tree cạnh (mét)
+# Cắt nhỏ đoạn dài để điểm giữa của mẩu luôn đại diện tốt cho đoạn.
+PIECE_LENGTH_M = 50.0
+
+# Kích thước ô lưới của GridIndex (độ) ~ 550m
+GRID_CELL_DEG = 0.005
+
+# Kết quả bám cạnh (1 điểm):
+#   - edge: cạnh u->v được bám vào, twin: cạnh ngược v->u (None nếu đường 1 chiều)
+#   - t: vị trí tương đối trên cạnh (0 = tại u, 1 = tại v)
+#   - lat, lng: tọa độ điểm chiếu (node ảo)
+#   - dist_m: khoảng cách từ điểm gốc tới cạnh (mét)
+EdgeSnap = namedtuple('EdgeSnap', ['edge', 'twin', 't', 'lat', 'lng', 'dist_m'])
+
+
+def snap_sources(graph, snap, weights):
+    """
+    Node ảo làm ĐIỂM ĐI: đi tiếp tới v (phần còn lại của cạnh) hoặc quay về u qua cạnh ngược.
+    Trả về dict {node: chi phí ban đầu} cho graph_engine.shortest_path.
+    """
+    seeds = {}
+    if weights[snap.edge] < INF:
+        seeds[int(graph.targets[snap.edge])] = (1.0 - snap.t) * weights[snap.edge]
+    if snap.twin is not None and weights[snap.twin] < INF:
+        u = int(graph.sources[snap.edge])
+        seeds[u] = min(seeds.get(u, INF), snap.t * weights[snap.twin])
+    return seeds
+
+
+def snap_targets(graph, snap, weights):
+    """
+    Node ảo làm ĐIỂM ĐẾN: tới từ u (đi thêm đoạn t của cạnh) hoặc từ v qua cạnh ngược.
+    Trả về dict {node: chi phí cộng thêm}.
+    """
+    goals = {}
+    if weights[snap.edge] < INF:
+        goals[int(graph.sources[snap.edge])] = snap.t * weights[snap.edge]
+    if snap.twin is not None and weights[snap.twin] < INF:
+        v = int(graph.targets[snap.edge])
+        goals[v] = min(goals.get(v, INF), (1.0 - snap.t) * weights[snap.twin])
+    return goals
+
+
+class SnapIndex:
+    """
+    KD-tree trên tọa độ node (và lazily trên các đoạn thẳng của cạnh).
+    Tọa độ được chiếu phẳng ra mét quanh vĩ độ trung bình của bản đồ.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        lat0 = float(np.mean(graph.y)) if graph.num_nodes else 0.0
+        self.kx = M_PER_DEG_LON * math.cos(math.radians(lat0))
+        self.ky = M_PER_DEG_LAT
+
+        self.node_xy = np.column_stack((graph.x * self.kx, graph.y * self.ky))
+        self.node_tree = cKDTree(self.node_xy) if cKDTree is not None else None
+
+        # Dữ liệu cạnh chỉ dựng khi có người gọi snap_edges()
+        self._segments = None
+
+    def _project(self, lats, lons):
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        return np.column_stack((lons * self.kx, lats * self.ky))
+
+    # ------------------------------------------
+    # BÁM NODE
+    # ------------------------------------------
+    def snap_nodes(self, lats, lons):
+        """
+        Input: N vĩ độ, N kinh độ.
+        Output: (mảng id nội bộ của node gần nhất, mảng khoảng cách mét).
+        """
+        q = self._project(lats, lons)
+        if self.node_tree is not None:
+            dist, idx = self.node_tree.query(q)
+            return idx.astype(np.int32), dist
+
+        idx = np.empty(len(q), dtype=np.int32)
+        dist = np.empty(len(q), dtype=np.float64)
+        for i, p in enumerate(q):
+            d2 = ((self.node_xy - p) ** 2).sum(axis=1)
+            idx[i] = np.argmin(d2)
+            dist[i] = math.sqrt(d2[idx[i]])
+        return idx, dist
+
+    # ------------------------------------------
+    # BÁM CẠNH
+    # ------------------------------------------
+    def _build_segments(self):
+        g = self.graph
+        seg = g.segments()
+        seg_edge = seg.edge
+        ax, ay = seg.a_lon * self.kx, seg.a_lat * self.ky
+        bx, by = seg.b_lon * self.kx, seg.b_lat * self.ky
+        seg_len = np.hypot(bx - ax, by - ay)
+        n_seg = len(seg_edge)
+
+        # Vị trí bắt đầu của đoạn dọc theo cạnh (để tính t)
+        cum = np.cumsum(seg_len)
+        edge_start = np.concatenate(([0.0], cum))[seg.first[:-1]]
+        seg_start = np.concatenate(([0.0], cum[:-1])) - edge_start[seg_edge]
+        edge_len = np.bincount(seg_edge, weights=seg_len, minlength=g.num_edges)
+
+        # Cắt nhỏ đoạn dài thành các mẩu <= PIECE_LENGTH_M, lấy điểm giữa mẩu vào KD-tree
+        n_pieces = np.maximum(1, np.ceil(seg_len / PIECE_LENGTH_M)).astype(np.int64)
+        piece_seg = np.repeat(np.arange(n_seg), n_pieces)
+        first_piece = np.concatenate(([0], np.cumsum(n_pieces)[:-1]))
+        j = np.arange(len(piece_seg)) - np.repeat(first_piece, n_pieces)
+        frac = (j + 0.5) / n_pieces[piece_seg]
+        piece_xy = np.column_stack((ax[piece_seg] + frac * (bx - ax)[piece_seg],
+                                    ay[piece_seg] + frac * (by - ay)[piece_seg]))
+
+        self._segments = {
+            'edge': seg_edge, 'ax': ax, 'ay': ay, 'bx': bx, 'by': by,
+            'len': seg_len, 'start': seg_start, 'edge_len': edge_len,
+            'piece_seg': piece_seg,
+            'half_piece': float((seg_len / n_pieces).max() / 2) if n_seg else 0.0,
+            'tree': cKDTree(piece_xy) if cKDTree is not None else None,
+        }
+        return self._segments
+
+    def _segment_distance(self, q, segs):
+        """Khoảng cách từ mỗi điểm q[i] tới các đoạn segs[i, :] (chiếu vuông góc, kẹp t trong [0,1])."""
+        s = self._segments
+        ax, ay = s['ax'][segs], s['ay'][segs]
+        dx, dy = s['bx'][segs] - ax, s['by'][segs] - ay
+        qx, qy = q[:, 0:1], q[:, 1:2]
+        len_sq = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(len_sq > 0, ((qx - ax) * dx + (qy - ay) * dy) / len_sq, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        return np.hypot(qx - (ax + t * dx), qy - (ay + t * dy)), t
+
+    def snap_edges(self, lats, lons, k=8):
+        """
+        Bám N điểm vào cạnh gần nhất (vector hóa).
+        Output: list EdgeSnap theo đúng thứ tự input.
+        """
+        s = self._segments or self._build_segments()
+        q = self._project(lats, lons)
+        n_seg = len(s['len'])
+
+        if s['tree'] is not None:
+            best_seg = np.zeros(len(q), dtype=np.int64)
+            best_t = np.zeros(len(q))
+            best_d = np.full(len(q), INF)
+            todo = np.arange(len(q))
+
+            # Lấy k mẩu gần nhất rồi tính khoảng cách chính xác tới đoạn của chúng.
+            # Đoạn gần nhất thật sự phải có mẩu nằm trong bán kính (best + nửa mẩu):
+            # điểm nào mà k ứng viên chưa phủ hết bán kính đó -> tăng k và tính lại.
+            while len(todo):
+                k = min(k, len(s['piece_seg']))
+                d_piece, cand = s['tree'].query(q[todo], k=k)
+                d_piece, cand = d_piece.reshape(len(todo), k), cand.reshape(len(todo), k)
+                segs = s['piece_seg'][cand]
+                dist, t = self._segment_distance(q[todo], segs)
+                best = np.argmin(dist, axis=1)
+                rows = np.arange(len(todo))
+                best_seg[todo], best_t[todo], best_d[todo] = segs[rows, best], t[rows, best], dist[rows, best]
+
+                if k == len(s['piece_seg']): break
+                todo = todo[d_piece[:, -1] <= best_d[todo] + s['half_piece']]
+                k *= 4
+        else:
+            best_seg = np.empty(len(q), dtype=np.int64)
+            best_t = np.empty(len(q))
+            best_d = np.empty(len(q))
+            all_segs = np.arange(n_seg)[None, :]
+            for i in range(len(q)):
+                d_i, t_i = self._segment_distance(q[i:i + 1], all_segs)
+                j = int(np.argmin(d_i[0]))
+                best_seg[i], best_t[i], best_d[i] = j, t_i[0, j], d_i[0, j]
+
+        # Quy đổi sang vị trí tương đối trên cả cạnh + tọa độ node ảo
+        edges = s['edge'][best_seg]
+        along = s['start'][best_seg] + best_t * s['len'][best_seg]
+        edge_len = s['edge_len'][edges]
+        frac = np.where(edge_len > 0, along / np.where(edge_len > 0, edge_len, 1.0), 0.0)
+        snap_x = s['ax'][best_seg] + best_t * (s['bx'][best_seg] - s['ax'][best_seg])
+        snap_y = s['ay'][best_seg] + best_t * (s['by'][best_seg] - s['ay'][best_seg])
+
+        return [
+            EdgeSnap(int(e), self.graph.find_twin(int(e)), float(f), float(y / self.ky), float(x / self.kx), float(d))
+            for e, f, x, y, d in zip(edges, frac, snap_x, snap_y, best_d)
+        ]
+
+
+class Corridor:
+    """
+    Hành lang tìm đường: một "view" KHÔNG copy trên CompactGraph.
+    Chỉ giữ mảng chỉ số node/cạnh nằm trong BBox (giống subgraph của networkx:
+    cạnh thuộc hành lang khi cả 2 đầu mút đều nằm trong hộp).
+    """
+    def __init__(self, graph, bbox, nodes, node_mask, edges):
+        self.graph = graph
+        self.bbox = bbox              # (south, west, north, east)
+        self.nodes = nodes            # int32: id node trong hộp (tăng dần)
+        self.node_mask = node_mask    # bool (n): node có nằm trong hộp không
+        self.edges = edges            # int64: id cạnh trong hộp (tăng dần)
+
+    @property
+    def num_edges(self):
+        return len(self.edges)
+
+    @property
+    def is_full(self):
+        """Hành lang đã phủ toàn bộ bản đồ (không nới rộng thêm được nữa)."""
+        return len(self.nodes) == self.graph.num_nodes
+
+    def contains(self, node):
+        return bool(self.node_mask[node])
+
+
+class GridIndex:
+    """
+    Lưới đều (uniform grid) trên tọa độ node, lưu dạng CSR theo ô:
+    node của ô c nằm trong cell_nodes[cell_offsets[c]:cell_offsets[c+1]].
+    Ô được đánh số theo hàng (row-major) nên 1 hàng ô liên tiếp = 1 lát cắt liên tục.
+    """
+    def __init__(self, graph, cell_deg=GRID_CELL_DEG):
+        self.graph = graph
+        self.cell = cell_deg
+        self.x0 = float(graph.x.min()) if graph.num_nodes else 0.0
+        self.y0 = float(graph.y.min()) if graph.num_nodes else 0.0
+        self.nx = int((graph.x.max() - self.x0) / cell_deg) + 1 if graph.num_nodes else 1
+        self.ny = int((graph.y.max() - self.y0) / cell_deg) + 1 if graph.num_nodes else 1
+
+        cx = ((graph.x - self.x0) / cell_deg).astype(np.int64)
+        cy = ((graph.y - self.y0) / cell_deg).astype(np.int64)
+        cells = cy * self.nx + cx
+        self.cell_nodes = np.argsort(cells, kind='stable').astype(np.int32)
+        self._full = None
+        self.cell_offsets = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.nx * self.ny), out=self.cell_offsets[1:])
+
+    def nodes_in_bbox(self, bbox):
+        """Id các node nằm TRONG hộp (so sánh chặt, giống vòng lặp cũ của _prepare_graph)."""
+        south, west, north, east = bbox
+        g = self.graph
+        cx0 = max(0, int(math.floor((west - self.x0) / self.cell)))
+        cx1 = min(self.nx - 1, int(math.floor((east - self.x0) / self.cell)))
+        cy0 = max(0, int(math.floor((south - self.y0) / self.cell)))
+        cy1 = min(self.ny - 1, int(math.floor((north - self.y0) / self.cell)))
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int32)
+
+        cand = np.concatenate([
+            self.cell_nodes[self.cell_offsets[cy * self.nx + cx0]:self.cell_offsets[cy * self.nx + cx1 + 1]]
+            for cy in range(cy0, cy1 + 1)
+        ])
+        x, y = g.x[cand], g.y[cand]
+        inside = (south < y) & (y < north) & (west < x) & (x < east)
+        return np.sort(cand[inside])
+
+    def full_corridor(self):
+        """Hành lang phủ TOÀN BỘ bản đồ (cache lại, chỉ đọc) - cho CCH không cần cắt BBox."""
+        if self._full is None:
+            g = self.graph
+            bbox = (float(g.y.min()), float(g.x.min()), float(g.y.max()), float(g.x.max())) if g.num_nodes else (0.0,) * 4
+            self._full = Corridor(g, bbox, np.arange(g.num_nodes, dtype=np.int32),
+                                  np.ones(g.num_nodes, dtype=bool), np.arange(g.num_edges, dtype=np.int64))
+        return self._full
+
+    def corridor(self, bbox):
+        """Cắt hành lang theo BBox. Chi phí tỉ lệ với kích thước hành lang, không phải cả thành phố."""
+        g = self.graph
+        nodes = self.nodes_in_bbox(bbox)
+        node_mask = np.zeros(g.num_nodes, dtype=bool)
+        node_mask[nodes] = True
+
+        # Gom toàn bộ cạnh đi ra từ các node trong hộp (theo CSR), giữ cạnh có đích cũng trong hộp
+        starts = g.offsets[nodes]
+        counts = g.offsets[nodes + 1] - starts
+        edges = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        edges = edges[node_mask[g.targets[edges]]]
+        return Corridor(g, bbox, nodes, node_mask, edges)
+
+
+def build_snap_index(graph):
+    """Hàm Factory - gọi 1 lần khi load bản đồ (traffic._register_graph)."""
+    return SnapIndex(graph)
+
+
+def build_grid_index(graph):
+    """Hàm Factory - gọi 1 lần khi load bản đồ (traffic._register_graph)."""
+    return GridIndex(graph)
+
+
+if __name__ == '__main__':
+    # Đo tốc độ bám điểm: python spatial_index.py <file.graphml>
+    import sys
+    import time
+    import osmnx as ox
+    import graph_engine
+
+    G = ox.load_graphml(sys.argv[1] if len(sys.argv) > 1 else 'vietnam_d1_map.graphml')
+    cg = graph_engine.build_compact_graph(G)
+    t0 = time.time()
+    index = build_snap_index(cg)
+    print(f"🌲 Dựng KD-tree node: {(time.time() - t0) * 1000:.1f} ms")
+
+    n = 10000
+    lats = np.random.uniform(cg.y.min(), cg.y.max(), n)
+    lons = np.random.uniform(cg.x.min(), cg.x.max(), n)
+
+    t0 = time.time()
+    idx, _ = index.snap_nodes(lats, lons)
+    print(f"📍 Bám node: {(time.time() - t0) / n * 1e6:.2f} µs/điểm")
+
+    ref = ox.distance.nearest_nodes(G, lons[:200], lats[:200])
+    same = sum(int(a) == int(b) for a, b in zip(cg.osmids[idx[:200]], ref))
+    print(f"   Khớp osmnx: {same}/200")
+    # Node khác osmnx chỉ được phép khi gần ngang nhau (phép chiếu phẳng cục bộ lệch < 1%)
+    pos = {int(o): i for i, o in enumerate(cg.osmids)}
+    ref_idx = np.array([pos[int(r)] for r in ref])
+    d_ours = ox.distance.great_circle(lats[:200], lons[:200], cg.y[idx[:200]], cg.x[idx[:200]])
+    d_ref = ox.distance.great_circle(lats[:200], lons[:200], cg.y[ref_idx], cg.x[ref_idx])
+    ok = bool(np.all(d_ours <= d_ref * 1.01 + 1.0))
+    print(f"   Không xa hơn node của osmnx: {ok}")
+
+    index.snap_edges(lats[:1], lons[:1])
+    t0 = time.time()
+    index.snap_edges(lats, lons)
+    print(f"🛣️ Bám cạnh: {(time.time() - t0) / n * 1e6:.2f} µs/điểm")
+
+    grid = build_grid_index(cg)
+    lat0, lon0 = float(np.median(cg.y)), float(np.median(cg.x))
+    bbox = (lat0 - 0.01, lon0 - 0.01, lat0 + 0.01, lon0 + 0.01)
+    t0 = time.time()
+    corridor = grid.corridor(bbox)
+    print(f"✂️ Hành lang: {len(corridor.nodes)} node, {corridor.num_edges} cạnh ({(time.time() - t0) * 1000:.2f} ms)")
+    # Đối chiếu với lọc vét cạn: node nằm chặt trong hộp, cạnh có cả 2 đầu mút trong hộp
+    inside = (bbox[0] < cg.y) & (cg.y < bbox[2]) & (bbox[1] < cg.x) & (cg.x < bbox[3])
+    ok = ok and np.array_equal(corridor.nodes, np.flatnonzero(inside))
+    ok = ok and np.array_equal(corridor.edges, np.flatnonzero(inside[cg.sources] & inside[cg.targets]))
+    print(f"   Khớp lọc vét cạn: {ok}")
+    if not ok:
+        sys.exit(1)
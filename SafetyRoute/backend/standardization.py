@@ -1,10 +1,10 @@
 import math
 import os
 import numpy as np
-import pickle
 import json
 from utils import haversine
 from utils import get_min_distance_to_segment
+import forest_model
 
 import warnings # <--- Thêm thư viện này
 
@@ -16,8 +16,8 @@ MODEL_PATH = os.path.join(os.path.dirname(__file__), 'traffic_model.pkl')
 traffic_model = None
 
 try:
-    with open(MODEL_PATH, 'rb') as f:
-        traffic_model = pickle.load(f)
+    # Ưu tiên bản phẳng traffic_model.npz (không cần sklearn), thiếu thì unpickle như cũ
+    traffic_model = forest_model.load_model(MODEL_PATH)
     print("🤖 Đã load thành công AI Model dự báo kẹt xe!")
 except Exception as e:
     print(f"⚠️ Không tìm thấy file model AI ({e}). Sẽ dùng logic If-Else cũ.")
@@ -68,6 +68,19 @@ def standardize_disaster_score(raw_categories):
             
     return max_score
 
+def _edge_points(edge_data, u_node, v_node):
+    """
+    Lấy danh sách các điểm tọa độ (Lon, Lat) tạo nên con đường.
+    """
+    if 'geometry' in edge_data:
+        # Nếu là đường cong, OSMnx lưu nó dưới dạng LineString
+        # Ta trích xuất các điểm tọa độ dọc theo đường cong
+        # line_coords = [(lon, lat), (lon, lat)...]
+        # Lưu ý: Shapely/OSMnx thường lưu (Lon, Lat) -> Cần chú ý thứ tự
+        return list(edge_data['geometry'].coords)
+    # Nếu là đường thẳng, chỉ có điểm đầu và cuối
+    return [(u_node['x'], u_node['y']), (v_node['x'], v_node['y'])]
+
 def calculate_disaster_impact_advanced(edge_data, u_node, v_node, disaster_list):
     """
     Input: 
@@ -76,21 +89,15 @@ def calculate_disaster_impact_advanced(edge_data, u_node, v_node, disaster_list)
         - disaster_list: Danh sách thiên tai
     Output: Điểm rủi ro (0.0 - 1.0)
     """
-    max_impact = 0.0
-    
     # 1. Lấy danh sách các điểm tọa độ tạo nên con đường
-    points = []
-    
-    if 'geometry' in edge_data:
-        # Nếu là đường cong, OSMnx lưu nó dưới dạng LineString
-        # Ta trích xuất các điểm tọa độ dọc theo đường cong
-        # line_coords = [(lon, lat), (lon, lat)...]
-        line_geom = edge_data['geometry']
-        points = list(line_geom.coords) 
-        # Lưu ý: Shapely/OSMnx thường lưu (Lon, Lat) -> Cần chú ý thứ tự
-    else:
-        # Nếu là đường thẳng, chỉ có điểm đầu và cuối
-        points = [(u_node['x'], u_node['y']), (v_node['x'], v_node['y'])]
+    return disaster_impact_from_points(_edge_points(edge_data, u_node, v_node), disaster_list)
+
+def disaster_impact_from_points(points, disaster_list):
+    """
+    Giống calculate_disaster_impact_advanced nhưng nhận thẳng danh sách điểm (Lon, Lat)
+    của con đường (VD: CompactGraph.edge_points khi không có dict cạnh của osmnx).
+    """
+    max_impact = 0.0
 
     # 2. Duyệt qua từng vùng thiên tai
     for d in disaster_list:
@@ -125,6 +132,99 @@ def calculate_disaster_impact_advanced(edge_data, u_node, v_node, disaster_list)
                 
     return max_impact
 
+# --- KERNEL VECTOR HÓA (numpy) CHO THIÊN TAI / THỜI TIẾT ---
+# Thay vì lặp Python: từng cạnh x từng thiên tai x từng đoạn thẳng, ta trải phẳng các cặp
+# (đoạn thẳng, vùng nguy hiểm) thành mảng rồi tính khoảng cách 1 lượt.
+# Kết quả GIỐNG HỆT các hàm scalar ở trên (cùng công thức, cùng thứ tự phép tính).
+
+# Số phần tử (cặp đoạn - vùng) tối đa xử lý trong 1 lượt numpy (giới hạn RAM)
+HAZARD_KERNEL_CHUNK = 1_000_000
+
+def segment_distance_km(p_lat, p_lng, a_lat, a_lon, b_lat, b_lon):
+    """
+    Bản numpy của utils.get_min_distance_to_segment: khoảng cách (km) từ P tới đoạn AB.
+    Nhận mảng cùng kích thước (hoặc broadcast được).
+    """
+    deg_to_rad = math.pi / 180
+    avg_lat = (a_lat + b_lat) / 2 * deg_to_rad
+    kx = 111.32 * np.cos(avg_lat)
+    ky = 110.57
+
+    px = (p_lng - a_lon) * kx
+    py = (p_lat - a_lat) * ky
+    bx = (b_lon - a_lon) * kx
+    by = (b_lat - a_lat) * ky
+
+    len_sq = bx*bx + by*by
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(len_sq == 0, 0.0, (px*bx + py*by) / len_sq)
+    t = np.clip(t, 0, 1)
+
+    dx = px - t * bx
+    dy = py - t * by
+    return np.sqrt(dx*dx + dy*dy)
+
+def disaster_hazard_arrays(disaster_list):
+    """Danh sách thiên tai -> mảng (lat, lng, radius, severity) cho kernel."""
+    lat = np.array([d['lat'] for d in disaster_list], dtype=np.float64)
+    lng = np.array([d['lng'] for d in disaster_list], dtype=np.float64)
+    radius = np.array([d.get('radius', 5.0) for d in disaster_list], dtype=np.float64)
+    severity = np.array([standardize_disaster_score(d.get('categories_raw', [])) for d in disaster_list], dtype=np.float64)
+    return lat, lng, radius, severity
+
+def weather_hazard_arrays(weather_zones):
+    """Danh sách vùng thời tiết -> mảng (lat, lng, radius, severity) cho kernel."""
+    lat = np.array([z['lat'] for z in weather_zones], dtype=np.float64)
+    lng = np.array([z['lng'] for z in weather_zones], dtype=np.float64)
+    radius = np.array([z.get('radius', 5.0) for z in weather_zones], dtype=np.float64)
+    severity = np.array([get_weather_base_score(z['condition'], z['wind_speed']) for z in weather_zones], dtype=np.float64)
+    return lat, lng, radius, severity
+
+def hazard_edge_scores(graph, edges, lat, lng, radius, severity, candidates=None):
+    """
+    Điểm rủi ro của từng cạnh = max severity của các vùng mà đường cong của cạnh cắt qua
+    (khoảng cách nhỏ nhất từ tâm vùng tới polyline <= bán kính).
+    Input:
+        - graph: CompactGraph (dùng graph.segments() đã trải phẳng lúc load)
+        - edges: mảng edge id (E)
+        - lat, lng, radius, severity: mảng của H vùng nguy hiểm
+        - candidates: (pair_e, pair_h) - các cặp (vị trí cạnh, vùng) cần kiểm tra
+          (từ HazardGridIndex.bulk_intersection). None = kiểm tra tất cả.
+    Output: mảng float (E)
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    scores = np.zeros(len(edges))
+    if len(edges) == 0 or len(severity) == 0:
+        return scores
+
+    # Vùng có severity = 0 không bao giờ làm tăng điểm -> bỏ qua (giống 'continue' bản scalar)
+    if candidates is None:
+        candidates = np.nonzero(np.ones((len(edges), len(severity)), dtype=bool))
+    pair_e, pair_h = candidates
+    keep = severity[pair_h] > 0
+    pair_e, pair_h = pair_e[keep], pair_h[keep]
+    if len(pair_e) == 0:
+        return scores
+
+    seg = graph.segments()
+    starts = seg.first[edges[pair_e]]
+    counts = seg.first[edges[pair_e] + 1] - starts
+    cum = np.cumsum(counts)
+
+    # Chia cặp thành từng lô để mảng tạm không vượt HAZARD_KERNEL_CHUNK phần tử
+    bounds = np.searchsorted(cum, np.arange(HAZARD_KERNEL_CHUNK, cum[-1], HAZARD_KERNEL_CHUNK), side='right')
+    for lo, hi in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(pair_e)]))):
+        if lo >= hi: continue
+        c = counts[lo:hi]
+        seg_ids = np.repeat(starts[lo:hi] - (np.cumsum(c) - c), c) + np.arange(c.sum())
+        owner = np.repeat(pair_e[lo:hi], c)
+        hz = np.repeat(pair_h[lo:hi], c)
+
+        dist = segment_distance_km(lat[hz], lng[hz], seg.a_lat[seg_ids], seg.a_lon[seg_ids], seg.b_lat[seg_ids], seg.b_lon[seg_ids])
+        hit = dist <= radius[hz]
+        np.maximum.at(scores, owner[hit], severity[hz[hit]])
+    return scores
+
 def get_weather_base_score(weather_main: str, wind_speed: float) -> float:
     """
     Tính điểm rủi ro cho MỘT điểm cụ thể dựa trên Trời và Gió.
@@ -180,18 +280,15 @@ def calculate_weather_impact_geometry(edge_data, u_node, v_node, weather_zones):
     Output: 
         - float: Điểm rủi ro thời tiết (0.0 - 1.0) cho cạnh này.
     """
-    from utils import get_min_distance_to_segment
-    
-    max_impact = 0.0
-    
     # 1. Lấy các điểm tạo nên con đường (Xử lý đường cong)
-    points = []
-    if 'geometry' in edge_data:
-        points = list(edge_data['geometry'].coords) 
-        # Lưu ý: geometry thường là (Lon, Lat). Cần check lại thư viện OSMnx đang dùng.
-        # Thông thường OSMnx trả về (x=Lon, y=Lat).
-    else:
-        points = [(u_node['x'], u_node['y']), (v_node['x'], v_node['y'])]
+    # Lưu ý: geometry thường là (Lon, Lat). Thông thường OSMnx trả về (x=Lon, y=Lat).
+    return weather_impact_from_points(_edge_points(edge_data, u_node, v_node), weather_zones)
+
+def weather_impact_from_points(points, weather_zones):
+    """
+    Giống calculate_weather_impact_geometry nhưng nhận thẳng danh sách điểm (Lon, Lat).
+    """
+    max_impact = 0.0
 
     # 2. Duyệt qua từng vùng thời tiết
     for zone in weather_zones:
@@ -243,37 +340,118 @@ except Exception as e:
     # Nếu lỗi thì dùng danh sách rỗng để code không bị crash
     CROWD_ZONES = []
 
-def calculate_crowd_score(lat, lon, current_hour):
-    
+# Hệ số gộp (ô x, ô y) của các lưới chỉ mục thành 1 khóa int64
+_CELL_KEY_STRIDE = 1 << 21
+
+# --- CHỈ MỤC ĐIỂM NÓNG ĐÁM ĐÔNG ---
+# Lưới đều, ô >= bán kính lớn nhất -> điểm nóng phủ 1 vị trí chắc chắn nằm trong 3x3 ô quanh nó.
+CROWD_CELL_MARGIN = 1.01
+# Sai khác |khoảng cách - bán kính| nhỏ hơn mức này thì tính lại bằng utils.haversine (khớp tuyệt đối)
+CROWD_EDGE_TOLERANCE_KM = 1e-6
+
+# Ma trận cạnh x khung giờ: 15 phút / khung -> 96 khung / ngày
+CROWD_SLOTS_PER_HOUR = 4
+CROWD_SLOTS = 24 * CROWD_SLOTS_PER_HOUR
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Bản numpy của utils.haversine (km)."""
+    R = 6371.0
+    dLat = np.radians(lat2 - lat1)
+    dLon = np.radians(lon2 - lon1)
+    a = np.sin(dLat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dLon / 2) ** 2
+    return R * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+class CrowdGridIndex:
     """
-    Tính điểm đám đông dựa trên:
-    1. Khoảng cách tới điểm nóng.
-    2. Khung giờ hoạt động (Time Factor).
-    3. Độ nổi tiếng của địa điểm (Weight Factor).
+    Tìm điểm nóng phủ một vị trí, GIỐNG HỆT vòng lặp cũ của calculate_crowd_score
+    (điểm nóng ĐẦU TIÊN theo thứ tự trong CROWD_ZONES có haversine <= bán kính),
+    nhưng chỉ xét các điểm nóng trong 3x3 ô lưới xung quanh thay vì quét cả ~400 điểm.
+    """
+    def __init__(self, zones):
+        self.zones = zones
+        self.lat = np.array([z['lat'] for z in zones], dtype=np.float64)
+        self.lng = np.array([z['lng'] for z in zones], dtype=np.float64)
+        self.radius = np.array([z.get('radius', 0.3) for z in zones], dtype=np.float64)
+
+        # Ô lưới (độ) >= bán kính lớn nhất tính theo chiều kinh độ (hẹp nhất ở vĩ độ cao nhất)
+        max_r = float(self.radius.max()) if len(zones) else 0.3
+        max_lat = float(np.abs(self.lat).max()) + 1.0 if len(zones) else 0.0
+        self.cell_deg = CROWD_CELL_MARGIN * max_r / (6371.0 * math.pi / 180 * math.cos(math.radians(min(max_lat, 89.0))))
+
+        keys = self._key(self._cell(self.lng), self._cell(self.lat))
+        order = np.argsort(keys, kind='stable')       # stable -> trong 1 ô giữ thứ tự CROWD_ZONES
+        self.cell_keys = keys[order]
+        self.cell_items = order
+        self.cells = {}
+        for k, i in zip(self.cell_keys.tolist(), self.cell_items.tolist()):
+            self.cells.setdefault(k, []).append(i)
+
+    def _cell(self, deg):
+        return np.floor(np.asarray(deg, dtype=np.float64) / self.cell_deg).astype(np.int64)
+
+    @staticmethod
+    def _key(cx, cy):
+        return cx * _CELL_KEY_STRIDE + cy
+
+    def first_hotspot(self, lat, lon):
+        """Index điểm nóng phủ (lat, lon), hoặc None."""
+        cx, cy = int(self._cell(lon)), int(self._cell(lat))
+        candidates = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                candidates.extend(self.cells.get(self._key(cx + dx, cy + dy), []))
+        for i in sorted(candidates):
+            spot = self.zones[i]
+            if haversine(lat, lon, spot['lat'], spot['lng']) <= spot.get('radius', 0.3):
+                return i
+        return None
+
+    def first_hotspots(self, lats, lons):
+        """
+        Bản vector hóa của first_hotspot cho nhiều điểm.
+        Output: mảng int64 index điểm nóng (-1 = không có).
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        result = np.full(len(lats), -1, dtype=np.int64)
+        if len(self.zones) == 0 or len(lats) == 0:
+            return result
+
+        cx, cy = self._cell(lons), self._cell(lats)
+        pts, items = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = self._key(cx + dx, cy + dy)
+                lo = np.searchsorted(self.cell_keys, keys, side='left')
+                n = np.searchsorted(self.cell_keys, keys, side='right') - lo
+                pts.append(np.repeat(np.arange(len(lats)), n))
+                items.append(self.cell_items[np.repeat(lo - (np.cumsum(n) - n), n) + np.arange(n.sum())])
+        pts, items = np.concatenate(pts), np.concatenate(items)
+
+        dist = haversine_np(lats[pts], lons[pts], self.lat[items], self.lng[items])
+        hit = dist <= self.radius[items]
+        # Sát mép bán kính: tính lại bằng utils.haversine để khớp tuyệt đối bản scalar
+        for j in np.flatnonzero(np.abs(dist - self.radius[items]) < CROWD_EDGE_TOLERANCE_KM).tolist():
+            p, i = int(pts[j]), int(items[j])
+            hit[j] = haversine(float(lats[p]), float(lons[p]), float(self.lat[i]), float(self.lng[i])) <= self.radius[i]
+
+        # Điểm nóng đầu tiên theo thứ tự danh sách = index nhỏ nhất
+        order = np.lexsort((items[hit], pts[hit]))
+        p_hit, i_hit = pts[hit][order], items[hit][order]
+        first = np.ones(len(p_hit), dtype=bool)
+        first[1:] = p_hit[1:] != p_hit[:-1]
+        result[p_hit[first]] = i_hit[first]
+        return result
+
+CROWD_INDEX = CrowdGridIndex(CROWD_ZONES)
+
+def crowd_time_factor(h_type, current_hour):
+    """
+    Time Factor (Theo giờ & Loại hình).
+    Logic này xác định: "Giờ này chỗ đó CÓ HOẠT ĐỘNG KHÔNG?"
     """
-    nearby_hotspot = None
-    
-    # 1. Tìm điểm nóng gần nhất
-    for spot in CROWD_ZONES:
-        # Lấy bán kính riêng của từng điểm (mặc định 0.3km)
-        radius = spot.get('radius', 0.3)
-        dist = haversine(lat, lon, spot['lat'], spot['lng'])
-        
-        if dist <= radius:
-            nearby_hotspot = spot
-            break 
-            
-    if not nearby_hotspot: return 0.0 
-    
-    # 2. Lấy thông tin cơ bản
-    h_type = nearby_hotspot.get('type', 'unknown')
-    hotspot_weight = nearby_hotspot.get('weight', 0.5) # Mặc định 0.5 nếu không ghi weight
-    
     time_factor = 0.1 # Mặc định vắng
     
-    # 3. Tính Time Factor (Theo giờ & Loại hình)
-    # Logic này xác định: "Giờ này chỗ đó CÓ HOẠT ĐỘNG KHÔNG?"
-    
     if h_type == "nightlife": # Bar, Phố đi bộ
         if 18 <= current_hour <= 24: time_factor = 1.0   # Giờ vàng
         elif 17 <= current_hour < 18: time_factor = 0.5  # Mới mở
@@ -299,6 +477,17 @@ def calculate_crowd_score(lat, lon, current_hour):
             time_factor = 1.0 # Giờ cao điểm
         else: 
             time_factor = 0.4 # Luôn có người
+
+    return time_factor
+
+def hotspot_crowd_score(hotspot, current_hour):
+    """Điểm đám đông của 1 điểm nóng tại 1 thời điểm."""
+    # 2. Lấy thông tin cơ bản
+    h_type = hotspot.get('type', 'unknown')
+    hotspot_weight = hotspot.get('weight', 0.5) # Mặc định 0.5 nếu không ghi weight
+    
+    # 3. Tính Time Factor (Theo giờ & Loại hình)
+    time_factor = crowd_time_factor(h_type, current_hour)
             
     # 4. TÍNH ĐIỂM CUỐI CÙNG (QUAN TRỌNG NHẤT)
     # Score = Time (0.0-1.0) * Weight (Độ nổi tiếng 0.0-1.0)
@@ -307,21 +496,82 @@ def calculate_crowd_score(lat, lon, current_hour):
     
     return round(final_score, 2)
 
-def calculate_traffic_score(current_hour: float, is_weekend: bool, weather_score: float = 0.0) -> float:
+def calculate_crowd_score(lat, lon, current_hour):
+    
     """
-    Tính điểm kẹt xe (Bản Clean - Không Spam Console)
+    Tính điểm đám đông dựa trên:
+    1. Khoảng cách tới điểm nóng.
+    2. Khung giờ hoạt động (Time Factor).
+    3. Độ nổi tiếng của địa điểm (Weight Factor).
     """
-    
-    # 1. Ưu tiên dùng AI
-    if traffic_model:
-        try:
-            input_data = [[current_hour, int(is_weekend), weather_score]]
-            pred = traffic_model.predict(input_data)[0]
-            return float(max(0.0, min(1.0, pred)))
-        except:
-            pass # Nếu lỗi thì xuống fallback bên dưới
+    # 1. Tìm điểm nóng phủ vị trí này (qua lưới CROWD_INDEX)
+    i = CROWD_INDEX.first_hotspot(lat, lon)
+    if i is None: return 0.0 
 
-    # 2. Fallback (Logic cũ)
+    return hotspot_crowd_score(CROWD_ZONES[i], current_hour)
+
+class CrowdTensor:
+    """
+    Điểm đám đông dựng sẵn cho từng cạnh x từng khung 15 phút (dựng 1 lần lúc load bản đồ).
+    Chỉ lưu hàng cho các cạnh có điểm nóng (ma trận thưa theo hàng), giá trị là phần trăm (uint8)
+    -> k / 100 trùng khớp round(score, 2) của bản scalar.
+    Mỗi khung có 2 cột: ĐÚNG đầu khung (VD 11:00) và TRONG khung (11:01 -> 11:14), vì các mốc giờ
+    của crowd_time_factor đều là bội của 15 phút nhưng có mốc đóng (<= 11) lẫn mốc mở (< 16).
+    """
+    def __init__(self, edge_row, at_start, inside):
+        self.edge_row = edge_row    # int32 (m): hàng trong ma trận, -1 = cạnh không gần điểm nóng
+        self.at_start = at_start    # uint8 (k, 96)
+        self.inside = inside        # uint8 (k, 96)
+
+    def column(self, current_hour):
+        """Cột điểm (k,) ứng với giờ hiện tại."""
+        pos = current_hour * CROWD_SLOTS_PER_HOUR
+        slot = int(math.floor(pos))
+        table = self.at_start if pos == slot else self.inside
+        return table[:, slot % CROWD_SLOTS]
+
+    def scores(self, edges, current_hour):
+        """Điểm đám đông (float) của danh sách cạnh tại giờ hiện tại - 1 lần gather."""
+        rows = self.edge_row[edges]
+        col = self.column(current_hour)
+        return np.where(rows >= 0, col[np.maximum(rows, 0)] if len(col) else 0, 0) / 100.0
+
+def build_crowd_tensor(graph, zones=None, index=None):
+    """
+    Gán điểm nóng cho trung điểm (u, v) của mọi cạnh rồi dựng CrowdTensor.
+    """
+    zones = CROWD_ZONES if zones is None else zones
+    index = index or (CROWD_INDEX if zones is CROWD_ZONES else CrowdGridIndex(zones))
+
+    mid_lat = (graph.y[graph.sources] + graph.y[graph.targets]) / 2
+    mid_lon = (graph.x[graph.sources] + graph.x[graph.targets]) / 2
+    hotspot = index.first_hotspots(mid_lat, mid_lon)
+
+    # Bảng điểm nóng x khung giờ (tính bằng đúng hàm scalar)
+    starts = [s / CROWD_SLOTS_PER_HOUR for s in range(CROWD_SLOTS)]
+    insides = [(s + 0.5) / CROWD_SLOTS_PER_HOUR for s in range(CROWD_SLOTS)]
+    hot_start = np.array([[round(hotspot_crowd_score(z, h) * 100) for h in starts] for z in zones], dtype=np.uint8).reshape(-1, CROWD_SLOTS)
+    hot_inside = np.array([[round(hotspot_crowd_score(z, h) * 100) for h in insides] for z in zones], dtype=np.uint8).reshape(-1, CROWD_SLOTS)
+
+    covered = np.flatnonzero(hotspot >= 0)
+    edge_row = np.full(graph.num_edges, -1, dtype=np.int32)
+    edge_row[covered] = np.arange(len(covered), dtype=np.int32)
+    return CrowdTensor(edge_row, hot_start[hotspot[covered]], hot_inside[hotspot[covered]])
+
+# --- CACHE ĐIỂM KẸT XE ---
+# Trong 1 request, giờ & cuối tuần là hằng số, điểm thời tiết chỉ có vài giá trị khác nhau
+# -> cache theo khóa (giờ lượng tử, cuối tuần, thời tiết lượng tử) thay vì predict từng cạnh.
+TRAFFIC_HOUR_STEP = 1 / 60        # Lượng tử giờ: 1 phút (curr_hour vốn đã tính theo phút)
+TRAFFIC_WEATHER_STEP = 0.01       # Lượng tử điểm thời tiết
+TRAFFIC_CACHE_MAX = 10000         # Quá số khóa này thì xóa cache làm lại (tránh phình RAM)
+TRAFFIC_SCORE_CACHE = {}
+
+def _traffic_key(current_hour, is_weekend, weather_score):
+    return (int(round(current_hour / TRAFFIC_HOUR_STEP)), bool(is_weekend),
+            int(round(weather_score / TRAFFIC_WEATHER_STEP)))
+
+def _traffic_fallback(current_hour, is_weekend):
+    """Fallback (Logic cũ) khi không có AI model."""
     score = 0.1 
     if not is_weekend: 
         if 6.5 <= current_hour < 9.0: score = 0.8    
@@ -336,6 +586,60 @@ def calculate_traffic_score(current_hour: float, is_weekend: bool, weather_score
         
     return score
 
+def _predict_traffic_keys(keys):
+    """
+    Tính điểm kẹt xe cho danh sách khóa CHƯA có trong cache bằng 1 lần predict duy nhất,
+    rồi ghi vào TRAFFIC_SCORE_CACHE.
+    """
+    hours = [k[0] * TRAFFIC_HOUR_STEP for k in keys]
+    scores = None
+
+    # 1. Ưu tiên dùng AI
+    if traffic_model:
+        try:
+            input_data = [[h, int(k[1]), k[2] * TRAFFIC_WEATHER_STEP] for h, k in zip(hours, keys)]
+            scores = [float(max(0.0, min(1.0, p))) for p in traffic_model.predict(input_data)]
+        except:
+            pass # Nếu lỗi thì xuống fallback bên dưới
+
+    # 2. Fallback (Logic cũ)
+    if scores is None:
+        scores = [_traffic_fallback(h, k[1]) for h, k in zip(hours, keys)]
+
+    if len(TRAFFIC_SCORE_CACHE) + len(keys) > TRAFFIC_CACHE_MAX:
+        TRAFFIC_SCORE_CACHE.clear()
+    TRAFFIC_SCORE_CACHE.update(zip(keys, scores))
+    return scores
+
+def calculate_traffic_score(current_hour: float, is_weekend: bool, weather_score: float = 0.0) -> float:
+    """
+    Tính điểm kẹt xe (Bản Clean - Không Spam Console)
+    Có cache: cùng (giờ, cuối tuần, thời tiết) chỉ predict 1 lần.
+    """
+    key = _traffic_key(current_hour, is_weekend, weather_score)
+    score = TRAFFIC_SCORE_CACHE.get(key)
+    if score is None:
+        score = _predict_traffic_keys([key])[0]
+    return score
+
+def calculate_traffic_scores(current_hour, is_weekend, weather_scores):
+    """
+    Bản batch của calculate_traffic_score cho cả mảng điểm thời tiết (mọi cạnh của 1 request).
+    Mỗi khóa khác nhau chỉ predict 1 lần (gộp chung 1 lời gọi model).
+    Output: mảng float cùng độ dài weather_scores.
+    """
+    weather_q = np.round(np.asarray(weather_scores, dtype=np.float64) / TRAFFIC_WEATHER_STEP).astype(np.int64)
+    uniq, inverse = np.unique(weather_q, return_inverse=True)
+    hour_q = int(round(current_hour / TRAFFIC_HOUR_STEP))
+    keys = [(hour_q, bool(is_weekend), int(w)) for w in uniq.tolist()]
+
+    # Đọc cache đúng 1 lần mỗi khóa: thread khác có thể clear() cache giữa lúc kiểm tra và lúc đọc
+    cached = [TRAFFIC_SCORE_CACHE.get(k) for k in keys]
+    missing = [k for k, v in zip(keys, cached) if v is None]
+    fresh = dict(zip(missing, _predict_traffic_keys(missing))) if missing else {}
+    values = np.array([fresh[k] if v is None else v for k, v in zip(keys, cached)], dtype=np.float64)
+    return values[inverse].reshape(-1)
+
 def calculate_segment_speed(edge_data, current_hour, is_weekend, weather_score, vehicle_mode="motorbike"):
     """
     Tính tốc độ di chuyển thực tế (km/h).
@@ -361,11 +665,7 @@ def calculate_segment_speed(edge_data, current_hour, is_weekend, weather_score,
     # Heuristic loại đường
     highway_type = edge_data.get('highway', 'residential')
     if isinstance(highway_type, list): highway_type = highway_type[0]
-    
-    if max_speed == 30.0:
-        if highway_type in ['trunk', 'primary', 'secondary']: max_speed = 50.0
-        elif highway_type in ['tertiary']: max_speed = 40.0
-        else: max_speed = 30.0 
+    max_speed = _highway_base_speed(max_speed, highway_type)
 
     # 3. Tính hệ số giảm tốc (Traffic Factor)
     tf_score = calculate_traffic_score(current_hour, is_weekend, weather_score)
@@ -380,16 +680,122 @@ def calculate_segment_speed(edge_data, current_hour, is_weekend, weather_score,
     
     return max(5.0, real_speed_kmh)
 
+def _highway_base_speed(max_speed, highway_type):
+    """Heuristic loại đường: maxspeed mặc định (30) -> đoán theo cấp đường."""
+    if max_speed == 30.0:
+        if highway_type in ['trunk', 'primary', 'secondary']: max_speed = 50.0
+        elif highway_type in ['tertiary']: max_speed = 40.0
+        else: max_speed = 30.0 
+    return max_speed
+
+def base_speed_array(graph):
+    """
+    Tốc độ cơ bản TĨNH (km/h) của mọi cạnh: maxspeed đã parse + heuristic loại đường.
+    Không phụ thuộc giờ/thời tiết -> dựng 1 lần lúc load bản đồ (traffic.py).
+    """
+    by_code = np.array([_highway_base_speed(30.0, hw) for hw in graph.highway_names], dtype=np.float64)
+    maxspeed = np.asarray(graph.maxspeed, dtype=np.float64)
+    return np.where(maxspeed == 30.0, by_code[graph.highway], maxspeed)
+
+def calculate_segment_speeds(base_speeds, current_hour, is_weekend, weather_scores, vehicle_mode="motorbike"):
+    """
+    Bản vector hóa của calculate_segment_speed cho nhiều cạnh.
+    Input: base_speeds (từ base_speed_array), weather_scores cùng độ dài.
+    Output: mảng tốc độ thực tế (km/h).
+    """
+    base_speeds = np.asarray(base_speeds, dtype=np.float64)
+    if vehicle_mode == "walking":
+        return np.full(len(base_speeds), 5.0)
+
+    tf_scores = calculate_traffic_scores(current_hour, is_weekend, weather_scores)
+    traffic_impact = 0.8 if vehicle_mode == "car" else 0.6
+    efficiency = 1.0 - (tf_scores * traffic_impact)
+    return np.maximum(5.0, base_speeds * efficiency)
+
 # --- BỔ SUNG CUỐI FILE standardization.py ---
 
-class SimpleSpatialIndex:
+# Kích thước ô lưới của chỉ mục thiên tai/thời tiết (độ, ~5.5 km)
+HAZARD_GRID_DEG = 0.05
+
+def hazard_bounds(items):
     """
-    Một lớp giả lập Spatial Index (R-tree) đơn giản.
-    Giúp tìm nhanh các vật thể nằm trong một vùng hình chữ nhật (BBox).
-    Dùng cái này để không phải cài thư viện 'rtree' (thường khó cài trên Windows).
+    BBox (min_lng, min_lat, max_lng, max_lat) của từng vùng nguy hiểm theo BÁN KÍNH THẬT.
+    Bề ngang (kinh độ) tính với cos của vĩ độ xa xích đạo nhất mà vùng có thể chạm tới (+1 độ dự phòng)
+    -> không bao giờ hẹp hơn đĩa bán kính r của get_min_distance_to_segment.
     """
-    def __init__(self, items):
+    lat = np.array([it['lat'] for it in items], dtype=np.float64)
+    lng = np.array([it['lng'] for it in items], dtype=np.float64)
+    radius = np.array([it.get('radius', 5.0) for it in items], dtype=np.float64)
+    d_lat = radius / 110.57
+    cos_lat = np.cos(np.radians(np.minimum(np.abs(lat) + d_lat + 1.0, 89.0)))
+    d_lng = radius / (111.32 * cos_lat)
+    return np.column_stack((lng - d_lng, lat - d_lat, lng + d_lng, lat + d_lat)).reshape(-1, 4)
+
+class HazardGridIndex:
+    """
+    Spatial Index dạng LƯỚI ĐỀU cho thiên tai / vùng thời tiết (thay SimpleSpatialIndex quét tuyến tính).
+    Mỗi vùng được đăng ký vào mọi ô mà BBox bán kính của nó phủ lên
+    -> bão bán kính 20 km không còn bị cắt cụt bởi buffer cố định 5 km như trước.
+    Không cần cài thư viện 'rtree' (thường khó cài trên Windows), chỉ dùng numpy.
+    """
+    def __init__(self, items, cell_deg=HAZARD_GRID_DEG):
         self.items = items
+        self.cell_deg = cell_deg
+        self.bounds = hazard_bounds(items) if items else np.zeros((0, 4))
+        # Khung bao toàn bộ các vùng: bbox truy vấn được cắt về khung này (hộp rất lớn không phải duyệt hàng triệu ô)
+        self.extent = (np.concatenate((self.bounds[:, :2].min(axis=0), self.bounds[:, 2:].max(axis=0)))
+                       if items else np.zeros(4))
+
+        # Bảng (ô -> vùng) dạng 2 mảng đã sắp theo khóa ô, tra bằng searchsorted
+        owner, cx, cy = self._cover(self.bounds)
+        keys = cx * _CELL_KEY_STRIDE + cy
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys = keys[order]
+        self.cell_items = owner[order]
+
+    def _cover(self, bboxes):
+        """Liệt kê mọi ô lưới mà từng bbox phủ lên. Output: (chỉ số bbox, ô x, ô y)."""
+        ix0, iy0 = self._cell(bboxes[:, 0]), self._cell(bboxes[:, 1])
+        nx = np.maximum(self._cell(bboxes[:, 2]) - ix0 + 1, 0)   # bbox rỗng (min > max) -> 0 ô
+        ny = np.maximum(self._cell(bboxes[:, 3]) - iy0 + 1, 0)
+        counts = nx * ny
+        owner = np.repeat(np.arange(len(bboxes), dtype=np.int64), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = ix0[owner] + local // ny[owner]
+        cy = iy0[owner] + local % ny[owner]
+        return owner, cx, cy
+
+    def _cell(self, deg):
+        return np.floor(deg / self.cell_deg).astype(np.int64)
+
+    def bulk_intersection(self, bboxes):
+        """
+        Truy vấn NHIỀU bbox cùng lúc (VD: bbox của mọi cạnh trong hành lang).
+        Input: mảng (E, 4) các bbox (min_lng, min_lat, max_lng, max_lat)
+        Output: 2 mảng (rows, items) - các cặp (vị trí bbox, index item) có BBox giao nhau,
+                không trùng lặp (rows tăng dần, items trong cùng 1 row KHÔNG nhất thiết có thứ tự).
+        """
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        if len(self.items) == 0 or len(bboxes) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        ext = self.extent
+        clipped = np.column_stack((np.maximum(bboxes[:, 0], ext[0]), np.maximum(bboxes[:, 1], ext[1]),
+                                   np.minimum(bboxes[:, 2], ext[2]), np.minimum(bboxes[:, 3], ext[3])))
+        query, cx, cy = self._cover(clipped)
+        keys = cx * _CELL_KEY_STRIDE + cy
+        lo = np.searchsorted(self.cell_keys, keys, side='left')
+        n = np.searchsorted(self.cell_keys, keys, side='right') - lo
+        rows = np.repeat(query, n)
+        cx, cy = np.repeat(cx, n), np.repeat(cy, n)
+        items = self.cell_items[np.repeat(lo - (np.cumsum(n) - n), n) + np.arange(n.sum())]
+
+        # Lọc chính xác bằng BBox (ô lưới chỉ là lọc thô).
+        # Chống trùng: 1 cặp chỉ được tính ở ô chứa góc dưới-trái của phần giao 2 bbox.
+        b, h = bboxes[rows], self.bounds[items]
+        keep = ((b[:, 0] <= h[:, 2]) & (h[:, 0] <= b[:, 2]) & (b[:, 1] <= h[:, 3]) & (h[:, 1] <= b[:, 3]) &
+                (self._cell(np.maximum(b[:, 0], h[:, 0])) == cx) & (self._cell(np.maximum(b[:, 1], h[:, 1])) == cy))
+        return rows[keep], items[keep]
 
     def intersection(self, bbox):
         """
@@ -397,26 +803,12 @@ class SimpleSpatialIndex:
         Input: bbox (min_x, min_y, max_x, max_y) <-> (min_lng, min_lat, max_lng, max_lat)
         Output: List các index (vị trí) của item trong danh sách gốc.
         """
-        min_lng, min_lat, max_lng, max_lat = bbox
-        found_indices = []
-        
-        # Buffer an toàn (khoảng 5km) để không bỏ sót các đám mây/bão nằm ở mép
-        buffer = 0.05 
-        
-        for i, item in enumerate(self.items):
-            i_lat = item.get('lat')
-            i_lng = item.get('lng')
-            
-            # Kiểm tra sơ bộ: Nếu item nằm trong vùng (hoặc gần vùng) bbox thì lấy
-            if (min_lat - buffer <= i_lat <= max_lat + buffer) and \
-               (min_lng - buffer <= i_lng <= max_lng + buffer):
-                found_indices.append(i)
-                
-        return found_indices
+        _, items = self.bulk_intersection([bbox])
+        return sorted(items.tolist())
 
 def create_spatial_index(items):
     """
     Hàm Factory để tạo Spatial Index từ danh sách (Disasters/Weather).
     Được gọi bởi core_logic.py.
     """
-    return SimpleSpatialIndex(items)
\ No newline at end of file
+    return HazardGridIndex(items)
\ No newline at end of file
@@ -0,0 +1,250 @@
+# file: tiles.py
+"""
+Tile bản đồ theo lưới Web Mercator chuẩn (z/x/y, giống OSM/Leaflet) cho các lớp môi trường
+và heatmap rủi ro từng cạnh đường.
+
+Mỗi tile là 1 GeoJSON FeatureCollection đã cắt sẵn theo ô:
+    - disasters / crowd : điểm có TÂM nằm trong tile
+    - weather           : vùng mưa có bán kính CHẠM tile (1 vùng có thể nằm ở nhiều tile, trùng 'id')
+    - risk              : cạnh đường có BBox chạm tile, kèm penalty tính bằng CÙNG hàm chấm điểm
+                          với _calculate_weights (RoutingEngine.score_edges)
+Tile cache trong RAM (LRU) và trên đĩa; khóa gồm dấu vân tay dữ liệu của hazard_store
+-> dữ liệu đổi thì khóa đổi, tile cũ tự bị bỏ qua (thư mục thế hệ cũ trên đĩa bị dọn).
+"""
+import hashlib
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import core_logic
+import hazard_store
+import response_cache
+import standardization
+import traffic
+
+TILE_LAYERS = ('disasters', 'weather', 'crowd', 'risk')
+TILE_MAX_ZOOM = 22
+
+# Heatmap rủi ro chỉ phục vụ từ mức zoom này (zoom nhỏ hơn: quá nhiều cạnh, trả tile rỗng)
+RISK_MIN_ZOOM = int(os.getenv("RISK_MIN_ZOOM", "13"))
+
+# Nới hộp cắt hành lang (độ) để lấy cả cạnh có 1 đầu mút nằm ngoài tile
+RISK_EDGE_PAD_DEG = 0.01
+
+# Thư mục cache tile trên đĩa ('' = chỉ cache trong RAM)
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tile_cache'))
+TILE_CACHE_MAX = int(os.getenv("TILE_CACHE_MAX", "4096"))
+
+# Thư mục con do cache tự tạo trong TILE_CACHE_DIR: chỉ dọn trong đây (TILE_CACHE_DIR có thể là thư mục dùng chung)
+TILE_CACHE_SUBDIR = 'safetyroute_tiles'
+
+# Tên thư mục thế hệ (_generation: 16 ký tự hex) - chỉ xóa thư mục đúng dạng này
+GENERATION_RE = re.compile(r'^[0-9a-f]{16}$')
+
+# Thế hệ cũ chỉ bị xóa khi không được dùng (ghi / chuyển sang) trong khoảng này:
+# nhiều worker có thể tạm thấy thế hệ khác nhau, không được xóa cây tile của nhau
+TILE_GC_GRACE_S = int(os.getenv("TILE_GC_GRACE_S", "600"))
+
+# Tile hazard sống ngắn (thread nền làm mới dữ liệu), tile risk gắn với khung 15 phút của crowd
+TILE_MAX_AGE_S = int(os.getenv("TILE_MAX_AGE_S", "60"))
+
+# Số chữ số thập phân của tọa độ trong GeoJSON (~1 m)
+COORD_DECIMALS = 5
+
+
+def tile_bbox(z, x, y):
+    """Ô (z, x, y) -> (south, west, north, east) theo độ."""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def valid_tile(layer, z, x, y):
+    return layer in TILE_LAYERS and 0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _point_feature(layer, i, item):
+    props = {k: v for k, v in item.items() if k not in ('lat', 'lng')}
+    props['id'] = f"{layer}-{i}"
+    return {"type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(item['lng'], COORD_DECIMALS),
+                                                          round(item['lat'], COORD_DECIMALS)]},
+            "properties": props}
+
+
+def render_hazard_tile(snap, layer, bbox):
+    """Tile của 1 lớp trong hazard_store (disasters / weather / crowd)."""
+    hl = snap.layers[layer]
+    south, west, north, east = bbox
+    if layer == 'weather':
+        idx = hl.index.intersection((west, south, east, north))
+    else:
+        cand = np.array(hl.index.intersection((west, south, east, north)), dtype=np.int64)
+        lat, lng = hl.lat[cand], hl.lng[cand]
+        # Biên trên/phải mở: điểm nằm đúng mép chung chỉ thuộc về 1 tile
+        idx = cand[(south <= lat) & (lat < north) & (west <= lng) & (lng < east)].tolist()
+    return {"type": "FeatureCollection",
+            "features": [_point_feature(layer, i, hl.items[i]) for i in idx]}
+
+
+def render_risk_tile(snap, bbox, curr_hour, vehicle_mode):
+    """
+    Heatmap rủi ro: các cạnh chạm tile + penalty của risk model (hệ số ưu tiên mặc định).
+    Thiên tai / thời tiết lấy theo BÁN KÍNH chạm vùng -> không bị đứt gãy ở mép tile.
+    """
+    empty = {"type": "FeatureCollection", "features": []}
+    net_type = core_logic.engine._net_type(vehicle_mode)
+    compact = traffic.load_compact_graph(net_type)
+    if compact is None:
+        return empty
+
+    south, west, north, east = bbox
+    pad = RISK_EDGE_PAD_DEG
+    corridor = traffic.load_corridor_index(net_type).corridor((south - pad, west - pad, north + pad, east + pad))
+    eb = compact.edge_bounds()[corridor.edges]
+    edges = corridor.edges[(eb[:, 0] <= east) & (west <= eb[:, 2]) & (eb[:, 1] <= north) & (south <= eb[:, 3])]
+    if len(edges) == 0:
+        return empty
+
+    ext = compact.edge_bounds()[edges]
+    box = (float(ext[:, 1].min()), float(ext[:, 0].min()), float(ext[:, 3].max()), float(ext[:, 2].max()))
+    env = {"disasters": snap.layers['disasters'].touching(box), "weather": snap.layers['weather'].touching(box)}
+    penalties, scores = core_logic.engine.score_edges(compact, edges, env, curr_hour, vehicle_mode, {})
+
+    features = []
+    for i, e in enumerate(edges.tolist()):
+        pts = np.round(np.asarray(compact.edge_points(e)), COORD_DECIMALS)   # (lon, lat)
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": pts.tolist()},
+            "properties": {"id": f"edge-{e}", "risk": round(float(penalties[i]), 4),
+                           "disaster": round(float(scores[i, 0]), 4), "weather": round(float(scores[i, 1]), 4),
+                           "crowd": round(float(scores[i, 2]), 4)},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class TileCache:
+    """
+    Cache tile 2 tầng: LRU trong RAM (response_cache) + file trên đĩa.
+    Trên đĩa: TILE_CACHE_DIR/TILE_CACHE_SUBDIR/<thế hệ>/<layer>/<z>/<x>/<y>[_<biến thể>].json,
+    thế hệ = dấu vân tay dữ liệu hazard_store. Sang thế hệ mới thì xóa các thư mục thế hệ cũ
+    (đúng dạng 16 hex, không được dùng trong TILE_GC_GRACE_S giây) - an toàn khi nhiều process dùng chung.
+    """
+    def __init__(self, cache_dir=TILE_CACHE_DIR, max_entries=TILE_CACHE_MAX):
+        self.cache_dir = os.path.join(cache_dir, TILE_CACHE_SUBDIR) if cache_dir else ''
+        self.memory = response_cache.ResponseCache(max_entries)
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _disk_path(self, generation, layer, z, x, y, variant):
+        name = f"{y}_{variant}.json" if variant else f"{y}.json"
+        return os.path.join(self.cache_dir, generation, layer, str(z), str(x), name)
+
+    def _switch_generation(self, generation):
+        """Dữ liệu đổi -> dọn tile cũ (RAM + đĩa)."""
+        with self._lock:
+            if generation == self._generation:
+                return
+            self._generation = generation
+            self.memory.clear()
+            if not self.cache_dir:
+                return
+            self._touch(generation)
+            try:
+                names = os.listdir(self.cache_dir)
+            except OSError:
+                return   # chưa có thư mục / process khác vừa xóa
+            now = time.time()
+            for name in names:
+                if name == generation or not GENERATION_RE.match(name):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    if now - os.path.getmtime(path) < TILE_GC_GRACE_S:
+                        continue   # worker khác còn đang dùng thế hệ này
+                except OSError:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _touch(self, generation):
+        """Đánh dấu thế hệ đang được dùng (mtime thư mục) để process khác không dọn mất."""
+        path = os.path.join(self.cache_dir, generation)
+        try:
+            os.makedirs(path, exist_ok=True)
+            os.utime(path)
+        except OSError:
+            pass
+
+    def get_or_render(self, generation, layer, z, x, y, variant, render):
+        """
+        Output: CachedBody của tile. `render()` chỉ được gọi khi cả RAM và đĩa đều chưa có.
+        """
+        if generation != self._generation:
+            self._switch_generation(generation)
+        key = (generation, layer, z, x, y, variant)
+        body = self.memory.get(key)
+        if body is not None:
+            return body
+
+        etag = response_cache.make_etag('tile', *key)
+        path = self._disk_path(generation, layer, z, x, y, variant) if self.cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    return self.memory.put(key, response_cache.CachedBody(etag, f.read(), 'application/geo+json'))
+            except OSError:
+                pass
+
+        raw = render()
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(raw)
+                os.replace(tmp, path)   # ghi nguyên tử: request khác không đọc phải file dở dang
+                self._touch(generation)
+            except OSError as e:
+                print(f"⚠️ [TILE] Không ghi được cache đĩa ({e})")
+        return self.memory.put(key, response_cache.CachedBody(etag, raw, 'application/geo+json'))
+
+
+TILE_CACHE = TileCache()
+
+
+def _generation(snap):
+    """Thế hệ dữ liệu: đổi khi bất kỳ lớp nào của hazard_store đổi nội dung."""
+    return hashlib.sha1('|'.join(snap.digests).encode('utf-8')).hexdigest()[:16]
+
+
+def get_tile(layer, z, x, y, dumps, vehicle_mode='motorbike', now=None):
+    """
+    Tile (z, x, y) của `layer` dạng CachedBody. `dumps`: hàm obj -> str JSON (app.json.dumps).
+    Tile risk còn phụ thuộc khung giờ 15 phút (điểm đám đông) và phương tiện (phạt xe lớn vào hẻm).
+    """
+    snap = hazard_store.STORE.snapshot()
+    bbox = tile_bbox(z, x, y)
+    if layer != 'risk':
+        return TILE_CACHE.get_or_render(_generation(snap), layer, z, x, y, '',
+                                        lambda: dumps(render_hazard_tile(snap, layer, bbox)).encode('utf-8'))
+
+    now = now or datetime.now()
+    slot = int((now.hour + now.minute / 60) * standardization.CROWD_SLOTS_PER_HOUR) % standardization.CROWD_SLOTS
+    variant = f"{vehicle_mode}_{slot}"
+    if z < RISK_MIN_ZOOM:
+        return TILE_CACHE.get_or_render(_generation(snap), layer, z, x, y, variant,
+                                        lambda: dumps({"type": "FeatureCollection", "features": []}).encode('utf-8'))
+    # Giữa khung giờ: đại diện cho cả 15 phút (đúng mốc đầu khung dùng bảng at_start riêng)
+    slot_hour = (slot + 0.5) / standardization.CROWD_SLOTS_PER_HOUR
+    return TILE_CACHE.get_or_render(_generation(snap), layer, z, x, y, variant,
+                                    lambda: dumps(render_risk_tile(snap, bbox, slot_hour, vehicle_mode)).encode('utf-8'))
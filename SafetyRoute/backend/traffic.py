@@ -1,5 +1,11 @@
-import osmnx as ox
 import os
+import threading
+import cch
+import graph_engine
+import graph_snapshot
+import landmarks
+import spatial_index
+import standardization
 
 # Cấu hình tên file cache cho từng chế độ
 GRAPH_FILES = {
@@ -13,8 +19,29 @@ SYSTEM_GRAPHS = {
     "walk": None
 }
 
+# Bản nén dạng mảng (CSR) của SYSTEM_GRAPHS - dựng 1 lần khi load
+COMPACT_GRAPHS = {
+    "drive": None,
+    "walk": None
+}
+
+# Chỉ mục bám điểm (KD-tree) trên node/cạnh của từng bản đồ
+SNAP_INDEXES = {
+    "drive": None,
+    "walk": None
+}
+
+# Lưới đều trên node để cắt hành lang (Corridor) theo BBox không cần copy
+CORRIDOR_INDEXES = {
+    "drive": None,
+    "walk": None
+}
+
 PLACE_NAME = "Ho Chi Minh City, Vietnam"
 
+# Khóa nạp bản đồ: nhiều thread (request) cùng gọi lúc khởi động thì chỉ 1 thread được load
+_LOAD_LOCK = threading.Lock()
+
 def load_graph_by_mode(mode="walk"):
     """
     Tải bản đồ theo chế độ (drive/walk).
@@ -26,12 +53,25 @@ def load_graph_by_mode(mode="walk"):
     if SYSTEM_GRAPHS[mode] is not None:
         return SYSTEM_GRAPHS[mode]
 
+    with _LOAD_LOCK:
+        # Thread khác vừa load xong trong lúc mình chờ khóa
+        if SYSTEM_GRAPHS[mode] is not None:
+            return SYSTEM_GRAPHS[mode]
+        return _load_graph(mode, filename)
+
+def _load_graph(mode, filename):
+    """
+    Đọc bản đồ từ file hoặc tải mới từ OSM (gọi khi đang giữ _LOAD_LOCK).
+    """
+    # Import muộn: osmnx kéo theo geopandas... rất nặng, worker chạy bằng snapshot không cần
+    import osmnx as ox
+
     # 2. Nếu chưa có trong RAM, kiểm tra file trên đĩa
     if os.path.exists(filename):
         print(f"📂 [CACHE] Đang tải bản đồ '{mode}' từ file '{filename}'...")
         try:
             G = ox.load_graphml(filename)
-            SYSTEM_GRAPHS[mode] = G
+            _register_graph(mode, G)
             return G
         except Exception as e:
             print(f"⚠️ File lỗi, tải lại từ đầu... ({e})")
@@ -48,22 +88,86 @@ def load_graph_by_mode(mode="walk"):
         ox.save_graphml(G, filepath=filename)
         
         # Lưu vào RAM
-        SYSTEM_GRAPHS[mode] = G
+        _register_graph(mode, G)
         return G
         
     except Exception as e:
         print(f"❌ Lỗi tải bản đồ: {e}")
         return None
 
+def _register_graph(mode, G):
+    """
+    Lưu đồ thị vào RAM và dựng luôn bản CSR tương ứng (nếu chưa có từ snapshot).
+    SYSTEM_GRAPHS được gán CUỐI CÙNG: thread khác thấy đồ thị thì các chỉ mục cũng đã sẵn sàng.
+    """
+    if COMPACT_GRAPHS[mode] is None:
+        try:
+            _register_compact(mode, graph_engine.build_compact_graph(G))
+        except Exception as e:
+            print(f"⚠️ Không dựng được CSR cho '{mode}' ({e}).")
+    SYSTEM_GRAPHS[mode] = G
+
+def _register_compact(mode, compact):
+    """
+    Dựng các chỉ mục trên bản CSR rồi mới công bố COMPACT_GRAPHS.
+    """
+    compact.segments()  # trải phẳng hình học cạnh 1 lần cho kernel thiên tai/thời tiết
+    compact.base_speed = standardization.base_speed_array(compact)  # maxspeed + heuristic loại đường
+    compact.crowd = standardization.build_crowd_tensor(compact)     # điểm đám đông cạnh x 96 khung giờ
+    compact.cch = cch.load_cch(compact)                             # CCH dựng offline (chỉ có khi nạp snapshot)
+    compact.landmarks = landmarks.load_landmarks(compact)           # bảng ALT dựng offline (như trên)
+    SNAP_INDEXES[mode] = spatial_index.build_snap_index(compact)
+    CORRIDOR_INDEXES[mode] = spatial_index.build_grid_index(compact)
+    COMPACT_GRAPHS[mode] = compact
+    print(f"🧱 [CSR] Đã nạp bản đồ '{mode}': {compact.num_nodes} node, {compact.num_edges} cạnh")
+
+def load_compact_graph(mode="walk"):
+    """
+    Lấy bản CSR của đồ thị.
+    Ưu tiên snapshot nhị phân (mmap, không cần parse XML), thiếu/cũ thì quay về GraphML.
+    """
+    if COMPACT_GRAPHS.get(mode) is not None:
+        return COMPACT_GRAPHS[mode]
+
+    with _LOAD_LOCK:
+        if COMPACT_GRAPHS.get(mode) is not None:
+            return COMPACT_GRAPHS[mode]
+        filename = GRAPH_FILES.get(mode, "hcm_map_drive.graphml")
+        compact = graph_snapshot.load_snapshot(filename)
+        if compact is not None:
+            print(f"⚡ [SNAPSHOT] Đã mmap bản đồ '{mode}' từ '{graph_snapshot.snapshot_dir(filename)}'")
+            _register_compact(mode, compact)
+            return compact
+
+    # Không có snapshot -> đọc GraphML (tự dựng CSR trong _register_graph)
+    load_graph_by_mode(mode)
+    return COMPACT_GRAPHS.get(mode)
+
+def load_snap_index(mode="walk"):
+    """
+    Lấy chỉ mục bám điểm của bản đồ (tự load đồ thị nếu chưa có).
+    """
+    if SNAP_INDEXES.get(mode) is None:
+        load_compact_graph(mode)
+    return SNAP_INDEXES.get(mode)
+
+def load_corridor_index(mode="walk"):
+    """
+    Lấy lưới cắt hành lang của bản đồ (tự load đồ thị nếu chưa có).
+    """
+    if CORRIDOR_INDEXES.get(mode) is None:
+        load_compact_graph(mode)
+    return CORRIDOR_INDEXES.get(mode)
+
 def preload_maps():
     """
     Gọi khi khởi động Server để load trước vào RAM.
     """
     print("🚀 Đang khởi động hệ thống bản đồ Đa phương tiện...")
-    # Load trước bản đồ Drive (thường dùng nhất)
-    load_graph_by_mode("drive")
+    # Load trước bản đồ Drive (thường dùng nhất) - ưu tiên snapshot nhị phân
+    load_compact_graph("drive")
     # Bản đồ Walk có thể load sau hoặc load luôn tùy RAM server
-    # load_graph_by_mode("walk") 
+    # load_compact_graph("walk") 
     print("✅ Đã sẵn sàng phục vụ!")
 
 # Tự động chạy preload khi import (nếu cần)
@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 import pickle
+import forest_model
 
 def generate_risk_data(n_samples=5000):
     print(f"🎲 Đang sinh {n_samples} dữ liệu mẫu về rủi ro đường đi...")
@@ -66,6 +67,8 @@ def train():
     
     with open('risk_model.pkl', 'wb') as f:
         pickle.dump(model, f)
+    # Bản phẳng .npz cho lúc chạy (không cần sklearn)
+    forest_model.export_forest(model, 'risk_model.npz', source_path='risk_model.pkl')
         
     print("✅ Đã tạo xong 'risk_model.pkl'. Sẵn sàng tích hợp!")
 
@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 import pickle
+import forest_model
 import os
 
 def generate_dummy_data(n_samples=5000):
@@ -71,6 +72,8 @@ def train_model():
     filename = 'traffic_model.pkl'
     with open(filename, 'wb') as f:
         pickle.dump(model, f)
+    # Bản phẳng .npz cho lúc chạy (không cần sklearn)
+    forest_model.export_forest(model, 'traffic_model.npz', source_path=filename)
         
     print(f"✅ Đã train xong! Model được lưu tại: {filename}")
     print("Test thử dự đoán:")
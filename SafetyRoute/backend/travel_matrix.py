@@ -0,0 +1,135 @@
+# file: travel_matrix.py
+"""
+Ma trận N x M thời gian đi (eta) và rủi ro giữa nhiều điểm (VD khách sạn x điểm tham quan của crowd_zones.json).
+
+Gọi /api/find-routes N x M lần thì mỗi ô phải bám điểm, quét môi trường, chấm điểm cạnh và tìm đường riêng.
+Ở đây:
+    - Mỗi điểm đi chạy ĐÚNG 1 lần Dijkstra 1-tới-nhiều trên CompactGraph (cùng trọng số final_weight
+      = eta * (1 + penalty) với get_optimal_routes), dừng khi đã chốt mọi điểm đến.
+    - Dọc theo cây đường ngắn nhất cộng dồn luôn 2 đại lượng như _audit_route: eta (giây) và
+      penalty * chiều dài -> 1 lần tìm cho ra cả 1 hàng của 2 ma trận.
+    - Điểm đi trùng node dùng lại hàng đã tính.
+Không dùng kiểu "bucket" many-to-many: bucket chỉ có lợi khi mỗi lần tìm bị chặn bán kính nhỏ
+(Contraction Hierarchies); với Dijkstra thường, cây ngược từ mỗi điểm đến đã tốn bằng 1 hàng.
+"""
+import heapq
+from collections import namedtuple
+
+import numpy as np
+
+import graph_engine
+
+INF = graph_engine.INF
+
+# eta, risk: float32 (N, M), inf = không tới được; settled: tổng số node đã chốt (công sức tìm)
+MatrixResult = namedtuple('MatrixResult', ['eta', 'risk', 'settled'])
+
+
+def _row(graph, source, goal_of, num_goals, w, expand, eta, risk):
+    """1 lần Dijkstra từ `source`: (hàng eta, hàng risk, số node đã chốt)."""
+    offsets, targets = graph.adjacency()
+    eta_row = np.full(num_goals, np.inf, dtype=np.float32)
+    risk_row = np.full(num_goals, np.inf, dtype=np.float32)
+    remaining = len(goal_of)
+
+    dist = {source: 0.0}
+    acc = {source: (0.0, 0.0)}   # (eta, risk) cộng dồn theo đường có final_weight nhỏ nhất
+    heap = [(0.0, source)]
+    done = set()
+    push, pop = heapq.heappush, heapq.heappop
+    while heap and remaining:
+        d, u = pop(heap)
+        if u in done: continue
+        done.add(u)
+        a, r = acc[u]
+        if u in goal_of:
+            eta_row[goal_of[u]] = a
+            risk_row[goal_of[u]] = r
+            remaining -= 1
+
+        if expand is not None: expand(u, heap)
+        for e in range(offsets[u], offsets[u + 1]):
+            we = w[e]
+            if we == INF: continue
+            v = targets[e]
+            nd = d + we
+            if nd < dist.get(v, INF):
+                dist[v] = nd
+                acc[v] = (a + eta[e], r + risk[e])
+                push(heap, (nd, v))
+    return eta_row, risk_row, len(done)
+
+
+def matrix_rows(graph, sources, targets, weights, eta, risk):
+    """
+    Sinh lần lượt từng hàng (để stream): (i, hàng eta float32 (M), hàng risk float32 (M), số node đã chốt).
+    Input:
+        - sources, targets: list id node
+        - weights: trọng số tìm đường (mảng / overlay lười, graph_engine.weight_lists)
+        - eta, risk: list chi phí theo edge id (WeightOverlay.criteria())
+    """
+    w, expand, _ = graph_engine.weight_lists(weights)
+    goal_of = {}
+    for j, t in enumerate(targets):
+        goal_of.setdefault(int(t), []).append(j)
+    goal_of = {t: np.array(js) for t, js in goal_of.items()}
+
+    rows = {}
+    for i, s in enumerate(sources):
+        s = int(s)
+        if s in rows:
+            yield (i,) + rows[s][:2] + (0,)
+            continue
+        rows[s] = _row(graph, s, goal_of, len(targets), w, expand, eta, risk)
+        yield (i,) + rows[s]
+
+
+def travel_matrix(graph, sources, targets, weights, eta, risk):
+    """Ma trận đầy đủ (dạng thư viện). Output: MatrixResult."""
+    eta_mat = np.full((len(sources), len(targets)), np.inf, dtype=np.float32)
+    risk_mat = np.full((len(sources), len(targets)), np.inf, dtype=np.float32)
+    settled = 0
+    for i, eta_row, risk_row, n in matrix_rows(graph, sources, targets, weights, eta, risk):
+        eta_mat[i] = eta_row
+        risk_mat[i] = risk_row
+        settled += n
+    return MatrixResult(eta_mat, risk_mat, settled)
+
+
+if __name__ == '__main__':
+    # Đối chiếu với tìm đường từng cặp: python travel_matrix.py [file.graphml]
+    import sys
+    import time
+
+    import benchmark
+    import landmarks
+    import standardization
+
+    g = benchmark.load_bench_graph(sys.argv[1] if len(sys.argv) > 1 else 'hcm_map_drive.graphml')
+    rng = np.random.default_rng(0)
+    eta_arr = landmarks.free_flow_weights(g, standardization.base_speed_array(g)) * rng.uniform(1.0, 2.0, g.num_edges)
+    penalty = np.where(rng.random(g.num_edges) < 0.2, rng.uniform(0, 3, g.num_edges), 0.0)
+    weights = eta_arr * (1 + penalty)
+    risk_arr = penalty * np.asarray(g.length)
+
+    srcs = rng.integers(0, g.num_nodes, 20).tolist()
+    dsts = rng.integers(0, g.num_nodes, 50).tolist()
+    t0 = time.perf_counter()
+    res = travel_matrix(g, srcs, dsts, weights, eta_arr.tolist(), risk_arr.tolist())
+    t_mat = time.perf_counter() - t0
+
+    ok = True
+    t0 = time.perf_counter()
+    for i, s in enumerate(srcs):
+        for j, t in enumerate(dsts):
+            ref = graph_engine.shortest_path(g, s, t, weights)
+            if ref is None:
+                ok = ok and not np.isfinite(res.eta[i, j])
+                continue
+            ok = ok and np.isclose(res.eta[i, j], eta_arr[ref.edges].sum(), rtol=1e-5, atol=1e-3)
+            ok = ok and np.isclose(res.risk[i, j], risk_arr[ref.edges].sum(), rtol=1e-5, atol=1e-3)
+    t_ref = time.perf_counter() - t0
+    print(f"🧮 Ma trận {len(srcs)}x{len(dsts)}: {t_mat * 1000:.1f} ms (chốt {res.settled})"
+          f" | từng cặp {t_ref * 1000:.1f} ms | khớp: {ok}")
+    if not ok:
+        sys.exit(1)
@@ -3,9 +3,32 @@ import numpy as np
 import os
 import json
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 DEMO_MODE = False  # <--- CÔNG TẮC: True = Đọc file json, False = Quét API thật
 
+# Địa chỉ API Open-Meteo (đổi được qua biến môi trường, VD trỏ về server giả lập khi kiểm thử)
+OPEN_METEO_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+
+# --- TẦNG FETCH (pool kết nối + song song + gộp nhiều tọa độ + cache theo ô lưới) ---
+WEATHER_POOL_SIZE = int(os.getenv("WEATHER_POOL_SIZE", "8"))      # Số kết nối / luồng song song
+WEATHER_BATCH_SIZE = int(os.getenv("WEATHER_BATCH_SIZE", "50"))   # Số tọa độ tối đa trong 1 lần gọi Open-Meteo
+WEATHER_CELL_DEG = float(os.getenv("WEATHER_CELL_DEG", "0.02"))   # Ô lưới cache (~2.2 km)
+WEATHER_CACHE_TTL_S = float(os.getenv("WEATHER_CACHE_TTL_S", "600"))
+WEATHER_TIMEOUT_S = 3
+
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=WEATHER_POOL_SIZE))
+_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=WEATHER_POOL_SIZE))
+_EXECUTOR = ThreadPoolExecutor(max_workers=WEATHER_POOL_SIZE, thread_name_prefix="weather")
+
+# Cache: (ô lat, ô lon) -> (hết hạn lúc, condition, wind_speed)
+WEATHER_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
 def get_weather_zones(bbox):
     """
     Hàm duy nhất lấy dữ liệu thời tiết (Mưa/Gió).
@@ -47,43 +70,104 @@ def get_weather_zones(bbox):
 
     # --- CASE 2: CHẠY REAL (Quét lưới Open-Meteo) ---
     else:
-        # 1. Tạo lưới quét
+        # 1. Tạo lưới quét, lấy thời tiết cả 9 điểm 1 lượt (song song + cache)
         lat_steps = np.linspace(south, north, 3)
         lon_steps = np.linspace(west, east, 3)
+        points = [(lat, lon) for lat in lat_steps for lon in lon_steps]
+        results = fetch_weather_points(points)
 
-        for lat in lat_steps:
-            for lon in lon_steps:
-                # Gọi hàm helper bên dưới
-                cond, wind = _fetch_open_meteo(lat, lon)
-                
-                # Logic lọc xấu
-                is_bad = False
-                radius = base_radius
-                if cond in ["Rain", "Thunderstorm", "Drizzle", "Fog"]:
-                    is_bad = True
-                    if cond == "Thunderstorm": radius = 4.0
-                if wind >= 10.0: is_bad = True
-
-                if is_bad:
-                    zones.append({
-                        "lat": lat, "lng": lon, "radius": round(radius,2),
-                        "condition": cond, "wind_speed": wind,
-                        "description": f"Realtime: {cond}, Gió: {wind}m/s"
-                    })
+        for (lat, lon), (cond, wind) in zip(points, results):
+            # Logic lọc xấu
+            is_bad = False
+            radius = base_radius
+            if cond in ["Rain", "Thunderstorm", "Drizzle", "Fog"]:
+                is_bad = True
+                if cond == "Thunderstorm": radius = 4.0
+            if wind >= 10.0: is_bad = True
+
+            if is_bad:
+                zones.append({
+                    "lat": lat, "lng": lon, "radius": round(radius,2),
+                    "condition": cond, "wind_speed": wind,
+                    "description": f"Realtime: {cond}, Gió: {wind}m/s"
+                })
     
     return zones
 
+def get_weather_zones_many(bboxes):
+    """
+    get_weather_zones cho nhiều hộp (VD các ô của hazard_store): lấy thời tiết của MỌI điểm lưới
+    trong 1 lượt song song trước, sau đó từng hộp chỉ đọc cache.
+    """
+    if not DEMO_MODE:
+        points = []
+        for south, west, north, east in bboxes:
+            points.extend((lat, lon) for lat in np.linspace(south, north, 3) for lon in np.linspace(west, east, 3))
+        fetch_weather_points(points)
+    return [get_weather_zones(bbox) for bbox in bboxes]
+
 # --- HÀM HỖ TRỢ (PRIVATE) ---
-def _fetch_open_meteo(lat, lon):
+def _cell_of(lat, lon):
+    """Ô lưới cache của 1 tọa độ."""
+    return (int(round(lat / WEATHER_CELL_DEG)), int(round(lon / WEATHER_CELL_DEG)))
+
+def _fetch_batch(cells):
+    """
+    1 lần gọi Open-Meteo cho nhiều ô (API nhận danh sách latitude/longitude cách nhau dấu phẩy).
+    Output: dict {ô: (condition, wind)} - ô lỗi thì không có trong dict.
+    """
+    lats = ",".join(f"{c[0] * WEATHER_CELL_DEG:.4f}" for c in cells)
+    lons = ",".join(f"{c[1] * WEATHER_CELL_DEG:.4f}" for c in cells)
+    params = {"latitude": lats, "longitude": lons, "current_weather": "true", "windspeed_unit": "ms"}
     try:
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {"latitude": lat, "longitude": lon, "current_weather": "true", "windspeed_unit": "ms"}
-        resp = requests.get(url, params=params, timeout=3)
-        if resp.status_code == 200:
-            curr = resp.json().get('current_weather', {})
-            return _wmo_to_str(curr.get('weathercode', 0)), curr.get('windspeed', 0.0)
-    except: pass
-    return "Clear", 0.0
+        resp = _SESSION.get(OPEN_METEO_URL, params=params, timeout=WEATHER_TIMEOUT_S)
+        if resp.status_code != 200:
+            return {}
+        data = resp.json()
+        items = data if isinstance(data, list) else [data]   # 1 tọa độ -> API trả object, nhiều -> list
+        out = {}
+        for cell, item in zip(cells, items):
+            curr = item.get('current_weather', {})
+            out[cell] = (_wmo_to_str(curr.get('weathercode', 0)), curr.get('windspeed', 0.0))
+        return out
+    except: return {}
+
+def fetch_weather_points(points):
+    """
+    Lấy (condition, wind_speed) cho nhiều tọa độ:
+        - Tọa độ được gom về ô lưới WEATHER_CELL_DEG -> các bbox chồng nhau (nhiều user) dùng chung ô.
+        - Ô còn hạn trong cache thì không gọi API.
+        - Ô thiếu: chia lô WEATHER_BATCH_SIZE, các lô gửi SONG SONG qua pool kết nối dùng chung.
+    Lỗi mạng -> ("Clear", 0.0) như trước (và không ghi vào cache).
+    """
+    now = time.time()
+    cells = [_cell_of(lat, lon) for lat, lon in points]
+    result = {}
+    with _CACHE_LOCK:
+        for cell in set(cells):
+            hit = WEATHER_CACHE.get(cell)
+            if hit and hit[0] > now:
+                result[cell] = (hit[1], hit[2])
+
+    missing = sorted(set(cells) - set(result))
+    if missing:
+        batches = [missing[i:i + WEATHER_BATCH_SIZE] for i in range(0, len(missing), WEATHER_BATCH_SIZE)]
+        fetched = {}
+        for part in _EXECUTOR.map(_fetch_batch, batches):
+            fetched.update(part)
+        with _CACHE_LOCK:
+            expires = time.time() + WEATHER_CACHE_TTL_S
+            for cell, (cond, wind) in fetched.items():
+                WEATHER_CACHE[cell] = (expires, cond, wind)
+            # Dọn ô hết hạn để cache không phình mãi
+            for cell in [c for c, v in WEATHER_CACHE.items() if v[0] <= now]:
+                del WEATHER_CACHE[cell]
+        result.update(fetched)
+
+    return [result.get(cell, ("Clear", 0.0)) for cell in cells]
+
+def _fetch_open_meteo(lat, lon):
+    return fetch_weather_points([(lat, lon)])[0]
 
 def _wmo_to_str(code):
     if code in [51, 53, 55, 56, 57]: return "Drizzle"
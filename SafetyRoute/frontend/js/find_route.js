@@ -3,6 +3,7 @@ let riskLayers = L.layerGroup(); // Layer chứa các vòng tròn rủi ro (Minh
 let startMarker = null;
 let endMarker = null;
 const API_URL = "http://127.0.0.1:5000/api/find-routes";
+const REWEIGHT_URL = "http://127.0.0.1:5000/api/find-routes/reweight";
 
 // Đảm bảo map đã load xong mới add layer
 if (typeof map !== 'undefined') {
@@ -13,6 +14,52 @@ if (typeof map !== 'undefined') {
     });
 }
 
+// Đọc hệ số ưu tiên từ các thanh trượt
+function readPreferences() {
+    return {
+        traffic: 1.0,
+        weather: parseFloat(document.getElementById("pref-weather").value || 1.0),
+        crowd: parseFloat(document.getElementById("pref-crowd").value || 1.0),
+        disaster: 1.0
+    };
+}
+
+// Vẽ kết quả tìm đường (dùng chung cho tìm mới và re-weight)
+function renderRoutes(data, start, end, statusArea) {
+    window.currentRouteData = data; 
+
+    // 3. XỬ LÝ BẢN ĐỒ
+    clearMapLayers(); // Xóa đường cũ & rủi ro cũ
+    drawMarkers(start, end);
+
+    // A. VẼ MINH CHỨNG RỦI RO (QUAN TRỌNG)
+    // Dữ liệu này đã được Backend cắt (clip) theo BBox -> Không bị full graph
+    if (data.map_data) {
+        drawRiskEvidence(data.map_data);
+    }
+
+    // B. VẼ ĐƯỜNG PHỤ
+    if (data.alternatives && data.alternatives.length > 0) {
+        data.alternatives.forEach((altRoute, index) => {
+            drawSingleRoute(altRoute, "alternative", `Đường phụ ${index + 1}`);
+        });
+    }
+
+    // C. VẼ ĐƯỜNG CHÍNH
+    // Clone object để tránh tham chiếu vòng
+    const mainRouteObj = { ...data, geometry: data.geometry }; 
+    drawSingleRoute(mainRouteObj, "main", data.summary.description);
+
+    // Zoom vừa vặn với tất cả các đường
+    if (routeLayers.length > 0) {
+        const group = new L.featureGroup(routeLayers);
+        map.fitBounds(group.getBounds(), { padding: [50, 50] });
+    }
+
+    // Hiển thị thông tin
+    displayRouteInfo(data, statusArea, "CHÍNH (Tốt nhất)");
+}
+
 document.getElementById("searchBtn").addEventListener("click", async () => {
   const startInput = document.getElementById("startPoint");
   const endInput = document.getElementById("endPoint");
@@ -33,19 +80,12 @@ document.getElementById("searchBtn").addEventListener("click", async () => {
   try {
     // 1. CHUẨN BỊ PAYLOAD
     const modeSelect = document.getElementById("vehicleMode").value;
-    const prefWeather = parseFloat(document.getElementById("pref-weather").value || 1.0);
-    const prefCrowd = parseFloat(document.getElementById("pref-crowd").value || 1.0);
 
     const payload = {
       start: [parseFloat(startLat), parseFloat(startLon)],
       end: [parseFloat(endLat), parseFloat(endLon)],
       mode: modeSelect,
-      preferences: {
-          traffic: 1.0,
-          weather: prefWeather,
-          crowd: prefCrowd, 
-          disaster: 1.0
-      }
+      preferences: readPreferences()
     };
 
     // 2. GỌI API
@@ -58,43 +98,50 @@ document.getElementById("searchBtn").addEventListener("click", async () => {
 
     if (data.status === "error") throw new Error(data.message);
 
-    window.currentRouteData = data; 
+    // Ghi nhớ chuyến đi của phiên (token data.session) để kéo thanh trượt chỉ cần re-weight
+    window.currentRouteTrip = { start: [startLat, startLon], end: [endLat, endLon], mode: modeSelect };
+    renderRoutes(data, [startLat, startLon], [endLat, endLon], statusArea);
 
-    // 3. XỬ LÝ BẢN ĐỒ
-    clearMapLayers(); // Xóa đường cũ & rủi ro cũ
-    drawMarkers([startLat, startLon], [endLat, endLon]);
+  } catch (error) {
+    console.error(error);
+    statusArea.innerHTML = `<div class="status-box error">❌ ${error.message}</div>`;
+  }
+});
 
-    // A. VẼ MINH CHỨNG RỦI RO (QUAN TRỌNG)
-    // Dữ liệu này đã được Backend cắt (clip) theo BBox -> Không bị full graph
-    if (data.map_data) {
-        drawRiskEvidence(data.map_data);
-    }
+// --- KÉO THANH TRƯỢT ƯU TIÊN: TÌM LẠI NHANH TRÊN PHIÊN ĐÃ CÓ ---
+async function reweightRoutes() {
+  const current = window.currentRouteData;
+  const trip = window.currentRouteTrip;
+  if (!current || !current.session || !trip) return; // Chưa tìm đường lần nào
 
-    // B. VẼ ĐƯỜNG PHỤ
-    if (data.alternatives && data.alternatives.length > 0) {
-        data.alternatives.forEach((altRoute, index) => {
-            drawSingleRoute(altRoute, "alternative", `Đường phụ ${index + 1}`);
-        });
-    }
+  // Đổi phương tiện thì phải tìm lại từ đầu (phiên gắn với phương tiện)
+  if (document.getElementById("vehicleMode").value !== trip.mode) return;
 
-    // C. VẼ ĐƯỜNG CHÍNH
-    // Clone object để tránh tham chiếu vòng
-    const mainRouteObj = { ...data, geometry: data.geometry }; 
-    drawSingleRoute(mainRouteObj, "main", data.summary.description);
-
-    // Zoom vừa vặn với tất cả các đường
-    if (routeLayers.length > 0) {
-        const group = new L.featureGroup(routeLayers);
-        map.fitBounds(group.getBounds(), { padding: [50, 50] });
+  const statusArea = document.getElementById("status-area");
+  statusArea.innerHTML = `<div class="status-box loading">⏳ Đang cập nhật theo mức ưu tiên mới...</div>`;
+  try {
+    const response = await fetch(REWEIGHT_URL, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ session: current.session, preferences: readPreferences() })
+    });
+    if (response.status === 404) {
+      // Phiên hết hạn -> tìm lại đầy đủ
+      document.getElementById("searchBtn").click();
+      return;
     }
-
-    // Hiển thị thông tin
-    displayRouteInfo(data, statusArea, "CHÍNH (Tốt nhất)");
-
+    const data = await response.json();
+    if (data.status === "error") throw new Error(data.message);
+    renderRoutes(data, trip.start, trip.end, statusArea);
   } catch (error) {
     console.error(error);
     statusArea.innerHTML = `<div class="status-box error">❌ ${error.message}</div>`;
   }
+}
+
+["pref-weather", "pref-crowd"].forEach(id => {
+    const slider = document.getElementById(id);
+    if (slider) slider.addEventListener("change", reweightRoutes);
 });
 
 // --- HÀM VẼ MINH CHỨNG RỦI RO (Weather, Disaster, Crowd) ---